@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import logging
+import threading
+
+from tracing import tracing
+
+
+# Logger configuration
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+# Stats of the run are written here at exit so that CI can check the number of calls, empty value turns it off
+apiStatsFile = os.environ.get('CLOUD_DEV_API_STATS_FILE', os.path.expanduser('~/.cache/cloud-dev/api-stats.json'))
+
+# Upper bound in milliseconds of every latency bucket, the last bucket holds everything slower
+latencyBucketsMs = [10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000]
+
+# Error codes with which AWS services report throttling
+throttleErrorCodes = {
+    'Throttling',
+    'ThrottlingException',
+    'ThrottledException',
+    'RequestThrottledException',
+    'TooManyRequestsException',
+    'ProvisionedThroughputExceededException',
+    'RequestLimitExceeded',
+    'BandwidthLimitExceeded',
+    'RequestThrottled',
+    'SlowDown',
+    'PriorRequestNotComplete',
+    'EC2ThrottledException'
+}
+
+# Stats by (service, operation) for the whole process
+operationStats = {}
+operationStatsLock = threading.Lock()
+
+
+# Method to note start of an API call, runs once per call before the first attempt
+def onBeforeCall(context: dict, **kwargs):
+    """_summary_
+
+    Args:
+        context (dict): Request context shared by all events of the call
+    """
+    context['apiStatsStartedAt'] = tracing.now()
+    context['apiStatsAttempts'] = 1
+    context['apiStatsThrottles'] = 0
+
+
+# Method to count attempts and throttling errors, runs after every attempt of a call
+def onNeedsRetry(request_dict: dict, attempts: int, response=None, **kwargs):
+    """_summary_
+
+    Args:
+        request_dict (dict): Request of the attempt, holds the request context
+        attempts (int): Attempts made so far
+        response (tuple): HTTP response and parsed response of the attempt, None if it raised
+    """
+    context = request_dict.get('context', {})
+    context['apiStatsAttempts'] = attempts
+    context['apiStatsRetryChecked'] = True
+    if response is None:
+        return
+    httpResponse, parsedResponse = response
+    if httpResponse.status_code == 429 or parsedResponse.get('Error', {}).get('Code') in throttleErrorCodes:
+        context['apiStatsThrottles'] = context.get('apiStatsThrottles', 0) + 1
+
+
+# Method to record a finished API call
+def recordCall(serviceName: str, operationName: str, context: dict, error: str = None):
+    """_summary_
+
+    Args:
+        serviceName (str): Name of the AWS service, eg: ecs, elbv2
+        operationName (str): Name of the API operation, eg: DescribeServices
+        context (dict): Request context of the call
+        error (str): Error code or exception with which the call failed
+    """
+    startedAt = context.pop('apiStatsStartedAt', None)
+    if startedAt is None:
+        return
+    endedAt = tracing.now()
+    seconds = endedAt - startedAt
+    attempts = context.get('apiStatsAttempts', 1)
+    throttles = context.get('apiStatsThrottles', 0)
+    tracing.recordSpan('{}.{}'.format(serviceName, operationName), startedAt, endedAt, 'aws', error=error, attempts=attempts, throttles=throttles)
+
+    bucket = next((index for index, limit in enumerate(latencyBucketsMs) if seconds * 1000 <= limit), len(latencyBucketsMs))
+    with operationStatsLock:
+        stats = operationStats.setdefault((serviceName, operationName), {
+            'calls': 0,
+            'errors': 0,
+            'retries': 0,
+            'throttles': 0,
+            'seconds': 0.0,
+            'maxSeconds': 0.0,
+            'histogram': [0] * (len(latencyBucketsMs) + 1)
+        })
+        stats['calls'] += 1
+        stats['errors'] += 1 if error else 0
+        stats['retries'] += attempts - 1
+        stats['throttles'] += throttles
+        stats['seconds'] += seconds
+        stats['maxSeconds'] = max(stats['maxSeconds'], seconds)
+        stats['histogram'][bucket] += 1
+
+
+# Method to record an API call which got a response, including error responses
+def onAfterCall(http_response, parsed: dict, model, context: dict, **kwargs):
+    """_summary_
+
+    Args:
+        http_response (object): HTTP response of the last attempt
+        parsed (dict): Parsed response of the last attempt
+        model (object): Operation model of the call
+        context (dict): Request context of the call
+    """
+    error = parsed.get('Error', {}).get('Code', 'HTTP{}'.format(http_response.status_code)) if http_response.status_code >= 300 else None
+    # Responses which did not go through the retry handler, eg: answered by botocore Stubber, are checked here
+    if error in throttleErrorCodes and not context.get('apiStatsRetryChecked'):
+        context['apiStatsThrottles'] = context.get('apiStatsThrottles', 0) + 1
+    recordCall(model.service_model.service_name, model.name, context, error)
+
+
+# Method to attach call accounting to a boto3 client
+def attachToClient(client):
+    """_summary_
+
+    Args:
+        client (object): boto3 client
+    """
+    serviceName = client.meta.service_model.service_name
+
+    # Call which raised, eg: connection error after all attempts, has no response
+    def onAfterCallError(exception: Exception, context: dict, event_name: str, **kwargs):
+        recordCall(serviceName, event_name.split('.')[-1], context, type(exception).__name__)
+
+    # Handlers of before-call can answer the call themselves, eg: botocore Stubber, hence this one has to run first
+    client.meta.events.register_first('before-call.*.*', onBeforeCall)
+    client.meta.events.register('needs-retry', onNeedsRetry)
+    client.meta.events.register('after-call', onAfterCall)
+    client.meta.events.register('after-call-error', onAfterCallError)
+
+
+# Method to forget all the calls recorded so far, eg: between runs of a benchmark
+def resetStats():
+    """_summary_
+    """
+    with operationStatsLock:
+        operationStats.clear()
+
+
+# Method to estimate a latency percentile from the histogram
+def getPercentileMs(stats: dict, percentile: float):
+    """_summary_
+
+    Args:
+        stats (dict): Stats of an operation
+        percentile (float): Percentile between 0 and 100
+
+    Returns:
+        _type_: Upper bound in milliseconds of the bucket holding the percentile, slowest call for the last bucket
+    """
+    target = stats['calls'] * percentile / 100
+    seen = 0
+    for index, count in enumerate(stats['histogram']):
+        seen += count
+        if count and seen >= target:
+            if index < len(latencyBucketsMs):
+                return min(latencyBucketsMs[index], stats['maxSeconds'] * 1000)
+            break
+    return stats['maxSeconds'] * 1000
+
+
+# Method to get stats of all the API calls made so far
+def getStats():
+    """_summary_
+
+    Returns:
+        _type_: Totals and stats of every operation, slowest operations first
+    """
+    with operationStatsLock:
+        snapshot = {key: dict(stats, histogram=list(stats['histogram'])) for key, stats in operationStats.items()}
+
+    operations = []
+    for (serviceName, operationName), stats in snapshot.items():
+        operations.append(dict(
+            stats,
+            service=serviceName,
+            operation=operationName,
+            p50Ms=round(getPercentileMs(stats, 50), 1),
+            p95Ms=round(getPercentileMs(stats, 95), 1),
+            maxMs=round(stats['maxSeconds'] * 1000, 1),
+            seconds=round(stats['seconds'], 3)
+        ))
+    operations.sort(key=lambda stats: stats['seconds'], reverse=True)
+
+    totals = {key: sum(stats[key] for stats in operations) for key in ('calls', 'errors', 'retries', 'throttles')}
+    totals['byService'] = {}
+    for stats in operations:
+        totals['byService'][stats['service']] = totals['byService'].get(stats['service'], 0) + stats['calls']
+    return {'totals': totals, 'latencyBucketsMs': latencyBucketsMs, 'operations': operations}
+
+
+# Method to print table of API calls and write it as JSON, main.py runs it at exit
+def writeSummary():
+    """_summary_
+
+    Returns:
+        _type_: Stats of the run or None if no API call was made
+    """
+    stats = getStats()
+    if not stats['operations']:
+        return None
+
+    header = '{:<16} {:<36} {:>6} {:>6} {:>7} {:>9} {:>8} {:>8} {:>8} {:>8}'
+    print(header.format('service', 'operation', 'calls', 'errors', 'retries', 'throttles', 'p50 ms', 'p95 ms', 'max ms', 'total s'))
+    for operation in stats['operations']:
+        print(header.format(operation['service'], operation['operation'], operation['calls'], operation['errors'], operation['retries'], operation['throttles'], operation['p50Ms'], operation['p95Ms'], operation['maxMs'], operation['seconds']))
+    totals = stats['totals']
+    print(header.format('total', '', totals['calls'], totals['errors'], totals['retries'], totals['throttles'], '', '', '', ''))
+
+    if apiStatsFile:
+        try:
+            os.makedirs(os.path.dirname(apiStatsFile) or '.', exist_ok=True)
+            with open(apiStatsFile, 'w') as statsFile:
+                json.dump(stats, statsFile, indent=2)
+            logger.info(" API call stats written to {}".format(apiStatsFile))
+        except OSError as e:
+            logger.error(" Unable to write API call stats {}".format(str(e)))
+    return stats
+
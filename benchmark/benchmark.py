@@ -0,0 +1,840 @@
+#!/usr/bin/env python3
+
+# Benchmark of create, update and delete of main.py against an in-memory AWS, docker, git and HTTP stand-in
+# Run from the root of the repo: python -m benchmark.benchmark --help
+
+import os
+import io
+import sys
+import copy
+import json
+import time
+import uuid
+import base64
+import shutil
+import logging
+import argparse
+import tempfile
+import importlib
+import statistics
+import threading
+from types import SimpleNamespace
+from contextlib import redirect_stdout
+from datetime import datetime, timedelta, timezone
+
+
+# Every file written by a run is kept in a scratch directory, these are read by the modules when they are imported
+benchmarkDir = tempfile.mkdtemp(prefix='cloud-dev-benchmark-')
+os.environ.update({
+    'AWS_ACCESS_KEY_ID': 'benchmark',
+    'AWS_SECRET_ACCESS_KEY': 'benchmark',
+    'CLOUD_DEV_STATE_DB': os.path.join(benchmarkDir, 'state.db'),
+    'CLOUD_DEV_ECR_TOKEN_CACHE': os.path.join(benchmarkDir, 'ecr-tokens.json'),
+    'CLOUD_DEV_GIT_MIRROR_DIR': os.path.join(benchmarkDir, 'mirrors'),
+    'CLOUD_DEV_TRACE_DIR': os.path.join(benchmarkDir, 'traces'),
+    'CLOUD_DEV_API_STATS_FILE': '',
+    'CLOUD_DEV_BUILD_CACHE': 'none',
+    'CLOUD_DEV_READINESS_TIMEOUT': '60',
+    'CLOUD_DEV_DEPLOYMENT_TIMEOUT': '60'
+})
+
+from botocore.awsrequest import AWSResponse
+
+from clientRegistry import clientRegistry
+from apiStats import apiStats
+from application import application
+from healthCheck import healthChecks
+from kibana import kibana
+from route53 import route53
+from loadBalancer import loadBalancer
+from service import ecsService
+from tracing import tracing
+
+
+# Logger configuration
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+# Settings of the environment being benchmarked, passed to main.py as arguments
+region = 'ap-south-1'
+accountId = '123456789012'
+hostedZoneId = 'ZBENCHMARK'
+domainNameOfHostedZone = 'dev.example.com'
+listenerARNs = {
+    'https': 'arn:aws:elasticloadbalancing:{}:{}:listener/app/benchmark/0123456789abcdef/https'.format(region, accountId),
+    'http': 'arn:aws:elasticloadbalancing:{}:{}:listener/app/benchmark/0123456789abcdef/http'.format(region, accountId)
+}
+sourceSecretName = 'benchmark-source-secret'
+mainArguments = [
+    'benchmark.user@example.com', 'benchapp', '8080', 'health', 'benchapp-repo', 'main', sourceSecretName, 'create', 'example',
+    'benchmark-cluster', region, accountId, hostedZoneId, 'benchmark-org', 'benchmark-task-role', 'benchmark-execution-role',
+    'es.example.com', 'elastic', 'elastic', 'vpc-benchmark', domainNameOfHostedZone, 'benchmark-alb.{}.elb.amazonaws.com'.format(region),
+    'ZP97RAFLXTNZK', listenerARNs['https'], listenerARNs['http'], 'subnet-benchmark', 'sg-benchmark', 'kibana.example.com'
+]
+
+# Seconds every fake call takes, the overhead pass sets all of them to 0
+simulatedSeconds = {'aws': 0, 'http': 0, 'clone': 0, 'build': 0, 'push': 0}
+
+# State of the fake AWS account, created again at the start of every pass
+fakeState = {}
+fakeStateLock = threading.RLock()
+
+
+# Method to get an error response of the fake AWS
+def awsError(code: str, message: str = ''):
+    return {'Error': {'Code': code, 'Message': message}}
+
+
+# Method to get tags as a dict from a list of Key/Value or key/value pairs
+def getTagDict(tags: list):
+    return {tag.get('Key', tag.get('key')): tag.get('Value', tag.get('value')) for tag in tags or []}
+
+
+# Method to create state of the fake AWS account with other environments already in the zone and listeners
+def newFakeState(zoneRecords: int, listenerRules: int):
+    """_summary_
+
+    Args:
+        zoneRecords (int): Records of other environments in the hosted zone
+        listenerRules (int): Rules of other environments in each listener
+
+    Returns:
+        _type_: State of the fake AWS account
+    """
+    state = {
+        'services': {},
+        'taskDefinitions': {},
+        'targetGroups': {},
+        'rules': {listenerARN: {} for listenerARN in listenerARNs.values()},
+        'records': {hostedZoneId: {}},
+        'repositories': {},
+        'secrets': {},
+        'tags': {},
+        'commits': [uuid.uuid4().hex + uuid.uuid4().hex[:8]]
+    }
+    for listenerARN in listenerARNs.values():
+        state['rules'][listenerARN][listenerARN + '/default'] = {
+            'RuleArn': listenerARN + '/default', 'Priority': 'default', 'IsDefault': True, 'Conditions': [], 'Actions': []
+        }
+        for priority in range(1, listenerRules + 1):
+            ruleARN = '{}/rule-{}'.format(listenerARN, priority)
+            hostName = 'user{}-app.{}'.format(priority, domainNameOfHostedZone)
+            state['rules'][listenerARN][ruleARN] = {
+                'RuleArn': ruleARN, 'Priority': str(priority), 'IsDefault': False,
+                'Conditions': [{'Field': 'host-header', 'Values': [hostName], 'HostHeaderConfig': {'Values': [hostName]}}], 'Actions': []
+            }
+    for index in range(zoneRecords):
+        recordName = 'user{}-app.{}.'.format(index + 1, domainNameOfHostedZone)
+        state['records'][hostedZoneId][(recordName, 'A')] = {'Name': recordName, 'Type': 'A', 'AliasTarget': {'DNSName': 'other', 'HostedZoneId': 'other', 'EvaluateTargetHealth': False}}
+    state['secrets'][sourceSecretName] = {
+        'ARN': 'arn:aws:secretsmanager:{}:{}:secret:{}-AbCdEf'.format(region, accountId, sourceSecretName),
+        'Name': sourceSecretName,
+        'SecretString': json.dumps({'DATABASE_URL': 'postgres://db/benchmark', 'API_KEY': 'benchmark'})
+    }
+    return state
+
+
+# Fake ECS, services are steady as soon as they are created or updated
+def newDeployment(taskDefinition: str):
+    return {'id': 'ecs-svc/' + uuid.uuid4().hex[:19], 'status': 'PRIMARY', 'taskDefinition': taskDefinition, 'desiredCount': 1, 'runningCount': 1, 'rolloutState': 'COMPLETED'}
+
+
+def fakeCreateService(params: dict):
+    key = (params['cluster'], params['serviceName'])
+    existing = fakeState['services'].get(key)
+    if existing and existing['status'] != 'INACTIVE':
+        if params.get('clientToken') and existing['clientToken'] == params.get('clientToken'):
+            return {'service': existing}
+        return awsError('InvalidParameterException', 'Creation of service was not idempotent.')
+    service = {
+        'serviceName': params['serviceName'],
+        'serviceArn': 'arn:aws:ecs:{}:{}:service/{}/{}'.format(region, accountId, params['cluster'], params['serviceName']),
+        'status': 'ACTIVE',
+        'taskDefinition': params['taskDefinition'],
+        'loadBalancers': params.get('loadBalancers', []),
+        'desiredCount': params.get('desiredCount', 1),
+        'runningCount': 1,
+        'deployments': [newDeployment(params['taskDefinition'])],
+        'clientToken': params.get('clientToken')
+    }
+    fakeState['services'][key] = service
+    fakeState['tags'][service['serviceArn']] = getTagDict(params.get('tags'))
+    return {'service': service}
+
+
+def fakeDescribeServices(params: dict):
+    services, failures = [], []
+    for name in params['services']:
+        service = fakeState['services'].get((params['cluster'], name))
+        if service:
+            services.append(service)
+        else:
+            failures.append({'arn': name, 'reason': 'MISSING'})
+    return {'services': services, 'failures': failures}
+
+
+def fakeListServices(params: dict):
+    return {'serviceArns': [service['serviceArn'] for (cluster, name), service in fakeState['services'].items() if cluster == params['cluster'] and service['status'] == 'ACTIVE']}
+
+
+def fakeUpdateService(params: dict):
+    service = fakeState['services'].get((params['cluster'], params['service']))
+    if not service or service['status'] != 'ACTIVE':
+        return awsError('ServiceNotActiveException', 'Service was not ACTIVE.')
+    service['taskDefinition'] = params.get('taskDefinition', service['taskDefinition'])
+    service['deployments'] = [newDeployment(service['taskDefinition'])]
+    return {'service': service}
+
+
+def fakeDeleteService(params: dict):
+    service = fakeState['services'].get((params['cluster'], params['service']))
+    if not service or service['status'] == 'INACTIVE':
+        return awsError('ServiceNotFoundException', 'Service not found.')
+    service.update({'status': 'INACTIVE', 'runningCount': 0, 'deployments': []})
+    fakeState['tags'].pop(service['serviceArn'], None)
+    return {'service': service}
+
+
+def findTaskDefinition(taskDefinition: str):
+    family, _, revision = taskDefinition.split('/')[-1].partition(':')
+    revisions = fakeState['taskDefinitions'].get(family, [])
+    if revision:
+        return next((candidate for candidate in revisions if candidate['revision'] == int(revision)), None)
+    return next((candidate for candidate in reversed(revisions) if candidate['status'] == 'ACTIVE'), None)
+
+
+def fakeRegisterTaskDefinition(params: dict):
+    revisions = fakeState['taskDefinitions'].setdefault(params['family'], [])
+    revision = len(revisions) + 1
+    taskDefinition = {
+        'taskDefinitionArn': 'arn:aws:ecs:{}:{}:task-definition/{}:{}'.format(region, accountId, params['family'], revision),
+        'family': params['family'],
+        'revision': revision,
+        'status': 'ACTIVE',
+        'tags': params.get('tags', [])
+    }
+    revisions.append(taskDefinition)
+    return {'taskDefinition': taskDefinition, 'tags': taskDefinition['tags']}
+
+
+def fakeDescribeTaskDefinition(params: dict):
+    taskDefinition = findTaskDefinition(params['taskDefinition'])
+    if taskDefinition is None:
+        return awsError('ClientException', 'Unable to describe task definition.')
+    return {'taskDefinition': taskDefinition, 'tags': taskDefinition['tags'] if 'TAGS' in params.get('include', []) else []}
+
+
+def fakeListTaskDefinitions(params: dict):
+    return {'taskDefinitionArns': [
+        taskDefinition['taskDefinitionArn']
+        for family, revisions in fakeState['taskDefinitions'].items() if family.startswith(params.get('familyPrefix', ''))
+        for taskDefinition in revisions if taskDefinition['status'] == params.get('status', 'ACTIVE')
+    ]}
+
+
+def fakeDeregisterTaskDefinition(params: dict):
+    taskDefinition = findTaskDefinition(params['taskDefinition'])
+    if taskDefinition is None:
+        return awsError('ClientException', 'The specified task definition does not exist.')
+    taskDefinition['status'] = 'INACTIVE'
+    return {'taskDefinition': taskDefinition}
+
+
+def fakeDeleteTaskDefinitions(params: dict):
+    deleted = []
+    for taskDefinitionARN in params['taskDefinitions']:
+        taskDefinition = findTaskDefinition(taskDefinitionARN)
+        if taskDefinition and taskDefinition['status'] == 'INACTIVE':
+            taskDefinition['status'] = 'DELETE_IN_PROGRESS'
+            deleted.append(taskDefinition)
+    return {'taskDefinitions': deleted, 'failures': []}
+
+
+# Fake ELBv2, a target group has a healthy target while an active service is attached to it
+def fakeCreateTargetGroup(params: dict):
+    for targetGroup in fakeState['targetGroups'].values():
+        if targetGroup['TargetGroupName'] == params['Name']:
+            return {'TargetGroups': [targetGroup]}
+    targetGroup = {
+        'TargetGroupArn': 'arn:aws:elasticloadbalancing:{}:{}:targetgroup/{}/{}'.format(region, accountId, params['Name'], uuid.uuid4().hex[:16]),
+        'TargetGroupName': params['Name'],
+        'Port': params.get('Port')
+    }
+    fakeState['targetGroups'][targetGroup['TargetGroupArn']] = targetGroup
+    fakeState['tags'][targetGroup['TargetGroupArn']] = getTagDict(params.get('Tags'))
+    return {'TargetGroups': [targetGroup]}
+
+
+def fakeModifyTargetGroupAttributes(params: dict):
+    if params['TargetGroupArn'] not in fakeState['targetGroups']:
+        return awsError('TargetGroupNotFound', 'One or more target groups not found')
+    return {'Attributes': params['Attributes']}
+
+
+def fakeDescribeTargetGroups(params: dict):
+    if 'Names' in params:
+        targetGroups = [targetGroup for targetGroup in fakeState['targetGroups'].values() if targetGroup['TargetGroupName'] in params['Names']]
+        expected = len(params['Names'])
+    else:
+        targetGroups = [fakeState['targetGroups'][arn] for arn in params.get('TargetGroupArns', []) if arn in fakeState['targetGroups']]
+        expected = len(params.get('TargetGroupArns', []))
+    if len(targetGroups) != expected:
+        return awsError('TargetGroupNotFound', 'One or more target groups not found')
+    return {'TargetGroups': targetGroups}
+
+
+def getAttachedServices(targetGroupARN: str):
+    return [
+        service for service in fakeState['services'].values()
+        if service['status'] == 'ACTIVE' and any(loadBalancer['targetGroupArn'] == targetGroupARN for loadBalancer in service['loadBalancers'])
+    ]
+
+
+def fakeDescribeTargetHealth(params: dict):
+    if params['TargetGroupArn'] not in fakeState['targetGroups']:
+        return awsError('TargetGroupNotFound', 'One or more target groups not found')
+    return {'TargetHealthDescriptions': [
+        {'Target': {'Id': '10.0.0.{}'.format(index + 1), 'Port': 8080}, 'TargetHealth': {'State': 'healthy'}}
+        for index, service in enumerate(getAttachedServices(params['TargetGroupArn']))
+    ]}
+
+
+def fakeDeleteTargetGroup(params: dict):
+    targetGroupARN = params['TargetGroupArn']
+    usedByRule = any(
+        action.get('TargetGroupArn') == targetGroupARN
+        for rules in fakeState['rules'].values() for rule in rules.values() for action in rule['Actions']
+    )
+    if getAttachedServices(targetGroupARN) or usedByRule:
+        return awsError('ResourceInUse', 'Target group is currently in use by a listener or a rule')
+    fakeState['targetGroups'].pop(targetGroupARN, None)
+    fakeState['tags'].pop(targetGroupARN, None)
+    return {}
+
+
+def fakeDescribeRules(params: dict):
+    if 'ListenerArn' in params:
+        return {'Rules': list(fakeState['rules'].get(params['ListenerArn'], {}).values())}
+    allRules = {ruleARN: rule for rules in fakeState['rules'].values() for ruleARN, rule in rules.items()}
+    if any(ruleARN not in allRules for ruleARN in params['RuleArns']):
+        return awsError('RuleNotFound', 'One or more rules not found')
+    return {'Rules': [allRules[ruleARN] for ruleARN in params['RuleArns']]}
+
+
+def fakeCreateRule(params: dict):
+    rules = fakeState['rules'][params['ListenerArn']]
+    if any(rule['Priority'] == str(params['Priority']) for rule in rules.values()):
+        return awsError('PriorityInUse', 'Priority {} is currently in use'.format(params['Priority']))
+    ruleARN = '{}/rule-{}'.format(params['ListenerArn'], uuid.uuid4().hex[:16])
+    hostNames = params['Conditions'][0]['Values']
+    rules[ruleARN] = {
+        'RuleArn': ruleARN, 'Priority': str(params['Priority']), 'IsDefault': False,
+        'Conditions': [{'Field': 'host-header', 'Values': hostNames, 'HostHeaderConfig': {'Values': hostNames}}], 'Actions': params['Actions']
+    }
+    return {'Rules': [rules[ruleARN]]}
+
+
+def fakeDeleteRule(params: dict):
+    for rules in fakeState['rules'].values():
+        if rules.pop(params['RuleArn'], None):
+            return {}
+    return awsError('RuleNotFound', 'One or more rules not found')
+
+
+# Fake Route53, changes are in sync as soon as they are submitted
+def fakeListResourceRecordSets(params: dict):
+    return {'ResourceRecordSets': list(fakeState['records'][params['HostedZoneId']].values()), 'IsTruncated': False, 'MaxItems': '300'}
+
+
+def fakeChangeResourceRecordSets(params: dict):
+    records = fakeState['records'][params['HostedZoneId']]
+    changes = params['ChangeBatch']['Changes']
+    for change in changes:
+        key = (route53.normaliseRecordName(change['ResourceRecordSet']['Name']), change['ResourceRecordSet']['Type'])
+        if change['Action'] == 'CREATE' and key in records:
+            return awsError('InvalidChangeBatch', 'Tried to create resource record set {} but it already exists'.format(key[0]))
+        if change['Action'] == 'DELETE' and key not in records:
+            return awsError('InvalidChangeBatch', 'Tried to delete resource record set {} but it was not found'.format(key[0]))
+    for change in changes:
+        key = (route53.normaliseRecordName(change['ResourceRecordSet']['Name']), change['ResourceRecordSet']['Type'])
+        if change['Action'] == 'DELETE':
+            records.pop(key)
+        else:
+            records[key] = dict(change['ResourceRecordSet'], Name=key[0])
+    return {'ChangeInfo': {'Id': '/change/C' + uuid.uuid4().hex[:12].upper(), 'Status': 'PENDING', 'SubmittedAt': datetime.now(timezone.utc)}}
+
+
+def fakeGetChange(params: dict):
+    return {'ChangeInfo': {'Id': params['Id'], 'Status': 'INSYNC', 'SubmittedAt': datetime.now(timezone.utc)}}
+
+
+# Fake ECR, images are added to a repo by the fake docker push
+def fakeDescribeRepositories(params: dict):
+    repositories = [fakeState['repositories'][name] for name in params['repositoryNames'] if name in fakeState['repositories']]
+    if len(repositories) != len(params['repositoryNames']):
+        return awsError('RepositoryNotFoundException', 'The repository does not exist in the registry')
+    return {'repositories': [{'repositoryName': repository['repositoryName'], 'repositoryUri': repository['repositoryUri']} for repository in repositories]}
+
+
+def fakeDescribeImages(params: dict):
+    repository = fakeState['repositories'].get(params['repositoryName'])
+    if repository is None:
+        return awsError('RepositoryNotFoundException', 'The repository does not exist in the registry')
+    imageTags = [imageId['imageTag'] for imageId in params.get('imageIds', [])]
+    if any(imageTag not in repository['imageTags'] for imageTag in imageTags):
+        return awsError('ImageNotFoundException', 'The image requested does not exist in the repository')
+    return {'imageDetails': [{'repositoryName': params['repositoryName'], 'imageTags': imageTags}]}
+
+
+def fakeCreateRepository(params: dict):
+    if params['repositoryName'] in fakeState['repositories']:
+        return awsError('RepositoryAlreadyExistsException', 'The repository already exists in the registry')
+    repository = {
+        'repositoryName': params['repositoryName'],
+        'repositoryUri': '{}.dkr.ecr.{}.amazonaws.com/{}'.format(accountId, region, params['repositoryName']),
+        'imageTags': set()
+    }
+    fakeState['repositories'][params['repositoryName']] = repository
+    fakeState['tags']['arn:aws:ecr:{}:{}:repository/{}'.format(region, accountId, params['repositoryName'])] = getTagDict(params.get('tags'))
+    return {'repository': {'repositoryName': repository['repositoryName'], 'repositoryUri': repository['repositoryUri']}}
+
+
+def fakeDeleteRepository(params: dict):
+    repository = fakeState['repositories'].pop(params['repositoryName'], None)
+    if repository is None:
+        return awsError('RepositoryNotFoundException', 'The repository does not exist in the registry')
+    fakeState['tags'].pop('arn:aws:ecr:{}:{}:repository/{}'.format(region, accountId, params['repositoryName']), None)
+    return {'repository': {'repositoryName': repository['repositoryName'], 'repositoryUri': repository['repositoryUri']}}
+
+
+def fakeGetAuthorizationToken(params: dict):
+    return {'authorizationData': [{
+        'authorizationToken': base64.b64encode(b'AWS:benchmark').decode('utf-8'),
+        'proxyEndpoint': 'https://{}.dkr.ecr.{}.amazonaws.com'.format(accountId, region),
+        'expiresAt': datetime.now(timezone.utc) + timedelta(hours=12)
+    }]}
+
+
+# Fake Secrets Manager
+def fakeDescribeSecret(params: dict):
+    secret = fakeState['secrets'].get(params['SecretId'])
+    if secret is None:
+        return awsError('ResourceNotFoundException', 'Secrets Manager can not find the specified secret.')
+    return {'ARN': secret['ARN'], 'Name': secret['Name']}
+
+
+def fakeGetSecretValue(params: dict):
+    secret = fakeState['secrets'].get(params['SecretId'])
+    if secret is None:
+        return awsError('ResourceNotFoundException', 'Secrets Manager can not find the specified secret.')
+    return {'ARN': secret['ARN'], 'Name': secret['Name'], 'SecretString': secret['SecretString']}
+
+
+def fakeCreateSecret(params: dict):
+    existing = fakeState['secrets'].get(params['Name'])
+    if existing:
+        if params.get('ClientRequestToken') and existing.get('ClientRequestToken') == params.get('ClientRequestToken'):
+            return {'ARN': existing['ARN'], 'Name': existing['Name']}
+        return awsError('ResourceExistsException', 'The operation failed because the secret {} already exists.'.format(params['Name']))
+    secret = {
+        'ARN': 'arn:aws:secretsmanager:{}:{}:secret:{}-{}'.format(region, accountId, params['Name'], uuid.uuid4().hex[:6]),
+        'Name': params['Name'],
+        'SecretString': params['SecretString'],
+        'ClientRequestToken': params.get('ClientRequestToken')
+    }
+    fakeState['secrets'][params['Name']] = secret
+    fakeState['tags'][secret['ARN']] = getTagDict(params.get('Tags'))
+    return {'ARN': secret['ARN'], 'Name': secret['Name']}
+
+
+def fakeDeleteSecret(params: dict):
+    secret = fakeState['secrets'].pop(params['SecretId'], None)
+    if secret is None:
+        return awsError('ResourceNotFoundException', 'Secrets Manager can not find the specified secret.')
+    fakeState['tags'].pop(secret['ARN'], None)
+    return {'ARN': secret['ARN'], 'Name': secret['Name'], 'DeletionDate': datetime.now(timezone.utc)}
+
+
+# Fake tagging API, resource type is read from the ARN the same way preflight does
+def fakeGetResources(params: dict):
+    mappings = []
+    for arn, tags in fakeState['tags'].items():
+        arnParts = arn.split(':', 5)
+        resourceType = arnParts[2] + ':' + arnParts[5].split('/')[0].split(':')[0]
+        if params.get('ResourceTypeFilters') and resourceType not in params['ResourceTypeFilters']:
+            continue
+        if all(tags.get(tagFilter['Key']) in tagFilter.get('Values', [tags.get(tagFilter['Key'])]) and tagFilter['Key'] in tags for tagFilter in params.get('TagFilters', [])):
+            mappings.append({'ResourceARN': arn, 'Tags': [{'Key': key, 'Value': value} for key, value in tags.items()]})
+    return {'ResourceTagMappingList': mappings}
+
+
+# Handlers of the fake AWS by (service, operation)
+fakeOperations = {
+    ('ecs', 'CreateService'): fakeCreateService,
+    ('ecs', 'DescribeServices'): fakeDescribeServices,
+    ('ecs', 'ListServices'): fakeListServices,
+    ('ecs', 'UpdateService'): fakeUpdateService,
+    ('ecs', 'DeleteService'): fakeDeleteService,
+    ('ecs', 'RegisterTaskDefinition'): fakeRegisterTaskDefinition,
+    ('ecs', 'DescribeTaskDefinition'): fakeDescribeTaskDefinition,
+    ('ecs', 'ListTaskDefinitions'): fakeListTaskDefinitions,
+    ('ecs', 'DeregisterTaskDefinition'): fakeDeregisterTaskDefinition,
+    ('ecs', 'DeleteTaskDefinitions'): fakeDeleteTaskDefinitions,
+    ('elbv2', 'CreateTargetGroup'): fakeCreateTargetGroup,
+    ('elbv2', 'ModifyTargetGroupAttributes'): fakeModifyTargetGroupAttributes,
+    ('elbv2', 'DescribeTargetGroups'): fakeDescribeTargetGroups,
+    ('elbv2', 'DescribeTargetHealth'): fakeDescribeTargetHealth,
+    ('elbv2', 'DeleteTargetGroup'): fakeDeleteTargetGroup,
+    ('elbv2', 'DescribeRules'): fakeDescribeRules,
+    ('elbv2', 'CreateRule'): fakeCreateRule,
+    ('elbv2', 'DeleteRule'): fakeDeleteRule,
+    ('route53', 'ListResourceRecordSets'): fakeListResourceRecordSets,
+    ('route53', 'ChangeResourceRecordSets'): fakeChangeResourceRecordSets,
+    ('route53', 'GetChange'): fakeGetChange,
+    ('ecr', 'DescribeRepositories'): fakeDescribeRepositories,
+    ('ecr', 'DescribeImages'): fakeDescribeImages,
+    ('ecr', 'CreateRepository'): fakeCreateRepository,
+    ('ecr', 'DeleteRepository'): fakeDeleteRepository,
+    ('ecr', 'GetAuthorizationToken'): fakeGetAuthorizationToken,
+    ('secretsmanager', 'DescribeSecret'): fakeDescribeSecret,
+    ('secretsmanager', 'GetSecretValue'): fakeGetSecretValue,
+    ('secretsmanager', 'CreateSecret'): fakeCreateSecret,
+    ('secretsmanager', 'DeleteSecret'): fakeDeleteSecret,
+    ('resourcegroupstaggingapi', 'GetResources'): fakeGetResources,
+}
+
+
+# Method to keep parameters of a call as passed by the caller, before-call only gets the serialized request
+def captureCallParams(params: dict, context: dict, **kwargs):
+    context['benchmarkParams'] = params
+
+
+# Method to answer an AWS call from the fake instead of sending it, request is still built and validated by botocore
+def answerCall(model, context: dict, **kwargs):
+    """_summary_
+
+    Args:
+        model (object): Operation model of the call
+        context (dict): Request context holding the parameters of the call
+
+    Returns:
+        _type_: HTTP response and parsed response, botocore raises the modeled exception for error responses
+    """
+    time.sleep(simulatedSeconds['aws'])
+    handler = fakeOperations.get((model.service_model.service_name, model.name))
+    with fakeStateLock:
+        if handler is None:
+            parsed = awsError('UnknownOperationException', '{} is not supported by the benchmark'.format(model.name))
+        else:
+            parsed = copy.deepcopy(handler(context.get('benchmarkParams', {})))
+    statusCode = 400 if 'Error' in parsed else 200
+    parsed['ResponseMetadata'] = {'HTTPStatusCode': statusCode, 'HTTPHeaders': {}, 'RetryAttempts': 0}
+    return AWSResponse(None, statusCode, {}, None), parsed
+
+
+# Fake docker API client, build prints Dockerfile steps and push adds the tag to the fake ECR repo
+def fakeDockerBuild(path: str, tag: str, **kwargs):
+    instructions = ['FROM python:3.11-slim', 'WORKDIR /app', 'COPY requirements.txt .', 'RUN pip install -r requirements.txt', 'COPY . .', 'CMD ["python", "app.py"]']
+    for number, instruction in enumerate(instructions, start=1):
+        yield {'stream': 'Step {}/{} : {}\n'.format(number, len(instructions), instruction)}
+        if number <= 4:
+            yield {'stream': ' ---> Using cache\n'}
+        else:
+            time.sleep(simulatedSeconds['build'] / 2)
+        yield {'stream': ' ---> {}\n'.format(uuid.uuid4().hex[:12])}
+    yield {'stream': 'Successfully tagged {}:latest\n'.format(tag)}
+
+
+def fakeDockerTag(image: str, repository: str, tag: str = None, **kwargs):
+    return True
+
+
+def fakeDockerPush(repository: str, tag: str = None, **kwargs):
+    layers = [uuid.uuid4().hex[:12] for _ in range(3)]
+    yield {'status': 'The push refers to repository [{}]'.format(repository)}
+    for layer in layers:
+        yield {'status': 'Preparing', 'id': layer}
+    for layer in layers:
+        yield {'status': 'Pushing', 'id': layer, 'progressDetail': {'current': 1048576, 'total': 4194304}}
+        time.sleep(simulatedSeconds['push'] / len(layers))
+        yield {'status': 'Pushed', 'id': layer}
+    with fakeStateLock:
+        fakeState['repositories'][repository.split('/', 1)[1]]['imageTags'].add(tag)
+    yield {'status': '{}: digest: sha256:{} size: 1572'.format(tag, uuid.uuid4().hex)}
+
+
+fakeDockerClient = SimpleNamespace(build=fakeDockerBuild, tag=fakeDockerTag, push=fakeDockerPush)
+
+
+# Fake git, head of the branch is the last commit pushed with pushFakeCommit
+def fakeResolveBranchHead(gitRepoName: str, branchName: str, githubOrgName: str):
+    time.sleep(simulatedSeconds['aws'])
+    with fakeStateLock:
+        return fakeState['commits'][-1]
+
+
+def fakeCloneRepo(gitRepoName: str, branchName: str, githubOrgName: str, commitSHA: str = None):
+    time.sleep(simulatedSeconds['clone'])
+    return True
+
+
+def pushFakeCommit():
+    with fakeStateLock:
+        fakeState['commits'].append(uuid.uuid4().hex + uuid.uuid4().hex[:8])
+
+
+# Fake HTTP session used by health check and kibana
+def fakeHTTPResponse(payload: dict, statusCode: int = 200):
+    return SimpleNamespace(status_code=statusCode, json=lambda: payload, raise_for_status=lambda: None)
+
+
+def fakeHTTPGet(url: str, **kwargs):
+    time.sleep(simulatedSeconds['http'])
+    if url.endswith('/api/saved_objects/_find'):
+        return fakeHTTPResponse({'saved_objects': [], 'per_page': kwargs.get('params', {}).get('per_page', 20), 'total': 0})
+    return fakeHTTPResponse({'status': 'UP'})
+
+
+def fakeHTTPPost(url: str, json: list = None, **kwargs):
+    time.sleep(simulatedSeconds['http'])
+    return fakeHTTPResponse({'saved_objects': [{'id': savedObject['id'], 'type': savedObject['type']} for savedObject in json or []]})
+
+
+fakeHTTPSession = SimpleNamespace(get=fakeHTTPGet, post=fakeHTTPPost)
+
+
+# Method to replace AWS, docker, git and HTTP with the fakes
+def installFakes():
+    clientRegistry.registerClientEventHandler('before-parameter-build.*.*', captureCallParams)
+    clientRegistry.registerClientEventHandler('before-call.*.*', answerCall)
+    application.dockerClient = fakeDockerClient
+    application.resolveBranchHead = fakeResolveBranchHead
+    application.clone_repo = fakeCloneRepo
+    healthChecks.session = fakeHTTPSession
+    kibana.session = fakeHTTPSession
+
+
+# Method to drop everything a run keeps in memory, every run of main.py is a new process in CI
+def resetProcessState():
+    with clientRegistry.clientsLock:
+        clientRegistry.session = None
+        clientRegistry.clients.clear()
+    route53.zoneSnapshots.clear()
+    loadBalancer.listenerRuleIndexes.clear()
+    ecsService.clusterInventories.clear()
+    kibana.indexPatternCache.clear()
+    application.ecrTokens.clear()
+    with tracing.spansLock:
+        tracing.spans.clear()
+    apiStats.resetStats()
+
+
+# Method to check that resources of the environment are in the state expected after an operation
+def checkEnvironment(mainModule, operation: str):
+    """_summary_
+
+    Args:
+        mainModule (module): main module with the arguments of the run
+        operation (str): Operation which was run
+
+    Returns:
+        _type_: If the fake account looks the way the operation should have left it
+    """
+    environmentName = 'cloud-dev-' + mainModule.getUserName(mainModule.args.email) + '-' + mainModule.args.appName
+    with fakeStateLock:
+        service = fakeState['services'].get((mainModule.args.ecsClusterName, environmentName))
+        serviceActive = bool(service) and service['status'] == 'ACTIVE'
+        otherResources = [
+            environmentName in fakeState['secrets'],
+            mainModule.args.appName in fakeState['repositories'],
+            any(environmentName.replace('cloud-dev-', '', 1) in key[0] for key in fakeState['records'][hostedZoneId])
+        ]
+    if operation == 'delete':
+        return not serviceActive and not any(otherResources)
+    if operation == 'update':
+        return serviceActive and service['taskDefinition'].endswith(':{}'.format(len(fakeState['taskDefinitions'][environmentName])))
+    return serviceActive and all(otherResources)
+
+
+# Method to run one operation of main.py and measure it
+def runOperation(mainModule, operation: str, verbose: bool):
+    """_summary_
+
+    Args:
+        mainModule (module): main module
+        operation (str): create, update or delete
+        verbose (bool): Show logs and output of the run
+
+    Returns:
+        _type_: Wall time, AWS calls by operation and if the operation succeeded
+    """
+    mainModule.args.operation = operation
+    resetProcessState()
+    if operation in ('create', 'update'):
+        pushFakeCommit()
+    output = io.StringIO()
+    if not verbose:
+        logging.disable(logging.WARNING)
+    exited = False
+    start = time.perf_counter()
+    try:
+        with redirect_stdout(sys.stdout if verbose else output):
+            mainModule.main()
+    except SystemExit:
+        exited = True
+    finally:
+        seconds = time.perf_counter() - start
+        logging.disable(logging.NOTSET)
+    stats = apiStats.getStats()
+    succeeded = not exited and checkEnvironment(mainModule, operation)
+    if not succeeded:
+        logger.error(" {} failed, output of the run:\n{}".format(operation, output.getvalue()))
+    return {
+        'seconds': seconds,
+        'calls': {'{}.{}'.format(operationStats['service'], operationStats['operation']): operationStats['calls'] for operationStats in stats['operations']},
+        'succeeded': succeeded
+    }
+
+
+# Method to run create, update and delete a number of times against a new fake account
+def runPass(mainModule, iterations: int, zoneRecords: int, listenerRules: int, verbose: bool):
+    """_summary_
+
+    Args:
+        mainModule (module): main module
+        iterations (int): Times the create, update and delete cycle is run
+        zoneRecords (int): Records of other environments in the hosted zone
+        listenerRules (int): Rules of other environments in each listener
+        verbose (bool): Show logs and output of the runs
+
+    Returns:
+        _type_: Results of every run by operation
+    """
+    global fakeState
+    with fakeStateLock:
+        fakeState = newFakeState(zoneRecords, listenerRules)
+    results = {'create': [], 'update': [], 'delete': []}
+    for iteration in range(iterations):
+        for operation in results:
+            results[operation].append(runOperation(mainModule, operation, verbose))
+    return results
+
+
+# Method to print wall time, overhead and AWS calls of every operation
+def printReport(report: dict):
+    """_summary_
+
+    Args:
+        report (dict): Summary of the benchmark by operation
+    """
+    header = '{:<10} {:>6} {:>10} {:>10} {:>12} {:>12} {:>10}'
+    print(header.format('operation', 'runs', 'wall s', 'wall min s', 'overhead s', 'overhead min', 'aws calls'))
+    for operation, summary in report['operations'].items():
+        print(header.format(operation, summary['runs'], summary['wallSeconds'], summary['wallMinSeconds'], summary['overheadSeconds'], summary['overheadMinSeconds'], summary['awsCalls']))
+
+    apiOperations = sorted({name for summary in report['operations'].values() for name in summary['callsByOperation']})
+    print('')
+    callHeader = '{:<48}' + ' {:>8}' * len(report['operations'])
+    print(callHeader.format('aws calls per run', *report['operations']))
+    for name in apiOperations:
+        print(callHeader.format(name, *[summary['callsByOperation'].get(name, 0) for summary in report['operations'].values()]))
+
+
+# Method to compare AWS calls of every operation with a baseline written by an earlier run with --output
+def getCallRegressions(report: dict, baseline: dict):
+    """_summary_
+
+    Args:
+        report (dict): Summary of this benchmark by operation
+        baseline (dict): Summary of the baseline run
+
+    Returns:
+        _type_: Messages for every AWS operation which is called more often than in the baseline
+    """
+    regressions = []
+    for operation, summary in report['operations'].items():
+        baselineCalls = baseline['operations'].get(operation, {}).get('callsByOperation', {})
+        for name, calls in summary['callsByOperation'].items():
+            if calls > baselineCalls.get(name, 0):
+                regressions.append("{} calls {} {} times, baseline is {}".format(operation, name, calls, baselineCalls.get(name, 0)))
+        if summary['awsCalls'] < baseline['operations'].get(operation, {}).get('awsCalls', 0):
+            logger.info(" {} makes fewer AWS calls than the baseline please update it".format(operation))
+    return regressions
+
+
+# Method to run the benchmark
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark create, update and delete of cloud-dev against in-memory AWS, docker, git and HTTP')
+    parser.add_argument('--iterations', type=int, default=5, help='Times the create, update and delete cycle is run, default 5')
+    parser.add_argument('--aws-latency-ms', type=float, default=20, help='Latency of every fake AWS call and git ls-remote, default 20')
+    parser.add_argument('--http-latency-ms', type=float, default=50, help='Latency of every health check and kibana request, default 50')
+    parser.add_argument('--clone-seconds', type=float, default=0.5, help='Time taken by clone, default 0.5')
+    parser.add_argument('--build-seconds', type=float, default=2, help='Time taken by steps of docker build which are not cached, default 2')
+    parser.add_argument('--push-seconds', type=float, default=1, help='Time taken by docker push, default 1')
+    parser.add_argument('--zone-records', type=int, default=500, help='Records of other environments in the hosted zone, default 500')
+    parser.add_argument('--listener-rules', type=int, default=200, help='Rules of other environments in each listener, default 200')
+    parser.add_argument('--output', type=str, help='JSON file to write the results to, eg: to compare runs in CI')
+    parser.add_argument('--check', type=str, help='JSON file written with --output, benchmark fails when an operation makes more AWS calls than it, eg: benchmark/baseline.json')
+    parser.add_argument('--verbose', action='store_true', help='Show logs and output of every run')
+    benchmarkArgs = parser.parse_args()
+
+    # main.py reads its arguments when it is imported
+    sys.argv = ['main.py'] + mainArguments
+    mainModule = importlib.import_module('main')
+    installFakes()
+
+    try:
+        # Overhead pass has no simulated latency, all of its time is spent in cloud-dev, botocore and the fakes
+        simulatedSeconds.update({
+            'aws': benchmarkArgs.aws_latency_ms / 1000,
+            'http': benchmarkArgs.http_latency_ms / 1000,
+            'clone': benchmarkArgs.clone_seconds,
+            'build': benchmarkArgs.build_seconds,
+            'push': benchmarkArgs.push_seconds
+        })
+        simulatedResults = runPass(mainModule, benchmarkArgs.iterations, benchmarkArgs.zone_records, benchmarkArgs.listener_rules, benchmarkArgs.verbose)
+        simulatedSeconds.update(dict.fromkeys(simulatedSeconds, 0))
+        overheadResults = runPass(mainModule, benchmarkArgs.iterations, benchmarkArgs.zone_records, benchmarkArgs.listener_rules, benchmarkArgs.verbose)
+    finally:
+        shutil.rmtree(benchmarkDir, ignore_errors=True)
+
+    report = {'settings': vars(benchmarkArgs), 'operations': {}}
+    for operation in simulatedResults:
+        runs = simulatedResults[operation] + overheadResults[operation]
+        wallSeconds = [run['seconds'] for run in simulatedResults[operation]]
+        overheadSeconds = [run['seconds'] for run in overheadResults[operation]]
+        report['operations'][operation] = {
+            'runs': len(wallSeconds),
+            'failedRuns': sum(1 for run in runs if not run['succeeded']),
+            'wallSeconds': round(statistics.median(wallSeconds), 3),
+            'wallMinSeconds': round(min(wallSeconds), 3),
+            'overheadSeconds': round(statistics.median(overheadSeconds), 3),
+            'overheadMinSeconds': round(min(overheadSeconds), 3),
+            'awsCalls': max(sum(run['calls'].values()) for run in runs),
+            'callsByOperation': {name: max(run['calls'].get(name, 0) for run in runs) for name in sorted({name for run in runs for name in run['calls']})}
+        }
+    printReport(report)
+
+    if benchmarkArgs.output:
+        with open(benchmarkArgs.output, 'w') as outputFile:
+            json.dump(report, outputFile, indent=2)
+        logger.info(" Results written to {}".format(benchmarkArgs.output))
+
+    failedRuns = sum(summary['failedRuns'] for summary in report['operations'].values())
+    if failedRuns:
+        logger.error(" {} runs failed".format(failedRuns))
+        sys.exit(1)
+
+    if benchmarkArgs.check:
+        with open(benchmarkArgs.check) as baselineFile:
+            regressions = getCallRegressions(report, json.load(baselineFile))
+        for regression in regressions:
+            logger.error(" " + regression)
+        if regressions:
+            sys.exit(1)
+        logger.info(" AWS calls are within the baseline {}".format(benchmarkArgs.check))
+
+
+if __name__ == "__main__":
+    main()
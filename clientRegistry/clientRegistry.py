@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+
+import os
+import logging
+import threading
+import time
+import boto3
+from botocore.config import Config
+
+from apiStats import apiStats
+
+
+# Logger configuration
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+# Client settings, can be overridden from env or with configureClients
+clientSettings = {
+    'maxPoolConnections': int(os.environ.get('CLOUD_DEV_MAX_POOL_CONNECTIONS', '20')),
+    'maxAttempts': int(os.environ.get('CLOUD_DEV_MAX_ATTEMPTS', '10')),
+    'retryMode': os.environ.get('CLOUD_DEV_RETRY_MODE', 'adaptive'),
+    'tcpKeepalive': os.environ.get('CLOUD_DEV_TCP_KEEPALIVE', 'true').lower() == 'true'
+}
+
+# One session and one client per (service, region) for the whole process
+session = None
+clients = {}
+clientsLock = threading.Lock()
+
+# Event handlers registered on every client, eg: to answer calls from an in-memory fake in benchmarks
+clientEventHandlers = []
+
+# Token bucket of each service which has a client side rate limit, eg: set by long sweeps to stay below AWS API limits
+rateLimits = {}
+rateLimitLock = threading.Lock()
+
+
+# Method to change client settings, clients created before are dropped
+def configureClients(maxPoolConnections: int = None, maxAttempts: int = None, retryMode: str = None, tcpKeepalive: bool = None):
+    """_summary_
+
+    Args:
+        maxPoolConnections (int): Maximum number of connections kept open per client
+        maxAttempts (int): Maximum number of attempts for a call including retries
+        retryMode (str): botocore retry mode, one of legacy, standard or adaptive
+        tcpKeepalive (bool): Enable TCP keep-alive on client connections
+    """
+    newSettings = {
+        'maxPoolConnections': maxPoolConnections,
+        'maxAttempts': maxAttempts,
+        'retryMode': retryMode,
+        'tcpKeepalive': tcpKeepalive
+    }
+    with clientsLock:
+        clientSettings.update({key: value for key, value in newSettings.items() if value is not None})
+        clients.clear()
+
+
+# Method to limit requests per second sent to a service by all clients of the process
+def setRateLimit(serviceName: str, requestsPerSecond: float, burst: int = None):
+    """_summary_
+
+    Args:
+        serviceName (str): Name of the AWS service, eg: ecs, elbv2
+        requestsPerSecond (float): Requests allowed per second, None removes the limit
+        burst (int): Requests which can be sent at once after being idle, default is one second worth of requests
+    """
+    with rateLimitLock:
+        if requestsPerSecond is None:
+            rateLimits.pop(serviceName, None)
+            return
+        capacity = burst or max(1, int(requestsPerSecond))
+        rateLimits[serviceName] = {
+            'rate': requestsPerSecond,
+            'capacity': capacity,
+            'tokens': capacity,
+            'updatedAt': time.monotonic()
+        }
+
+
+# Method to wait till rate limit of the service allows one more request
+def acquireRateLimitToken(serviceName: str):
+    """_summary_
+
+    Args:
+        serviceName (str): Name of the AWS service, eg: ecs, elbv2
+    """
+    while True:
+        with rateLimitLock:
+            bucket = rateLimits.get(serviceName)
+            if bucket is None:
+                return
+            now = time.monotonic()
+            bucket['tokens'] = min(bucket['capacity'], bucket['tokens'] + (now - bucket['updatedAt']) * bucket['rate'])
+            bucket['updatedAt'] = now
+            if bucket['tokens'] >= 1:
+                bucket['tokens'] -= 1
+                return
+            delay = (1 - bucket['tokens']) / bucket['rate']
+        time.sleep(delay)
+
+
+# Method to register a botocore event handler on every client, clients created before are dropped
+def registerClientEventHandler(eventName: str, handler):
+    """_summary_
+
+    Args:
+        eventName (str): botocore event, eg: before-call.*.*
+        handler (function): Called with the arguments of the event
+    """
+    with clientsLock:
+        clientEventHandlers.append((eventName, handler))
+        clients.clear()
+
+
+# Method to build botocore config from client settings
+def getClientConfig():
+    """_summary_
+
+    Returns:
+        _type_: botocore config to be used for all clients
+    """
+    return Config(
+        max_pool_connections = clientSettings['maxPoolConnections'],
+        tcp_keepalive = clientSettings['tcpKeepalive'],
+        retries = {
+            'total_max_attempts': clientSettings['maxAttempts'],
+            'mode': clientSettings['retryMode']
+        }
+    )
+
+
+# Method to get shared boto3 client for a service in a region
+def getClient(serviceName: str, region: str):
+    """_summary_
+
+    Args:
+        serviceName (str): Name of the AWS service, eg: ecs, elbv2
+        region (str): Region of the client
+
+    Returns:
+        _type_: boto3 client shared by all modules
+    """
+    global session
+    key = (serviceName, region)
+    client = clients.get(key)
+    if client is not None:
+        return client
+
+    # boto3 sessions are not thread safe hence clients are only created under the lock
+    with clientsLock:
+        client = clients.get(key)
+        if client is None:
+            if session is None:
+                session = boto3.session.Session()
+            client = session.client(serviceName, region_name= region, config= getClientConfig())
+            # Hook runs before every attempt so that retries are rate limited as well
+            client.meta.events.register('before-send', lambda **kwargs: acquireRateLimitToken(serviceName))
+            # Calls, latency, retries and throttling of every operation are counted for the summary printed at exit
+            apiStats.attachToClient(client)
+            for eventName, handler in clientEventHandlers:
+                client.meta.events.register(eventName, handler)
+            clients[key] = client
+            logger.debug(" Created {} client for {}".format(serviceName, region))
+    return client
@@ -1,8 +1,15 @@
 #!/usr/bin/env python3
 
+import os
 import requests
 import logging
 import time
+from requests.adapters import HTTPAdapter
+
+from clientRegistry import clientRegistry
+from waiter import waiter
+from service import ecsService
+from tracing import tracing
 
 
 # Define the custom logger
@@ -10,29 +17,84 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
+# Seconds to wait for the app to become ready before health check is failed
+readinessTimeout = int(os.environ.get('CLOUD_DEV_READINESS_TIMEOUT', '600'))
+
+# Status codes which are treated as a healthy app
+healthyStatusCodes = (200, 201, 301, 302)
+
+# Session reused for all the probes so that connection is not opened again on every attempt
+session = requests.Session()
+session.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=4))
+
+
+# Method to check if any target in target group is healthy
+def checkTargetHealthy(targetGroupARN: str, region: str):
+    """_summary_
+
+    Args:
+        targetGroupARN (str): ARN of the target group of the service
+        region (str): Region of the target group
+
+    Returns:
+        _type_: If at least one target is healthy
+    """
+    client = clientRegistry.getClient('elbv2', region)
+    response = client.describe_target_health(TargetGroupArn = targetGroupARN)
+    states = [target['TargetHealth']['State'] for target in response['TargetHealthDescriptions']]
+    return 'healthy' in states
+
+
+# Method to probe health check endpoint once
+def probeHealthEndpoint(healthCheckUrlFull: str):
+    """_summary_
+
+    Args:
+        healthCheckUrlFull (str): Full URL of the health check endpoint
+
+    Returns:
+        _type_: If endpoint responded with a healthy status code
+    """
+    try:
+        response = session.get(healthCheckUrlFull, timeout=10)
+    except requests.RequestException as e:
+        logger.info(" Health check request failed {}".format(str(e)))
+        return False
+    logger.info(" Health check responded with {}".format(response.status_code))
+    return response.status_code in healthyStatusCodes
+
+
 # Method to ping health check endpoint
-def pingHealthEndpoint(domainName: str, healthCheckPath: str):
+@tracing.traced()
+def pingHealthEndpoint(domainName: str, healthCheckPath: str, ecsServiceName: str = None, ecsClusterName: str = None, targetGroupARN: str = None, region: str = None, timeout: int = None):
     """_summary_
 
     Args:
-        domainName (str): DNS name to which service is pointing to 
+        domainName (str): DNS name to which service is pointing to
         healthCheckPath (str): Health check path for service
+        ecsServiceName (str): Name of the ecs service, deployment is waited for when passed
+        ecsClusterName (str): ECS Cluster name
+        targetGroupARN (str): ARN of target group, target health is waited for when passed
+        region (str): Region of the ecs service and target group
+        timeout (int): Seconds to wait for the app to be ready
 
     Returns:
         _type_: Service response
     """
-    
+
     healthCheckUrlFull = 'https://' + domainName + '/' + healthCheckPath
     print("health check url is {} {} {}".format('\033[1m', healthCheckUrlFull, '\033[0m'))
     print("Please wait while app is getting deployed")
-    print(healthCheckUrlFull)
-    time.sleep(120)         # Sleep is added to wait untill application gets deployed 
-    response = requests.get('https://' + domainName + '/' + healthCheckPath)
-    if response.status_code == (200 or 201 or 301 or 302):
-        print(response)
-        return True
-    else:
-        print(response)
+    deadline = time.monotonic() + (timeout or readinessTimeout)
+    try:
+        if ecsServiceName:
+            if not waiter.pollUntil(lambda: ecsService.checkDeploymentRolledOut(ecsServiceName, None, ecsClusterName, region), deadline - time.monotonic(), description='ecs service {} to reach steady state'.format(ecsServiceName)):
+                return False
+        if targetGroupARN:
+            if not waiter.pollUntil(lambda: checkTargetHealthy(targetGroupARN, region), deadline - time.monotonic(), description='healthy target in target group'):
+                return False
+    except Exception as e:
+        print(str(e))
         return False
-        
-        
+
+    return waiter.pollUntil(lambda: probeHealthEndpoint(healthCheckUrlFull), deadline - time.monotonic(), baseDelay=1, maxDelay=15, description=healthCheckUrlFull)
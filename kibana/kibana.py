@@ -1,45 +1,156 @@
 import requests
 import os
+import uuid
+import logging
+import threading
+from requests.adapters import HTTPAdapter
 
+from tracing import tracing
 
-# Method to create index pattern in kibana
-def createIndexPattern(indexPatternName: str, kibanaURL: str):
-    # Kibana credentials to be setup as env to create index in kibana depending upon where it will be running
-    kibanaUsername = os.environ.get('kibanaUsername')
-    kibanaPassword = os.environ.get('kibanaPassword')
 
+# Logger configuration
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+# Session reused for all kibana calls so that connection is not opened again on every call
+session = requests.Session()
+session.mount('https://', HTTPAdapter(pool_connections=2, pool_maxsize=4))
+session.headers.update({
+    'kbn-xsrf': 'true',
+    'Content-Type': 'application/json',
+})
+
+# Titles of index patterns in each kibana, read once with _find and then kept up to date in place
+indexPatternCache = {}
+indexPatternCacheLock = threading.Lock()
+
+# Index patterns read per _find page
+findPageSize = 1000
+
+
+# Method to get kibana credentials, to be setup as env depending upon where it will be running
+def getKibanaAuth():
     """_summary_
+
+    Returns:
+        _type_: Username and password of kibana
+    """
+    return (os.environ.get('kibanaUsername'), os.environ.get('kibanaPassword'))
+
+
+# Method to get id of index pattern, the same title always gets the same id so that it can not be created twice
+def getIndexPatternId(indexPatternTitle: str):
+    """_summary_
+
     Args:
-        indexPatternName (str): Name of the index pattern to be created
-        kibanaURL       (str): Kibana URL where index would be created
+        indexPatternTitle (str): Title of the index pattern, eg: appName*
 
     Returns:
-        _type_: If index is created
+        _type_: Saved object id of the index pattern
+    """
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, 'cloud-dev/index-pattern/' + indexPatternTitle))
+
+
+# Method to get titles of all index patterns in kibana, all the pages are read on first use
+@tracing.traced()
+def getIndexPatternTitles(kibanaURL: str, refresh: bool = False):
+    """_summary_
+
+    Args:
+        kibanaURL (str): Kibana URL
+        refresh (bool): Read the index patterns again even if they were read before
+
+    Returns:
+        _type_: Set of index pattern titles
+    """
+    with indexPatternCacheLock:
+        if kibanaURL in indexPatternCache and not refresh:
+            return indexPatternCache[kibanaURL]
+
+        titles = set()
+        page = 1
+        while True:
+            response = session.get(
+                'https://' + kibanaURL + '/api/saved_objects/_find',
+                params={'type': 'index-pattern', 'fields': 'title', 'per_page': findPageSize, 'page': page},
+                auth=getKibanaAuth(),
+                timeout=30
+            )
+            response.raise_for_status()
+            result = response.json()
+            titles.update(savedObject['attributes']['title'] for savedObject in result['saved_objects'])
+            if page * result['per_page'] >= result['total'] or not result['saved_objects']:
+                break
+            page += 1
+        indexPatternCache[kibanaURL] = titles
+        logger.info(" Loaded {} index patterns from kibana".format(len(titles)))
+        return titles
+
+
+# Method to create many index patterns in kibana with one _bulk_create call, existing ones are skipped
+@tracing.traced()
+def createIndexPatterns(indexPatternNames: list, kibanaURL: str):
+    """_summary_
+
+    Args:
+        indexPatternNames (list): Names of the index patterns to be created, * is added to every name
+        kibanaURL (str): Kibana URL where index would be created
+
+    Returns:
+        _type_: If all index patterns exist
     """
-    
-    indexPatternName = indexPatternName + '*'
     try:
-        headers = {
-            'kbn-xsrf': 'true',
-            'Content-Type': 'application/json',
-        }
-
-        json_data = {
-            'index_pattern': {
-                'title': indexPatternName,
-                'timeFieldName': '@timestamp',
-            },
-        }
-        kibanaIndexCreateURL = 'https://' + kibanaURL + '/' + 'api/index_patterns/index_pattern'
-        response = requests.post(
-            kibanaIndexCreateURL,
-            headers=headers,
-            json=json_data,
-            auth=(kibanaUsername, kibanaPassword),
+        existingTitles = getIndexPatternTitles(kibanaURL)
+        missingTitles = sorted({name + '*' for name in indexPatternNames} - existingTitles)
+        if not missingTitles:
+            logger.info(" Index patterns already exist in kibana")
+            return True
+
+        # Object with the same id is not overwritten, a pattern created at the same time by another run comes back as conflict
+        response = session.post(
+            'https://' + kibanaURL + '/api/saved_objects/_bulk_create',
+            params={'overwrite': 'false'},
+            json=[
+                {
+                    'type': 'index-pattern',
+                    'id': getIndexPatternId(title),
+                    'attributes': {
+                        'title': title,
+                        'timeFieldName': '@timestamp',
+                    },
+                }
+                for title in missingTitles
+            ],
+            auth=getKibanaAuth(),
+            timeout=30
         )
+        response.raise_for_status()
+
+        created = True
+        for title, savedObject in zip(missingTitles, response.json()['saved_objects']):
+            error = savedObject.get('error')
+            if error and error.get('statusCode') != 409:
+                logger.error(" Unable to create index pattern {} {}".format(title, error.get('message')))
+                created = False
+                continue
+            with indexPatternCacheLock:
+                existingTitles.add(title)
+        return created
 
-        return True
-    
     except Exception as e:
         print(str(e))
         return False
+
+
+# Method to create index pattern in kibana
+def createIndexPattern(indexPatternName: str, kibanaURL: str):
+    """_summary_
+    Args:
+        indexPatternName (str): Name of the index pattern to be created
+        kibanaURL       (str): Kibana URL where index would be created
+
+    Returns:
+        _type_: If index is created
+    """
+    return createIndexPatterns([indexPatternName], kibanaURL)
@@ -1,17 +1,28 @@
 #!/usr/bin/env python3
 
-import boto3
+from clientRegistry import clientRegistry
 import sys
 import logging
-import random
+import threading
+from tracing import tracing
 
 
 # Define the custom logger
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# define the boto client
-#client = boto3.client('elbv2', region_name= region)
+# Listener rule index, every listener is read once per run and then kept up to date in place
+listenerRuleIndexes = {}
+listenerRuleIndexLock = threading.RLock()
+
+# Lock of each listener held while its rules are read, other listeners are read at the same time
+listenerLoadLocks = {}
+
+# ALB allows rule priorities from 1 to 50000
+maxRulePriority = 50000
+
+# Attempts to create a rule when other runs take the same priority at the same time
+maxPriorityAttempts = 5
 
 
 # Method to add https rule to load balancer
@@ -21,31 +32,19 @@ def addRuleToLoadBalancerHttps(domainName: str, targetGroupArn: str, priority: i
     Args:
         domainName (str): DNS to be matched for host in load balancer rule
         targetGroupArn (str): ARN of target group
-        priority (int): random int generated
+        priority (int): Priority of the rule, None to use a free priority of the listener
         HTTTPSListenerARN (str): HTTPS Listener ARN
 
     Returns:
         _type_: load balancer rules
     """
-    client = boto3.client('elbv2', region_name= region)
     try:
-        response = client.create_rule(
-            ListenerArn = HTTTPSListenerARN,
-            Priority = priority,
-            Conditions = [
-                {
-                    'Field': 'host-header',
-                    'Values': [domainName]
-                }
-            ],
-            Actions = [
+        HTTSPruleARN = createListenerRule(domainName, [
                 {
                 'Type': 'forward',
                 'TargetGroupArn': targetGroupArn
                 }
-            ]
-        )
-        HTTSPruleARN = response['Rules'][0]['RuleArn']
+            ], priority, HTTTPSListenerARN, region)
         return HTTSPruleARN
     
     except Exception as e:
@@ -59,24 +58,14 @@ def addRuleToLoadBalancerHttp(domainName: str, targetGroupArn: str, priority: in
     Args:
         domainName (str): DNS to be matched for host in load balancer rule
         targetGroupArn (str): ARN of target group
-        priority (int): random int generated
+        priority (int): Priority of the rule, None to use a free priority of the listener
         HTTPListenerARN (str): HTTP Listener ARN
 
     Returns:
         _type_: load balancer rule ARN
     """
-    client = boto3.client('elbv2', region_name= region)
     try:
-        response = client.create_rule(
-            ListenerArn = HTTPListenerARN,
-            Priority = priority,
-            Conditions = [
-                {
-                    'Field': 'host-header',
-                    'Values': [domainName]
-                }
-            ],
-            Actions = [
+        HTTPruleARN = createListenerRule(domainName, [
                 {
                 'Type': 'redirect',
                 'RedirectConfig': {
@@ -88,9 +77,7 @@ def addRuleToLoadBalancerHttp(domainName: str, targetGroupArn: str, priority: in
                     'StatusCode': 'HTTP_301'
                 }
                 }
-            ]
-        )
-        HTTPruleARN = response['Rules'][0]['RuleArn']
+            ], priority, HTTPListenerARN, region)
         return HTTPruleARN
     
     except Exception as e:
@@ -98,6 +85,222 @@ def addRuleToLoadBalancerHttp(domainName: str, targetGroupArn: str, priority: in
         return False
 
 
+# Method to create host based rule in listener, a free priority is used when priority is not passed
+@tracing.traced()
+def createListenerRule(domainName: str, actions: list, priority: int, listenerARN: str, region: str):
+    """_summary_
+
+    Args:
+        domainName (str): DNS to be matched for host in load balancer rule
+        actions (list): Actions of the rule
+        priority (int): Priority of the rule, None to use a free priority of the listener
+        listenerARN (str): ARN of the listener
+
+    Raises:
+        Exception: Rule could not be created
+
+    Returns:
+        _type_: ARN of the rule created
+    """
+    client = clientRegistry.getClient('elbv2', region)
+    index = getListenerRuleIndex(listenerARN, region)
+    for attempt in range(maxPriorityAttempts):
+        rulePriority = priority or allocatePriority(listenerARN, region)
+        try:
+            response = client.create_rule(
+                ListenerArn = listenerARN,
+                Priority = rulePriority,
+                Conditions = [
+                    {
+                        'Field': 'host-header',
+                        'Values': [domainName]
+                    }
+                ],
+                Actions = actions
+            )
+        except client.exceptions.PriorityInUseException:
+            # Another run took this priority after listener was read, it stays marked as used
+            if priority:
+                raise
+            logger.info(" Priority {} is already in use trying next free priority".format(rulePriority))
+            continue
+        except Exception:
+            if not priority:
+                releasePriority(index, rulePriority)
+            raise
+
+        ruleARN = response['Rules'][0]['RuleArn']
+        addRuleToIndex(index, ruleARN, rulePriority, [domainName])
+        return ruleARN
+    raise Exception("Unable to find free priority in listener {} after {} attempts".format(listenerARN, maxPriorityAttempts))
+
+
+# Method to reserve the lowest free priority of a listener
+def allocatePriority(listenerARN: str, region: str, lowestPriority: int = 1, highestPriority: int = maxRulePriority):
+    """_summary_
+
+    Args:
+        listenerARN (str): ARN of the listener
+        region (str): Region of the load balancer
+        lowestPriority (int): Lowest priority which can be used
+        highestPriority (int): Highest priority which can be used
+
+    Raises:
+        Exception: No priority is free in the range
+
+    Returns:
+        _type_: Priority which is marked as used in the listener rule index
+    """
+    index = getListenerRuleIndex(listenerARN, region)
+    with listenerRuleIndexLock:
+        # Priorities below the range are treated as used, lowest clear bit is the lowest free priority
+        usedPriorities = index['usedPriorities'] | ((1 << lowestPriority) - 1)
+        priority = (~usedPriorities & (usedPriorities + 1)).bit_length() - 1
+        if priority > highestPriority:
+            raise Exception("No free priority left between {} and {} in listener {}".format(lowestPriority, highestPriority, listenerARN))
+        index['usedPriorities'] |= 1 << priority
+        return priority
+
+
+# Method to free a priority reserved for a rule which was not created
+def releasePriority(index: dict, priority: int):
+    """_summary_
+
+    Args:
+        index (dict): Listener rule index
+        priority (int): Priority to be freed
+    """
+    with listenerRuleIndexLock:
+        index['usedPriorities'] &= ~(1 << priority)
+
+
+# Method to get host names matched by a listener rule
+def getRuleHostHeaders(rule: dict):
+    """_summary_
+
+    Args:
+        rule (dict): Rule as returned by describe_rules
+
+    Returns:
+        _type_: List of host header values of the rule
+    """
+    hostHeaders = []
+    for condition in rule['Conditions']:
+        if condition.get('Field') != 'host-header':
+            continue
+        hostHeaders.extend(condition.get('HostHeaderConfig', {}).get('Values', []) or condition.get('Values', []))
+    return hostHeaders
+
+
+# Method to get rule index of a listener, all the pages of rules are loaded on first use
+@tracing.traced()
+def getListenerRuleIndex(listenerARN: str, region: str):
+    """_summary_
+
+    Args:
+        listenerARN (str): ARN of the listener
+        region (str): Region of the load balancer
+
+    Returns:
+        _type_: Index with rules by host header, host headers by rule ARN and a bitmap of priorities in use
+    """
+    with listenerRuleIndexLock:
+        if listenerARN in listenerRuleIndexes:
+            return listenerRuleIndexes[listenerARN]
+        loadLock = listenerLoadLocks.setdefault(listenerARN, threading.Lock())
+
+    # Only runs reading the same listener wait for each other, the index is installed once it is complete
+    with loadLock:
+        with listenerRuleIndexLock:
+            if listenerARN in listenerRuleIndexes:
+                return listenerRuleIndexes[listenerARN]
+
+        client = clientRegistry.getClient('elbv2', region)
+        index = {'hosts': {}, 'rules': {}, 'usedPriorities': 0}
+        paginator = client.get_paginator('describe_rules')
+        for page in paginator.paginate(ListenerArn = listenerARN, PaginationConfig = {'PageSize': 400}):
+            for rule in page['Rules']:
+                priority = None if rule['IsDefault'] else int(rule['Priority'])
+                addRuleToIndex(index, rule['RuleArn'], priority, getRuleHostHeaders(rule))
+
+        with listenerRuleIndexLock:
+            listenerRuleIndexes[listenerARN] = index
+        logger.info(" Loaded {} rules of listener {}".format(len(index['rules']), listenerARN))
+        return index
+
+
+# Method to add a rule to listener rule index
+def addRuleToIndex(index: dict, ruleARN: str, priority: int, hostHeaders: list):
+    """_summary_
+
+    Args:
+        index (dict): Listener rule index
+        ruleARN (str): ARN of the rule
+        priority (int): Priority of the rule, None for default rule
+        hostHeaders (list): Host header values of the rule
+    """
+    with listenerRuleIndexLock:
+        for hostHeader in hostHeaders:
+            index['hosts'][hostHeader] = {'RuleArn': ruleARN, 'Priority': priority}
+        index['rules'][ruleARN] = {'Priority': priority, 'HostHeaders': list(hostHeaders)}
+        if priority is not None:
+            index['usedPriorities'] |= 1 << priority
+
+
+# Method to remove a deleted rule from all loaded listener rule indexes
+def removeRuleFromIndex(ruleARN: str):
+    """_summary_
+
+    Args:
+        ruleARN (str): ARN of the deleted rule
+    """
+    with listenerRuleIndexLock:
+        for index in listenerRuleIndexes.values():
+            rule = index['rules'].pop(ruleARN, None)
+            if rule is None:
+                continue
+            for hostHeader in rule['HostHeaders']:
+                if index['hosts'].get(hostHeader, {}).get('RuleArn') == ruleARN:
+                    del index['hosts'][hostHeader]
+            if rule['Priority'] is not None:
+                releasePriority(index, rule['Priority'])
+
+
+# Method to find rule of a host in listener
+def findRuleForHost(domainName: str, listenerARN: str, region: str):
+    """_summary_
+
+    Args:
+        domainName (str): Host name to be looked up
+        listenerARN (str): ARN of the listener
+        region (str): Region of the load balancer
+
+    Returns:
+        _type_: Rule ARN and priority of the host or None if host has no rule
+    """
+    return getListenerRuleIndex(listenerARN, region)['hosts'].get(domainName)
+
+
+# Method to check if listener rules still exist, used to verify rule ARNs recorded earlier
+def checkIfRulesExist(ruleARNs: list, region: str):
+    """_summary_
+
+    Args:
+        ruleARNs (list): ARNs of the listener rules
+        region (str): Region of the load balancer
+
+    Returns:
+        _type_: If all the rules exist
+    """
+    client = clientRegistry.getClient('elbv2', region)
+    try:
+        response = client.describe_rules(RuleArns = ruleARNs)
+        return len(response['Rules']) == len(ruleARNs)
+    except Exception as e:
+        print(str(e))
+        return False
+
+
 # Check if listener already exists
 def checkIfListenerExistsHTTPS(domainName: str, HTTTPSListenerARN: str, region: str):
     """`_summary_`
@@ -105,20 +308,12 @@ def checkIfListenerExistsHTTPS(domainName: str, HTTTPSListenerARN: str, region:
     Args:
         domainName (str): Domain name created for test env
         HTTTPSListenerARN (str):  HTTPS Listener ARN
+
+    Returns:
+        _type_: False if a rule for the domain already exists
     """
-    client = boto3.client('elbv2', region_name= region)
-    response = client.describe_rules(
-        ListenerArn = HTTTPSListenerARN,
-    )
-    for rules in response['Rules']:
-        for hostHeader in rules['Conditions']:
-            hostHeader = (hostHeader['Values'])
-            if domainName in hostHeader:
-                return False
-                break
-            else: 
-                return True
-                
+    return findRuleForHost(domainName, HTTTPSListenerARN, region) is None
+
 
 # Check if listener already exists
 def checkIfListenerExistsHTTP(domainName: str, HTTPListenerARN: str, region: str):
@@ -127,34 +322,28 @@ def checkIfListenerExistsHTTP(domainName: str, HTTPListenerARN: str, region: str
     Args:
         domainName (str): Domain name created for test env
         HTTPListenerARN (str):  HTTP Listener ARN
+
+    Returns:
+        _type_: False if a rule for the domain already exists
     """
-    client = boto3.client('elbv2', region_name= region)
-    response = client.describe_rules(
-        ListenerArn = HTTPListenerARN,
-    )
-    for rules in response['Rules']:
-        for hostHeader in rules['Conditions']:
-            hostHeader = (hostHeader['Values'])
-            if domainName in hostHeader:
-                return False
-                break
-            else: 
-                return True
-        
-        
+    return findRuleForHost(domainName, HTTPListenerARN, region) is None
+
+
 # Delete http rule from listener
+@tracing.traced()
 def deleteHTTPRuleLoadBalancer(httpRuleARN: str, region: str):
     """_summary_
 
     Args:
         ruleARN (str): Rule ARN of load balancer
     """
-    client = boto3.client('elbv2', region_name= region)
+    client = clientRegistry.getClient('elbv2', region)
     try:
         response = client.delete_rule(
             RuleArn = httpRuleARN
         )
     
+        removeRuleFromIndex(httpRuleARN)
         deleteRuleHTTPStatus = (response['ResponseMetadata']['HTTPStatusCode'])
         return deleteRuleHTTPStatus
     
@@ -163,18 +352,20 @@ def deleteHTTPRuleLoadBalancer(httpRuleARN: str, region: str):
         return False
 
 # Delete https rule from listener
+@tracing.traced()
 def deleteHTTPSRuleLoadBalancer(HTTPSRuleARN: str, region: str):
     """_summary_
 
     Args:
         ruleARN (str): Rule ARN of load balancer
     """
-    client = boto3.client('elbv2', region_name= region)
+    client = clientRegistry.getClient('elbv2', region)
     try:
         response = client.delete_rule(
             RuleArn = HTTPSRuleARN
         )
     
+        removeRuleFromIndex(HTTPSRuleARN)
         deleteRuleHTTPSStatus = (response['ResponseMetadata']['HTTPStatusCode'])
         return deleteRuleHTTPSStatus
     
@@ -191,16 +382,12 @@ def getHTTPRuleARN(hostHeader: str, HTTPListenerARN: str, region: str):
         hostHeader (str): host name for which listener rule to be fetched
 
     Returns:
-        _type_: _description_
+        _type_: Rule ARN or False if host has no rule
     """
-    client = boto3.client('elbv2', region_name= region)
-    listener_rules = client.describe_rules(ListenerArn=HTTPListenerARN)['Rules']
-    filtered_rules = [r for r in listener_rules if r['Conditions'] and r['Conditions'][0]['Values'][0] == hostHeader]
-    try:
-        httpRuleArn = filtered_rules[0]['RuleArn']
-        return httpRuleArn
-    except Exception as e:
+    rule = findRuleForHost(hostHeader, HTTPListenerARN, region)
+    if rule is None:
         return False
+    return rule['RuleArn']
 
 
 # Get ARN for HTTPS Rule
@@ -211,15 +398,9 @@ def getHTTPSRuleARN(hostHeader: str, HTTTPSListenerARN: str, region: str):
         hostHeader (str): host name for which listener rule to be fetched
 
     Returns:
-        _type_: _description_
+        _type_: Rule ARN or False if host has no rule
     """
-    client = boto3.client('elbv2', region_name= region)
-    listener_rules = client.describe_rules(ListenerArn=HTTTPSListenerARN)['Rules']
-    filtered_rules = [r for r in listener_rules if r['Conditions'] and r['Conditions'][0]['Values'][0] == hostHeader]
-    try:
-        httpsRuleArn = filtered_rules[0]['RuleArn']
-        return httpsRuleArn
-    except Exception as e:
+    rule = findRuleForHost(hostHeader, HTTTPSListenerARN, region)
+    if rule is None:
         return False
-    
-    
\ No newline at end of file
+    return rule['RuleArn']
@@ -7,7 +7,10 @@ import sys
 import logging
 import argparse
 import re 
-import random
+import uuid
+import json
+import hashlib
+import atexit
 from simple_colors import *
 
 
@@ -21,6 +24,13 @@ from application import application
 from healthCheck import healthChecks
 from kibana import kibana
 from secretManager import secretManager
+from stepGraph import stepGraph
+from teardown import teardown
+from reaper import reaper
+from stateStore import stateStore
+from preflight import preflight
+from tracing import tracing
+from apiStats import apiStats
 
 
 # Global variables
@@ -61,7 +71,24 @@ parser.add_argument('HTTPListenerARN', type=str, help='HTTP Listener ARN of load
 parser.add_argument('subnetID', type=str, help='Subnet Id in which workloads will run')
 parser.add_argument('securityGroupID', type=str, help='Security group ID to be used for ecs')
 parser.add_argument('kibanaURL', type=str, help='URL of kibana where application will be published')
-args = parser.parse_args()
+parser.add_argument('--injectSecrets', action='store_true', help='Inject every key of the secret into the container as environment variable through ECS instead of passing only the secret name')
+parser.add_argument('--secretOverride', action='append', default=[], metavar='KEY=VALUE', help='Value to be changed in the copy of the secret, secret is copied only when this is passed or secrets are not injected')
+
+# Reap works on environments of all users and needs only the shared settings, it is run as main.py reap <arguments>
+reapParser = argparse.ArgumentParser(description ='Cloud-dev -- Delete stale environments of all users')
+reapParser.add_argument('operation', type=str, choices=['reap'], help='Operation to be performed')
+reapParser.add_argument('ecsClusterName', type=str, help='Name of the ECS Cluster where all these ECS workloads will be running')
+reapParser.add_argument('region', type=str, help='Region in which all ECS workloads will be running ')
+reapParser.add_argument('awsAccountID', type=str, help='AWS Account ID in which all these resources will be running')
+reapParser.add_argument('HostedZoneId', type=str, help='ID of the Hosted Zone from Route 53 Console under which all domains for these were created')
+reapParser.add_argument('domainNameOfHostedZone', type=str, help='Route53 hosted zone name under which all records were created')
+reapParser.add_argument('loadBalancerDNSEndpoint', type=str, help='DNS of load balancer to which the route53 alias records point')
+reapParser.add_argument('AWSHostedZoneIDForLoadbalancerRegionBasis', type=str, help='AWS Has fixed hosted zone id for different type of Load balancer based on region that value to be passed details here https://docs.aws.amazon.com/general/latest/gr/elb.html')
+reapParser.add_argument('HTTTPSListenerARN', type=str, help='HTTPS Listener ARN of load balancer ')
+reapParser.add_argument('HTTPListenerARN', type=str, help='HTTP Listener ARN of load balancer')
+reapParser.add_argument('--delete', action='store_true', help='Delete the stale environments, without it or CLOUD_DEV_REAP_DRY_RUN=false they are only listed')
+
+args = reapParser.parse_args() if sys.argv[1:2] == ['reap'] else parser.parse_args()
 
 
 # Check if aws creds exists in env
@@ -91,8 +118,376 @@ def getUserName(email: str):
     UserNameFiltered = re.sub('\W+','', userNameFull)       # Remove special characters from username if any special characters are not allowed in task definition name
     return UserNameFiltered
 
+# Get the names of all resources of an environment, these are passed to the steps as initial outputs
+def getEnvironmentNames(userName: str):
+    ecsTaskDefinitionName = 'cloud-dev' + '-' + userName + '-' + args.appName      # cloud-dev is the prefix with which all the taskdefinition will be created
+    domainName = userName + '-' + args.appName
+    targetGroupNameShort = domainName[:31]                                            # Target group names are allowed to have only 32 characters long hence restricting it to 32 characters
+    targetGroupNameShort = re.sub('[^a-zA-Z0-9 \n\.]', '', targetGroupNameShort)      # Remove any special characters from target as special character at the end is not allowed
+    return {
+        'userName': userName,
+        'ecsTaskDefinitionName': ecsTaskDefinitionName,
+        'domainName': domainName,
+        'FullDomainName': domainName + '.' + args.domainNameOfHostedZone,
+        'targetGroupNameShort': targetGroupNameShort
+    }
+
+
+# Messages logged for resources found by pre-flight
+preflightConflictMessages = {
+    'ecsService': "ECS service with name {} already exists please consider using the same exiting",
+    'targetGroup': "Target group {} already exists please run delete before creating it again exiting",
+    'ecrRepo': "ECR Repo already exists with name of {} please consider using the same exiting",
+    'routeRecord': "DNS {} already exists with same name exiting",
+    'secret': "Secret {} already exists exiting"
+}
+
+# Check that nothing of the environment exists and the source secret does, all the checks are answered together
+def runPreflightChecks(environmentNames: dict):
+    try:
+        report = preflight.runPreflight(environmentNames['ecsTaskDefinitionName'], args.ecsClusterName, environmentNames['targetGroupNameShort'], args.appName, environmentNames['FullDomainName'], args.HostedZoneId, args.secretName, args.region)
+    except Exception as e:
+        logger.error(" Pre-flight checks failed {}".format(str(e)))
+        return False
+    # Copy of the secret is only made when the secret is not injected as it is
+    if not isSecretCopied() and 'secret' in report['conflicts']:
+        report['conflicts'].remove('secret')
+        report['passed'] = not report['conflicts'] and not report['missing']
+    for name in report['conflicts']:
+        logger.error(" " + preflightConflictMessages[name].format(report['resources'][name]))
+    if 'sourceSecret' in report['missing']:
+        logger.error(" Secret does not exist please make sure secret is present in aws account")
+    if report['passed']:
+        logger.info(" Pre-flight checks passed proceeding with creating all ECS resources")
+    return report['passed']
+
+
+# Get tags under which image is pushed, commit SHA tag is deployed and latest is kept for anyone pulling latest
+def getImageTagsToPush(imageTag: str):
+    if imageTag == 'latest':
+        return ['latest']
+    return [imageTag, 'latest']
+
+# Get idempotency token of a create call, reruns of the same create with the same parameters get the same token.
+# Parameters are part of it so that a rerun with changed inputs makes a new call instead of AWS failing on the reused token
+def getIdempotencyToken(createRunId: str, stepName: str, *parameters):
+    parametersHash = hashlib.sha256(json.dumps(parameters, sort_keys=True).encode()).hexdigest()
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, 'cloud-dev/{}/{}/{}'.format(createRunId, stepName, parametersHash)))
+
+# Create step to resolve commit of the branch, image is tagged with it
+def stepResolveCommit():
+    commitSHA = application.resolveBranchHead(args.gitRepoName, args.branchName, args.githubOrgName)
+    if not commitSHA:
+        logger.info(" Unable to resolve head of {} image will be tagged as latest".format(args.branchName))
+        return {'imageTag': 'latest'}
+    logger.info(" Head of {} is {}".format(args.branchName, commitSHA))
+    return {'imageTag': commitSHA}
+
+# Create step to clone the repo
+def stepCloneRepo(imageTag: str):
+    clonedRepo = application.clone_repo(args.gitRepoName, args.branchName, args.githubOrgName, None if imageTag == 'latest' else imageTag)
+    if not clonedRepo:
+        logger.error(" Unable to clone repo please check for error")
+        return False
+    logger.info(" Cloned {} repo".format(args.gitRepoName))
+    return {'clonedRepo': True}
+
+# Create step to build docker image
+def stepBuildImage(clonedRepo: bool, ecrRepoURI: str):
+    logger.info(" Building docker image ")
+    dockerImageBuild = application.buildDockerImage(args.gitRepoName, args.appName, args.branchName, ecrRepoURI, args.region)
+    if not dockerImageBuild:
+        logger.error(" Docker image build failed with error")
+        return False
+    logger.info(" Image built with name of {}".format(args.appName))
+    return {'imageBuilt': True}
+
+# Create step to create ECR repo, repo created by an earlier run of the same create is reused
+def stepCreateECRRepo(resuming: bool):
+    if resuming and application.checkIfECRRepoExists(args.appName, args.awsAccountID, args.region):
+        logger.info(" ECR repo {} was created by an earlier run".format(args.appName))
+        return {'ecrRepoName': args.appName, 'ecrRepoURI': args.awsAccountID + '.dkr.ecr.' + args.region + '.amazonaws.com/' + args.appName}
+    createECRRepoResponse = application.createECRRepo(args.appName, args.email, args.awsAccountID, args.region)
+    if not createECRRepoResponse:
+        logger.error(" Unable to create ECR repo please check for error")
+        return False
+    ecrRepoName, ecrRepoURI = createECRRepoResponse
+    logger.info(" ECR repo created with name of {} ".format(ecrRepoName))
+    return {'ecrRepoName': ecrRepoName, 'ecrRepoURI': ecrRepoURI}
+
+# Create step to push docker image to ECR
+def stepPushImage(imageBuilt: bool, ecrRepoName: str, imageTag: str):
+    imagePushedToECR = application.pushImageToECR(ecrRepoName, args.appName, args.awsAccountID, args.region, getImageTagsToPush(imageTag))
+    if not imagePushedToECR:
+        logger.error(" Unable to push image to ecr please check for error")
+        return False
+    logger.info(" Pushed image to ecr")
+    return {'imagePushed': True}
+
+# Get values passed to be changed in the copy of the secret
+def getSecretOverrides():
+    return dict(secretOverride.split('=', 1) for secretOverride in args.secretOverride)
+
+# Check if secret has to be copied for the environment, injected secret is used as it is unless values are overridden
+def isSecretCopied():
+    return not args.injectSecrets or bool(args.secretOverride)
+
+# Create step to inherit and create new secret in secret manager
+def stepCopySecret(ecsTaskDefinitionName: str, createRunId: str):
+    if not isSecretCopied():
+        secretDetails = secretManager.getSecretKeys(args.secretName, args.region)
+        if secretDetails is False:
+            logger.error(" Unable to read keys of secret {} please make sure it is JSON".format(args.secretName))
+            return False
+        secretARN, secretKeys = secretDetails
+        logger.info(" Keys of secret {} will be injected without copying it".format(args.secretName))
+        return {'secretName': args.secretName, 'secretARN': secretARN, 'secretKeys': secretKeys, 'secretCopied': False}
+
+    #sourceSecretName = args.sourceSecretName    # This will be sent as parameter when all the services will be moved to secret manager
+    createNewSecretSecretManager = secretManager.getAndCreateSecret(args.secretName, ecsTaskDefinitionName, args.email, args.region, getIdempotencyToken(createRunId, 'copySecret', args.secretName, getSecretOverrides()), getSecretOverrides())
+    if not createNewSecretSecretManager:
+        logger.error(" Unable to create secret in secret manager please check for error ")
+        return False
+    logger.info(" Secret has been created with name of {} in secret maanger".format(createNewSecretSecretManager))
+    secretARN, secretKeys = None, None
+    if args.injectSecrets:
+        secretDetails = secretManager.getSecretKeys(createNewSecretSecretManager, args.region)
+        if secretDetails is False:
+            return False
+        secretARN, secretKeys = secretDetails
+    return {'secretName': createNewSecretSecretManager, 'secretARN': secretARN, 'secretKeys': secretKeys, 'secretCopied': True}
+
+# Get secret used by an environment and if it is a copy made for it, recorded state is used when present
+def getEnvironmentSecret(ecsTaskDefinitionName: str):
+    recordedState = stateStore.getEnvironment(ecsTaskDefinitionName)
+    if 'secretCopied' in recordedState:
+        return recordedState['secretName'], recordedState['secretCopied']
+    if secretManager.checkIfSecretExists(ecsTaskDefinitionName, args.region):
+        return ecsTaskDefinitionName, True
+    return args.secretName, False
+
+# Create step to create task definition
+def stepCreateTaskDefinition(ecsTaskDefinitionName: str, ecrRepoURI: str, secretName: str, secretARN: str, secretKeys: list, imageTag: str):
+    ecsCreateTaskDefinitionResponse = taskDefinition.createTaskDefinition(ecsTaskDefinitionName, args.appName, ecrRepoURI, args.appName, args.containerPort, args.email, secretName, args.awsAccountID, args.iamRoleNameForEcsTasks, args.iamExecutionRoleName, args.elasticSearchEndpointForLogs, args.elastciUserName, args.elasticPassowrd, args.region, imageTag, secretKeys, secretARN)
+    if not ecsCreateTaskDefinitionResponse:
+        logger.error(" Unable to create task definition please check for error")
+        return False
+    taskDefinitionARN, taskDefinitionName = ecsCreateTaskDefinitionResponse
+    logger.info(" Task definition has been cretated with name of {}".format(taskDefinitionName))
+    return {'taskDefinitionARN': taskDefinitionARN}
+
+# Create step to create target group
+def stepCreateTargetGroup(targetGroupNameShort: str):
+    createTargetGroupResponse = targetGroup.createTargetGroup(targetGroupNameShort, args.containerPort, args.healthCheckPath, args.email, args.vpcId, args.region)
+    if not createTargetGroupResponse:
+        logger.error(" Unable to create target group please check for error ")
+        return False
+    targetGroupARN, targetGroupName = createTargetGroupResponse
+    logger.info(" Target group has been created with name of {} ".format(targetGroupName))
+    return {'targetGroupARN': targetGroupARN}
+
+# Create step to create R53 Entry, record created by an earlier run of the same create is reused
+def stepCreateRouteRecord(domainName: str, FullDomainName: str, resuming: bool):
+    if resuming and route53.checkIfRouteRecordExists(FullDomainName, args.HostedZoneId, args.region):
+        logger.info(" Domain {} was created by an earlier run".format(FullDomainName))
+        return {'routeRecordCreated': True}
+    createRoute53Response = route53.createR53Entry(domainName, args.domainNameOfHostedZone, args.HostedZoneId, args.loadBalancerDNSEndpoint, args.AWSHostedZoneIDForLoadbalancerRegionBasis, args.region)
+    if not createRoute53Response:
+        logger.error(" Unable to create domain for URL {}  please check for error".format(FullDomainName))
+        return False
+    logger.info(" Domain has been created and the URL is {}".format(FullDomainName))
+    return {'routeRecordCreated': True}
+
+# Create step to add https rule in listener of load balancer
+def stepAddHTTPSRule(FullDomainName: str, targetGroupARN: str, resuming: bool):
+    existingRule = loadBalancer.findRuleForHost(FullDomainName, args.HTTTPSListenerARN, args.region)
+    if resuming and existingRule:
+        logger.info(" https rule for {} was created by an earlier run".format(FullDomainName))
+        return {'httpsRuleARN': existingRule['RuleArn']}
+    checkIfHTTPSListenerxists = loadBalancer.checkIfListenerExistsHTTPS(FullDomainName, args.HTTTPSListenerARN, args.region)
+    if checkIfHTTPSListenerxists == False:
+        logger.error(" Host entry already exists with {} ".format(FullDomainName))
+        return False
+    # Priority should not matter as it is host based mapping in load balancer and not PATH Based hence the lowest free priority is used
+    AddListenerHTTPSResponseARN = loadBalancer.addRuleToLoadBalancerHttps(FullDomainName, targetGroupARN, None, args.HTTTPSListenerARN, args.region)
+    if not AddListenerHTTPSResponseARN:
+        logger.error(" Unable to add entry in listener in load balancer")
+        return False
+    logger.info(" DNS entry has been added in load balancer listener for https")
+    return {'httpsRuleARN': AddListenerHTTPSResponseARN}
+
+# Create step to add http rule in listener of load balancer
+def stepAddHTTPRule(FullDomainName: str, targetGroupARN: str, resuming: bool):
+    existingRule = loadBalancer.findRuleForHost(FullDomainName, args.HTTPListenerARN, args.region)
+    if resuming and existingRule:
+        logger.info(" http rule for {} was created by an earlier run".format(FullDomainName))
+        return {'httpRuleARN': existingRule['RuleArn']}
+    checkIfHTTPListenerExists = loadBalancer.checkIfListenerExistsHTTP(FullDomainName, args.HTTPListenerARN, args.region)
+    if checkIfHTTPListenerExists == False:
+        logger.error(" Host entry already exists with same name {} ".format(FullDomainName))
+        return False
+    AddListenerHTTPResponseARN = loadBalancer.addRuleToLoadBalancerHttp(FullDomainName, targetGroupARN, None, args.HTTPListenerARN, args.region)
+    if not AddListenerHTTPResponseARN:
+        logger.error(" Unable to add DNS in load balancer for http please check for error")
+        return False
+    logger.info(" DNS entry has been added in load balancer listener for http")
+    return {'httpRuleARN': AddListenerHTTPResponseARN}
+
+# Create step to create ecs service, the target group has to be attached to the listener before this
+def stepCreateService(ecsTaskDefinitionName: str, taskDefinitionARN: str, targetGroupARN: str, httpsRuleARN: str, httpRuleARN: str, imagePushed: bool, createRunId: str):
+    createECSServiceResponse = ecsService.createService(ecsTaskDefinitionName, taskDefinitionARN, targetGroupARN, args.appName, args.containerPort, args.email, args.ecsClusterName, args.subnetID, args.securityGroupID, args.region, getIdempotencyToken(createRunId, 'createService', taskDefinitionARN, targetGroupARN))
+    if not createECSServiceResponse:
+        logger.error(" Unable to create ECS service please check for error")
+        return False
+    ecsServiceName, ecsServiceARN = createECSServiceResponse
+    logger.info(" ECS service has been created with name of {} ".format(ecsServiceName))
+    return {'ecsServiceName': ecsServiceName, 'ecsServiceARN': ecsServiceARN}
+
+# Create step to create index in kibana, failure here does not stop the create
+def stepCreateIndexPattern():
+    createIndexPatternResponse = kibana.createIndexPattern(args.appName, args.kibanaURL)
+    if createIndexPatternResponse:
+        logger.info(" Index has been created in kibana with name {}".format(args.appName))
+    else:
+        logger.error(" Unable to create index in kibana please create index pattern in kibana manually")
+    return {'indexPatternCreated': bool(createIndexPatternResponse)}
+
+# Steps of create with the outputs they need from each other
+def getCreateSteps():
+    return [
+        stepGraph.step('resolveCommit', stepResolveCommit, provides=['imageTag']),
+        stepGraph.step('cloneRepo', stepCloneRepo, requires=['imageTag'], provides=['clonedRepo']),
+        stepGraph.step('buildImage', stepBuildImage, requires=['clonedRepo', 'ecrRepoURI'], provides=['imageBuilt']),
+        stepGraph.step('createECRRepo', stepCreateECRRepo, requires=['resuming'], provides=['ecrRepoName', 'ecrRepoURI']),
+        stepGraph.step('pushImage', stepPushImage, requires=['imageBuilt', 'ecrRepoName', 'imageTag'], provides=['imagePushed']),
+        stepGraph.step('copySecret', stepCopySecret, requires=['ecsTaskDefinitionName', 'createRunId'], provides=['secretName', 'secretARN', 'secretKeys', 'secretCopied']),
+        stepGraph.step('createTaskDefinition', stepCreateTaskDefinition, requires=['ecsTaskDefinitionName', 'ecrRepoURI', 'secretName', 'secretARN', 'secretKeys', 'imageTag'], provides=['taskDefinitionARN']),
+        stepGraph.step('createTargetGroup', stepCreateTargetGroup, requires=['targetGroupNameShort'], provides=['targetGroupARN']),
+        stepGraph.step('createRouteRecord', stepCreateRouteRecord, requires=['domainName', 'FullDomainName', 'resuming'], provides=['routeRecordCreated']),
+        stepGraph.step('addHTTPSRule', stepAddHTTPSRule, requires=['FullDomainName', 'targetGroupARN', 'resuming'], provides=['httpsRuleARN']),
+        stepGraph.step('addHTTPRule', stepAddHTTPRule, requires=['FullDomainName', 'targetGroupARN', 'resuming'], provides=['httpRuleARN']),
+        stepGraph.step('createService', stepCreateService, requires=['ecsTaskDefinitionName', 'taskDefinitionARN', 'targetGroupARN', 'httpsRuleARN', 'httpRuleARN', 'imagePushed', 'createRunId'], provides=['ecsServiceName', 'ecsServiceARN']),
+        stepGraph.step('createIndexPattern', stepCreateIndexPattern, provides=['indexPatternCreated']),
+    ]
+
+
+# Check that what a step of an earlier run made still exists, steps without a check are kept as they are
+def getCompletedStepChecks():
+    # Checkout and local image are gone once the builder exits, image steps are only kept when the image is in ECR
+    imagePushed = lambda outputs: outputs['imageTag'] != 'latest' and application.checkIfImageExistsInECR(args.appName, outputs['imageTag'], args.awsAccountID, args.region)
+    return {
+        'cloneRepo': imagePushed,
+        'buildImage': imagePushed,
+        'pushImage': imagePushed,
+        'createECRRepo': lambda outputs: application.checkIfECRRepoExists(outputs['ecrRepoName'], args.awsAccountID, args.region),
+        'copySecret': lambda outputs: not outputs['secretCopied'] or secretManager.checkIfSecretExists(outputs['secretName'], args.region),
+        'createTaskDefinition': lambda outputs: (taskDefinition.getLatestTaskDefinition(outputs['ecsTaskDefinitionName'], args.region) or [None])[0] == outputs['taskDefinitionARN'],
+        'createTargetGroup': lambda outputs: targetGroup.checkIfTargetGroupExists(outputs['targetGroupARN'], args.region),
+        'createRouteRecord': lambda outputs: route53.checkIfRouteRecordExists(outputs['FullDomainName'], args.HostedZoneId, args.region),
+        'addHTTPSRule': lambda outputs: loadBalancer.checkIfRulesExist([outputs['httpsRuleARN']], args.region),
+        'addHTTPRule': lambda outputs: loadBalancer.checkIfRulesExist([outputs['httpRuleARN']], args.region),
+        'createService': lambda outputs: ecsService.getServiceStatus(outputs['ecsServiceName'], args.ecsClusterName, args.region) == 'ACTIVE'
+    }
+
+# Keep only the steps of an earlier run whose resources still exist, steps which need outputs of a dropped step are run again as well
+def validateCompletedSteps(completedSteps: dict, environmentNames: dict):
+    outputs = dict(environmentNames)
+    for stepOutputs in completedSteps.values():
+        outputs.update(stepOutputs)
+    validSteps = dict(completedSteps)
+    for stepName, check in getCompletedStepChecks().items():
+        if stepName not in validSteps:
+            continue
+        try:
+            valid = check(outputs)
+        except Exception as e:
+            logger.info(" Unable to check step {} of earlier run {}".format(stepName, str(e)))
+            valid = False
+        if not valid:
+            logger.info(" What step {} made in an earlier run is gone it will be run again".format(stepName))
+            del validSteps[stepName]
+
+    providers = {output: stepDefinition['name'] for stepDefinition in getCreateSteps() for output in stepDefinition['provides']}
+    dropped = True
+    while dropped:
+        dropped = False
+        for stepDefinition in getCreateSteps():
+            if stepDefinition['name'] in validSteps and any(providers[output] not in validSteps for output in stepDefinition['requires'] if output in providers):
+                logger.info(" Step {} depends on a step which is run again it will be run again".format(stepDefinition['name']))
+                del validSteps[stepDefinition['name']]
+                dropped = True
+    return validSteps
+
+# Get ARNs of listener rules and target group of an environment, recorded state is used unless it is out of date
+def getLoadBalancerResources(ecsTaskDefinitionName: str, FullDomainName: str, targetGroupNameShort: str):
+    recordedState = stateStore.getEnvironment(ecsTaskDefinitionName)
+    resources = {name: recordedState.get(name) for name in ('httpRuleARN', 'httpsRuleARN', 'targetGroupARN')}
+    # Recorded ARNs are checked with one describe each instead of scanning both listeners
+    if all(resources.values()) and loadBalancer.checkIfRulesExist([resources['httpRuleARN'], resources['httpsRuleARN']], args.region) and targetGroup.checkIfTargetGroupExists(resources['targetGroupARN'], args.region):
+        logger.info(" Using recorded state of {}".format(ecsTaskDefinitionName))
+        return resources
+
+    logger.info(" Recorded state of {} is missing or out of date looking up resources".format(ecsTaskDefinitionName))
+    getTargetGroupARN = targetGroup.getTargetGroupARN(targetGroupNameShort, args.region)
+    if not getTargetGroupARN:
+        logger.error(" Unable to get target group ARN")
+    return {
+        'httpRuleARN': loadBalancer.getHTTPRuleARN(FullDomainName, args.HTTPListenerARN, args.region) or None,
+        'httpsRuleARN': loadBalancer.getHTTPSRuleARN(FullDomainName, args.HTTTPSListenerARN, args.region) or None,
+        'targetGroupARN': getTargetGroupARN or None
+    }
+
+# Remove everything created when the app does not come up after create
+def rollbackCreate(outputs: dict):
+    teardownResponse = teardown.runTeardown({
+        'ecsServiceName': outputs.get('ecsServiceName'),
+        'ecsClusterName': args.ecsClusterName,
+        'ecsTaskDefinitionName': outputs.get('ecsTaskDefinitionName'),
+        'hostName': outputs.get('domainName'),
+        'domainNameOfHostedZone': args.domainNameOfHostedZone,
+        'HostedZoneId': args.HostedZoneId,
+        'loadBalancerDNSEndpoint': args.loadBalancerDNSEndpoint,
+        'AWSHostedZoneIDForLoadbalancerRegionBasis': args.AWSHostedZoneIDForLoadbalancerRegionBasis,
+        'ecrRepoName': outputs.get('ecrRepoName'),
+        'registryId': args.awsAccountID,
+        # Injected secret is the source secret and is not deleted
+        'secretName': outputs.get('secretName') if outputs.get('secretCopied') else None,
+        'httpRuleARN': outputs.get('httpRuleARN'),
+        'httpsRuleARN': outputs.get('httpsRuleARN'),
+        'targetGroupARN': outputs.get('targetGroupARN'),
+        'region': args.region
+    })
+    # Steps of this run are not resumed after a rollback even when it failed, next create starts with pre-flight
+    stateStore.clearStepOutputs(outputs['ecsTaskDefinitionName'])
+    if teardownResponse:
+        logger.info(" Rolled back all resources of {}".format(outputs.get('FullDomainName')))
+        stateStore.deleteEnvironment(outputs['ecsTaskDefinitionName'])
+    else:
+        logger.error(" Unable to roll back all resources please check for error, run delete before creating it again")
+
+# Delete environments of all users in the cluster which are past TTL or idle
+def reap():
+    if not checkIfEnvExists():
+        logger.error(" Could not find aws creds in env exiting")
+        sys.exit(1)
+
+    dryRun = reaper.reapDryRun and not args.delete
+    if dryRun:
+        logger.info(" Dry run, stale environments are only listed pass --delete or set CLOUD_DEV_REAP_DRY_RUN=false to delete them")
+    reapedEnvironments, failedEnvironments = reaper.reapStaleEnvironments(args.ecsClusterName, args.domainNameOfHostedZone, args.HostedZoneId, args.loadBalancerDNSEndpoint, args.AWSHostedZoneIDForLoadbalancerRegionBasis, args.HTTPListenerARN, args.HTTTPSListenerARN, args.awsAccountID, args.region, dryRun)
+    for ecsServiceName in reapedEnvironments:
+        logger.info(" Reaped {}".format(ecsServiceName))
+    if failedEnvironments:
+        logger.error(" Unable to reap {} please check for error".format(failedEnvironments))
+        sys.exit(1)
+
 # Main function
 def main():
+    # Reap does not act for a user hence it has no email to validate
+    if args.operation == 'reap':
+        reap()
+        return
+
     # Validate user email address
     emailValidated = validateEmail(args.email, args.companyEmailDomain)
     if emailValidated:
@@ -113,350 +508,198 @@ def main():
     
     
     if args.operation == 'create':
-        # cloud-dev is the prefix with which all the taskdefinition will be created
-        ecsTaskDefinitionName = 'cloud-dev' + '-' + userName + '-' + args.appName 
-        secretName = 'cloud-dev' + '-' + userName + '-' + args.appName
-        # Check if ecs service exists 
-        checkIfEcsServiceExists = ecsService.checkIfServiceExists(ecsTaskDefinitionName, args.ecsClusterName, args.region, args.awsAccountID)
-        if checkIfEcsServiceExists:
-            logger.error(" ECS service with name {} already exists please consider using the same exiting".format(ecsTaskDefinitionName))
-            sys.exit(1)
-        else:
-            logger.info(" Service does not exist proceeding with creating all ECS resources ")
-            
-        # Check if ECR Repo exists 
-        checkIfECRRepoExistsResponse = application.checkIfECRRepoExists(args.appName, args.awsAccountID, args.region)
-        if checkIfECRRepoExistsResponse:
-            logger.error(" ECR Repo already exists with name of {} please consider using the same exiting".format(args.appName))
-            sys.exit(1)
-        else:
-            logger.info(" ECR Repo does not exist proceeding")
-        
-        # Check if route 53 record exist 
-        domainName = userName + '-' + args.appName 
-        checkIfRouteRecordExistsResponse = route53.checkIfRouteRecordExists(domainName, args.HostedZoneId, args.region)
-        if checkIfRouteRecordExistsResponse:
-            logger.error(" DNS already exists with same name exiting")
-            sys.exit(1)
-        else:
-            logger.info(" DNS Doesnot exist proceeding")
-           
-        # Check if secret exists 
-        checkIfSecretExistsResponse = secretManager.checkIfSecretExists(args.secretName, region)
-        if checkIfSecretExistsResponse:
-            logger.info(" Secret exists proceeding")
+        environmentNames = getEnvironmentNames(userName)
+        environmentName = environmentNames['ecsTaskDefinitionName']
+
+        # Steps finished by an earlier run which failed are not run again, pre-flight would fail on what that run created
+        completedSteps = stateStore.getStepOutputs(environmentName)
+        createRunId = stateStore.getEnvironment(environmentName).get('createRunId')
+        resuming = bool(completedSteps and createRunId)
+        if resuming:
+            logger.info(" Resuming create of {} from the first unfinished step".format(environmentName))
+            completedSteps = validateCompletedSteps(completedSteps, environmentNames)
         else:
-            logger.error(" Secret does not exist please make sure secret is present in aws account")
-            sys.exit(1)
-        
-        
-        clonedRepo = application.clone_repo(args.gitRepoName, args.branchName, args.githubOrgName)
-        if clonedRepo:
-            logger.info(" Cloned {} repo".format(args.gitRepoName))
-            logger.info(" Building docker image ")
-            dockerImageBuild = application.buildDockerImage(args.gitRepoName, args.appName)
-            if dockerImageBuild:
-                logger.info(" Image built with name of {}".format(args.appName))
-                ecrRepoName, ecrRepoURI = application.createECRRepo(args.appName, args.email, args.awsAccountID, args.region)
-                if ecrRepoName:
-                    logger.info(" ECR repo created with name of {} ".format(ecrRepoName))
-                    imagePushedToECR = application.pushImageToECR(ecrRepoName, args.appName, args.region)
-                    if imagePushedToECR:
-                        logger.info(" Pushed image to ecr")
-                    else:
-                        logger.error(" Unable to push image to ecr please check for error")
-                else:
-                    logger.error(" Unable to create ECR repo please check for error")
-            else:
-                logger.error(" Docker image build failed with error")
+            if not runPreflightChecks(environmentNames):
                 sys.exit(1)
-        else:
-            logger.error(" Unable to clone repo please check for error")
-            sys.exit(1)
-        
-        # Inherit and create new secret in secret manager
-        #sourceSecretName = args.sourceSecretName    # This will be sent as parameter when all the services will be moved to secret manager
-        createNewSecretSecretManager = secretManager.getAndCreateSecret(args.secretName, ecsTaskDefinitionName, args.email, args.region)
-        if createNewSecretSecretManager:
-            logger.info(" Secret has been created with name of {} in secret maanger".format(createNewSecretSecretManager))
-        else:
-            logger.error(" Unable to create secret in secret manager please check for error ")
-            
-        # create task definition
-        ecsCreateTaskDefinitionResponse = taskDefinition.createTaskDefinition(ecsTaskDefinitionName, args.appName, ecrRepoURI, args.appName, args.containerPort, args.email, createNewSecretSecretManager, args.awsAccountID, args.iamRoleNameForEcsTasks, args.iamExecutionRoleName, args.elasticSearchEndpointForLogs, args.elastciUserName, args.elasticPassowrd, args.region)
-        taskDefinitionARN, taskDefinitionName = ecsCreateTaskDefinitionResponse[0], ecsCreateTaskDefinitionResponse[1]
-        if ecsCreateTaskDefinitionResponse:
-            logger.info(" Task definition has been cretated with name of {}".format(ecsTaskDefinitionName))
-        else:
-            logger.error(" Unable to create task definition please check for error")
-        
-        # create target group
-        targetGroupNameFull = userName + '-' + args.appName             # Target group will be created based on username and app name being passed 
-        targetGroupNameShort = targetGroupNameFull[:31]                 # Target group names are allowed to have only 32 characters long hence restricting it to 32 characters 
-        targetGroupNameShort = re.sub('[^a-zA-Z0-9 \n\.]', '', targetGroupNameShort)    # Remove any special characters from target as special character at the end is not allowed 
-        createTargetGroupResponse = targetGroup.createTargetGroup(targetGroupNameShort, args.containerPort, args.healthCheckPath, args.email, args.vpcId, args.region)
-        targetGroupARN, targetGroupNameShort  = createTargetGroupResponse[0], createTargetGroupResponse[1]
-        if createTargetGroupResponse:
-            logger.info(" Target group has been created with name of {} ".format(targetGroupNameShort))
-        else:
-            logger.error(" Unable to create target group please check for error ")
-            sys.exit(1)
-        
-        # create R53 Entry
-        domainName = targetGroupNameFull
-        FullDomainName = domainName + '.' + args.domainNameOfHostedZone
-        createRoute53Response = route53.createR53Entry(domainName, args.domainNameOfHostedZone, args.HostedZoneId, args.loadBalancerDNSEndpoint, args.AWSHostedZoneIDForLoadbalancerRegionBasis, args.region)
-        if createRoute53Response:
-            logger.info(" Domain has been created and the URL is {}".format(FullDomainName))
-        else:
-            logger.error(" Unable to create domain for URL {}  please check for error".format(FullDomainName))
-            sys.exit(1)
-    
-        # Add http and https in listener of load balancer generating and picking random int to assign priority it should not matter as it is host based mapping in load balancer and not PATH Based
-        randomPriorityHttps = random.randint(1,1000)
-        randomPriorityHttp = random.randint(1001,2000)
-        checkIfHTTPSListenerxists = loadBalancer.checkIfListenerExistsHTTPS(FullDomainName, args.HTTTPSListenerARN, args.region)
-        if checkIfHTTPSListenerxists == False:
-            logger.error(" Host entry already exists with {} ".format(FullDomainName))
+            completedSteps = {}
+            createRunId = uuid.uuid4().hex
+            stateStore.clearStepOutputs(environmentName)
+            stateStore.saveEnvironment(environmentName, {'createRunId': createRunId})
+
+        # Independent steps like target group, DNS, secret and kibana run while the image is being built
+        initialOutputs = dict(environmentNames, createRunId=createRunId, resuming=resuming)
+        outputs, failedSteps, skippedSteps = stepGraph.runSteps(
+            getCreateSteps(),
+            initialOutputs,
+            completedSteps=completedSteps,
+            onStepFinished=lambda stepName, stepOutputs: stateStore.saveStepOutputs(environmentName, stepName, stepOutputs),
+            graphName='create'
+        )
+        if failedSteps:
+            logger.error(" Create failed at {} please check for error, run create again to resume from the failed step".format(', '.join(failedSteps)))
+            if skippedSteps:
+                logger.error(" Steps not run because of it {}".format(', '.join(skippedSteps)))
             sys.exit(1)
-        else:
-            AddListenerHTTPSResponseARN = loadBalancer.addRuleToLoadBalancerHttps(FullDomainName, targetGroupARN, randomPriorityHttps, args.HTTTPSListenerARN, args.region)
-            if AddListenerHTTPSResponseARN:
-                logger.info(" DNS entry has been added in load balancer listener for https")
-            else:
-                logger.error(" Unable to add entry in listener in load balancer")
-                
-            checkIfHTTPListenerExists = loadBalancer.checkIfListenerExistsHTTP(FullDomainName, args.HTTPListenerARN, args.region)
-            if checkIfHTTPListenerExists == False:
-                logger.error(" Host entry already exists with same name {} ".format(FullDomainName))
-                sys.exit(1)
-            else:
-                AddListenerHTTPResponseARN = loadBalancer.addRuleToLoadBalancerHttp(FullDomainName, targetGroupARN, randomPriorityHttp, args.HTTPListenerARN, args.region)
-                if AddListenerHTTPResponseARN:
-                    logger.info(" DNS entry has been added in load balancer listener for http")
-                else:
-                    logger.error(" Unable to add DNS in load balancer for http please check for error")
-    
-        # Create ecs service 
-        createECSServiceResponse = ecsService.createService(ecsTaskDefinitionName, ecsTaskDefinitionName, targetGroupARN, args.appName, args.containerPort, args.email, args.ecsClusterName, args.subnetID, args.securityGroupID, args.region)
-        ecsServiceName , ecsServiceARN = createECSServiceResponse[0], createECSServiceResponse[1]
-        try:
-            if createECSServiceResponse:
-                logger.info(" ECS service has been created with name of {} ".format(ecsServiceName))
-            else:
-                logger.error(" Unable to create ECS service please check for error")
-        except Exception as e:
-            print(str(e))
-    
-        
-        # Create index in kibana
-        createIndexPatternResponse= kibana.createIndexPattern(args.appName, args.kibanaURL)
-        if createIndexPatternResponse:
-            logger.info(" Index has been created in kibana with name {}".format(args.appName))
-        else:
-            logger.error(" Unable to create index in kibana please create index pattern in kibana manually")
 
-                
+        # Every resource is recorded so that update and delete do not have to look them up again
+        stateStore.saveEnvironment(outputs['ecsTaskDefinitionName'], {
+            'ecsServiceName': outputs['ecsServiceName'],
+            'ecsServiceARN': outputs['ecsServiceARN'],
+            'taskDefinitionARN': outputs['taskDefinitionARN'],
+            'targetGroupARN': outputs['targetGroupARN'],
+            'httpRuleARN': outputs['httpRuleARN'],
+            'httpsRuleARN': outputs['httpsRuleARN'],
+            'ecrRepoURI': outputs['ecrRepoURI'],
+            'secretName': outputs['secretName'],
+            'secretCopied': outputs['secretCopied'],
+            'imageTag': outputs['imageTag'],
+            'deregistrationDelaySeconds': targetGroup.deregistrationDelaySeconds
+        })
+
         # Health check for service endpoint
-        healthCheckResponse = healthChecks.pingHealthEndpoint(FullDomainName, args.healthCheckPath)
+        FullDomainName = outputs['FullDomainName']
+        healthCheckResponse = healthChecks.pingHealthEndpoint(FullDomainName, args.healthCheckPath, outputs['ecsServiceName'], args.ecsClusterName, outputs['targetGroupARN'], args.region)
         if healthCheckResponse:
             logger.info(" Health check passed for URL {} ".format(FullDomainName))
+            stateStore.clearStepOutputs(environmentName)
         else:
             logger.error(" Health check failed for URL {} please check kibana for error".format(FullDomainName))
-            
-            # Delete ecs service
-            ecsServiceDeleteResponse = ecsService.deleteEcsService(ecsServiceName, args.ecsClusterName, args.region)
-            if ecsServiceDeleteResponse:
-                logger.info(" ECS service {} deleted ".format(ecsServiceName))
-            else:
-                logger.error(" Unable to delete ECS service {}".format(ecsServiceName))
-                
-            # Delete http rule from load balancer
-            deleteRuleHTTPResponse = loadBalancer.deleteHTTPRuleLoadBalancer(AddListenerHTTPResponseARN, args.region)
-            logger.info(" Deleted entry from load balancer for http")
-            if deleteRuleHTTPResponse:
-            # Delete https rule from load balancer
-                deleteRuleHTTPSResponse = loadBalancer.deleteHTTPSRuleLoadBalancer(AddListenerHTTPSResponseARN, args.region)
-                if deleteRuleHTTPSResponse:
-                    logger.info(" Deleted entry from load balancer for https")
-                else:
-                    logger.error(" Unable to delete rule from load balancer for https")
-            else:
-                logger.error(" Unable to delete rule from load balancer for http")
-                    
-            # Delete target group 
-            deleteTargetGroup = targetGroup.deleteTargetGroup(targetGroupARN, args.region)
-            if deleteTargetGroup:
-                logger.info(" Deleted target group ")
-            else:
-                logger.error(" Unable to delete target group ")
-                    
-            # Delete Route53 entry
-            deleteR53EntryResponse = route53.DeleteR53Entry(domainName, args.domainNameOfHostedZone, args.HostedZoneId, args.loadBalancerDNSEndpoint, args.AWSHostedZoneIDForLoadbalancerRegionBasis, args.region)
-            if deleteR53EntryResponse:
-                logger.info(" Deleted r53 entry {}".format(FullDomainName))
-            else:
-                logger.error(" Unable to delete r53 entry {}".format(FullDomainName))
-                
-            
-            #List all revisions of Taskdefinitions
-            listTaskDefinitionARNS = taskDefinition.listTaskDefinitionARNS(ecsTaskDefinitionName, args.region)
-            if (len(listTaskDefinitionARNS)) == 0:
-                logger.info(" No task definition matched with name of {} ".format(ecsTaskDefinitionName))
-            else:
-                logger.info(" Found task definitions with name of {} de-registering all the revisions".format(ecsTaskDefinitionName))   
-            # De-Register task definition 
-            deRegisterTaskDefinitionResponse = taskDefinition.deRegisterTaskDefinition(listTaskDefinitionARNS, args.region)
-            if deRegisterTaskDefinitionResponse:
-                logger.info(" Task definition de-registered")
-            else:
-                logger.error(" Unble to de-register task definition")
-            
-            # Delete ECR Repo
-            deleteECRRepoResponse = application.deleteECRRepo(args.appName, args.awsAccountID, args.region)
-            if deleteECRRepoResponse:
-                logger.info(" ECR repo deleted")
-            else:
-                logger.error(" Unable to delete ECR Repo")
-                
-            # Delete secret from secret manager 
-            deleteSecretRepoResponse = secretManager.deleteSecret(createNewSecretSecretManager)
-            if deleteSecretRepoResponse:
-                logger.info(" Secret deleted from secret manager")
-            else:
-                logger.error(" Unable to delete secret from secret manager")
-    
+            rollbackCreate(outputs)
+
     elif args.operation == 'update':
         ecsTaskDefinitionName = 'cloud-dev' + '-' + userName + '-' + args.appName 
         ecrRepoURI = args.awsAccountID + '.dkr.ecr.' + args.region + '.amazonaws.com/' + args.appName
-        checkIfEcsServiceExistsUpdated = ecsService.checkIfServiceExists(ecsTaskDefinitionName)
-        if checkIfEcsServiceExistsUpdated:
+        # Service recorded by create is not looked up again, update_service fails if it is gone
+        recordedState = stateStore.getEnvironment(ecsTaskDefinitionName)
+        if recordedState.get('ecsServiceARN'):
+            logger.info(" Found recorded service with name {} proceeding with re-deployment".format(ecsTaskDefinitionName))
+        elif ecsService.checkIfServiceExists(ecsTaskDefinitionName, args.ecsClusterName, args.region, args.awsAccountID):
             logger.info(" Found service with name {} proceeding with re-deployment".format(ecsTaskDefinitionName))
         else:
             logger.error(" Unable to find service with name {} please check app name passed ".format(ecsTaskDefinitionName))
             sys.exit(1)
             
-        clonedRepo = application.clone_repo(args.gitRepoName, args.branchName)
-        if clonedRepo:
-            logger.info(" Cloned {} repo".format(args.gitRepoName))
-            logger.info(" Building docker image ")
-            dockerImageBuild = application.buildDockerImage(args.gitRepoName, args.appName)
-            if dockerImageBuild:
-                logger.info(" Image built with name of {}".format(args.appName))
-                imagePushedToECR = application.pushImageToECR(args.appName, args.appName, args.region)
-                if imagePushedToECR:
-                    logger.info(" Pushed image to ECR")
+        # Image of a commit is immutable, when it is already in ECR clone, build and push are skipped
+        imageTag = stepResolveCommit()['imageTag']
+        if imageTag != 'latest' and application.checkIfImageExistsInECR(args.appName, imageTag, args.awsAccountID, args.region):
+            logger.info(" Image for commit {} already exists in ECR skipping build".format(imageTag))
+        else:
+            clonedRepo = application.clone_repo(args.gitRepoName, args.branchName, args.githubOrgName, None if imageTag == 'latest' else imageTag)
+            if clonedRepo:
+                logger.info(" Cloned {} repo".format(args.gitRepoName))
+                logger.info(" Building docker image ")
+                dockerImageBuild = application.buildDockerImage(args.gitRepoName, args.appName, args.branchName, ecrRepoURI, args.region)
+                if dockerImageBuild:
+                    logger.info(" Image built with name of {}".format(args.appName))
+                    imagePushedToECR = application.pushImageToECR(args.appName, args.appName, args.awsAccountID, args.region, getImageTagsToPush(imageTag))
+                    if imagePushedToECR:
+                        logger.info(" Pushed image to ECR")
+                    else:
+                        logger.error(" Unable to push image to ECR")
+                        sys.exit(1)
                 else:
-                    logger.error(" Unable to push image to ECR")
+                    logger.error(" Docker image build failed with error")
+                    sys.exit(1)
             else:
-                logger.error(" Docker image build failed with error")
+                logger.error(" Unable to clone repo please check for error")
                 sys.exit(1)
-        else:
-            logger.error(" Unable to clone repo please check for error")
-            sys.exit(1)
 
         
+        # Secret used by create is passed again so that unchanged content reuses the revision, keys are read again as the secret may have new ones
+        secretName, _ = getEnvironmentSecret(ecsTaskDefinitionName)
+        secretARN, secretKeys = None, None
+        if args.injectSecrets:
+            secretDetails = secretManager.getSecretKeys(secretName, args.region)
+            if secretDetails is False:
+                logger.error(" Unable to read keys of secret {} please make sure it is JSON".format(secretName))
+                sys.exit(1)
+            secretARN, secretKeys = secretDetails
+
         # Create new revision of task definition 
-        updatedecsCreateTaskDefinitionResponse = taskDefinition.updateTaskDefinition(ecsTaskDefinitionName, args.appName, ecrRepoURI, args.appName, args.containerPort, args.email, args.secretName, args.awsAccountID, args.iamRoleNameForEcsTasks, args.iamExecutionRoleName, args.elasticSearchEndpointForLogs, args.elastciUserName, args.elasticPassowrd, args.region)
-        updatedtaskDefinitionARN, updatedtaskDefinitionName = updatedecsCreateTaskDefinitionResponse[0], updatedecsCreateTaskDefinitionResponse[1]
+        updatedecsCreateTaskDefinitionResponse = taskDefinition.updateTaskDefinition(ecsTaskDefinitionName, args.appName, ecrRepoURI, args.appName, args.containerPort, args.email, secretName, args.awsAccountID, args.iamRoleNameForEcsTasks, args.iamExecutionRoleName, args.elasticSearchEndpointForLogs, args.elastciUserName, args.elasticPassowrd, args.region, imageTag, secretKeys, secretARN)
         if updatedecsCreateTaskDefinitionResponse:
+            updatedtaskDefinitionARN, updatedtaskDefinitionName = updatedecsCreateTaskDefinitionResponse
             logger.info(" Task definition has been cretated with name of {}".format(updatedtaskDefinitionName))
         else:
             logger.error(" Unable to create task definition please check for error")
+            sys.exit(1)
             
+        # Old tasks drain for the deregistration delay of the target group, environments created before it was set still have the 300s default
+        if recordedState.get('deregistrationDelaySeconds') != targetGroup.deregistrationDelaySeconds:
+            targetGroupARN = recordedState.get('targetGroupARN') or targetGroup.getTargetGroupARN(getEnvironmentNames(userName)['targetGroupNameShort'], args.region)
+            if targetGroupARN and targetGroup.setDeregistrationDelay(targetGroupARN, args.region):
+                logger.info(" Deregistration delay of target group set to {} seconds".format(targetGroup.deregistrationDelaySeconds))
+                stateStore.saveEnvironment(ecsTaskDefinitionName, {'targetGroupARN': targetGroupARN, 'deregistrationDelaySeconds': targetGroup.deregistrationDelaySeconds})
+            else:
+                logger.error(" Unable to set deregistration delay of target group old tasks will drain for the default time")
+
         # Update ecs service with new task definition revision 
         updateECSServiceResponse = ecsService.updateECSService(updatedtaskDefinitionName, updatedtaskDefinitionARN, args.ecsClusterName, args.region)
         if updateECSServiceResponse:
             logger.info(" ECS Service {} is updated with new task definition revision".format(updatedtaskDefinitionName))
+            stateStore.saveEnvironment(ecsTaskDefinitionName, {'taskDefinitionARN': updatedtaskDefinitionARN, 'imageTag': imageTag})
         else:
-            logger.error(" Unable to update ecs service with new task definition revision please check for error")
+            logger.error(" Unable to roll out new task definition revision on ecs service please check for error")
+            # Recorded state may be out of date, next run looks the resources up again
+            stateStore.deleteEnvironment(ecsTaskDefinitionName)
+            sys.exit(1)
+
+        # Remove old revisions of task definition keeping the last few for rollback
+        garbageCollectResponse = taskDefinition.garbageCollectTaskDefinitions(ecsTaskDefinitionName, args.region, keepLast=max(taskDefinition.keepTaskDefinitionRevisions, 1))
+        if garbageCollectResponse:
+            logger.info(" Old task definition revisions removed")
+        else:
+            logger.error(" Unable to remove old task definition revisions")
 
     
     elif args.operation == 'delete':
-        secretName = 'cloud-dev' + '-' + userName + '-' + args.appName
         ecsTaskDefinitionName = 'cloud-dev' + '-' + userName + '-' + args.appName 
+        # Only a copy made for the environment is deleted, injected source secret is shared
+        secretName, secretCopied = getEnvironmentSecret(ecsTaskDefinitionName)
         ecsServiceName = 'cloud-dev' + '-' + userName + '-' + args.appName 
         domainName = userName + '-' + args.appName 
         FullDomainName = domainName + '.' + args.domainNameOfHostedZone
-        # Delete ecs service
-        ecsServiceDeleteResponse = ecsService.deleteEcsService(ecsServiceName, args.ecsClusterName, args.region)
-        if ecsServiceDeleteResponse:
-            logger.info(" ECS service {} deleted ".format(ecsServiceName))
-        else:
-            logger.error(" Unable to delete ECS service {}".format(ecsServiceName))
-        
-        # Delete route53 record 
-        deleteR53EntryResponse = route53.DeleteR53Entry(domainName, args.domainNameOfHostedZone, args.HostedZoneId, args.loadBalancerDNSEndpoint, args.AWSHostedZoneIDForLoadbalancerRegionBasis, args.region)
-        if deleteR53EntryResponse:
-            logger.info(" Deleted r53 entry {}".format(FullDomainName))
-        else:
-            logger.error(" Unable to delete r53 entry {}".format(FullDomainName))
-        
-        # Delete ECR Repo 
-        deleteECRRepoResponse = application.deleteECRRepo(args.appName, args.awsAccountID, args.region)
-        if deleteECRRepoResponse:
-            logger.info(" ECR repo deleted")
-        else:
-            logger.error(" Unable to delete ECR Repo")
-        
-        # De-register task definition 
-        listTaskDefinitionARNS = taskDefinition.listTaskDefinitionARNS(ecsTaskDefinitionName, args.region)
-        if (len(listTaskDefinitionARNS)) == 0:
-            logger.info(" No task definition matched with name of {} ".format(ecsTaskDefinitionName))
-        else:
-            logger.info(" Found task definitions with name of {} de-registering all the revisions".format(ecsTaskDefinitionName))
-            deregisterTaskDefinisionRevs = taskDefinition.deRegisterTaskDefinition(listTaskDefinitionARNS, args.region)
-            if deregisterTaskDefinisionRevs:
-                logger.info(" Task definition have been de-registered")
-            else:
-                logger.error(" Unable to de-register task definition ")    
-            
-        # Delete secret from secret manager        
-        DeleteSecretFromSecretManagerResponse = secretManager.deleteSecret(secretName, args.region)
-        if DeleteSecretFromSecretManagerResponse:
-            logger.info(" Secret {} deleted from secret manager ".format(secretName))
-        else:
-            logger.error(" Unable to delete secret please check for error")
-        
-        # get and delete http rules arn from load balancer listener
-        getHTTPRuleARNResponse = loadBalancer.getHTTPRuleARN(FullDomainName, args.HTTPListenerARN, args.region)
-        if getHTTPRuleARNResponse:
-            deleteHTTPRuleEntryResponse = loadBalancer.deleteHTTPRuleLoadBalancer(getHTTPRuleARNResponse, args.region)
-            if deleteHTTPRuleEntryResponse:
-                logger.info(" Deleted http rule from load balancer")
-            else:
-                logger.error(" Unable to delete https rule from load balancer")
-            
-        # get and delete https rules arn from load balancer listener
-        getHTTPSRuleARNResponse = loadBalancer.getHTTPSRuleARN(FullDomainName, args.HTTTPSListenerARN, args.region)
-        if getHTTPSRuleARNResponse:
-            deleteHTTPSRuleEntryResponse = loadBalancer.deleteHTTPSRuleLoadBalancer(getHTTPSRuleARNResponse, args.region)
-            if deleteHTTPSRuleEntryResponse:
-                logger.info(" Deleted https rule from load balancer")
-            else:
-                logger.error(" Unable to delete https rule from load balancer")
-            
-        # Delete target group 
         targetGroupNameFull = userName + '-' + args.appName
         targetGroupNameShort = targetGroupNameFull[:31]
         targetGroupNameShort = re.sub('[^a-zA-Z0-9 \n\.]', '', targetGroupNameShort)
-        getTargetGroupARN = targetGroup.getTargetGroupARN(targetGroupNameShort, args.region)
-        if getTargetGroupARN:
-            deleteTargetGroupResponse = targetGroup.deleteTargetGroup(getTargetGroupARN, args.region)
-            if deleteTargetGroupResponse:
-                logger.info(" Target group deleted")
-            else:
-                logger.error(" Unable to delete target group")
+        loadBalancerResources = getLoadBalancerResources(ecsTaskDefinitionName, FullDomainName, targetGroupNameShort)
+
+        # Delete all resources, only target group waits for the service to drain and the rules to be deleted
+        teardownResponse = teardown.runTeardown({
+            'ecsServiceName': ecsServiceName,
+            'ecsClusterName': args.ecsClusterName,
+            'ecsTaskDefinitionName': ecsTaskDefinitionName,
+            'hostName': domainName,
+            'domainNameOfHostedZone': args.domainNameOfHostedZone,
+            'HostedZoneId': args.HostedZoneId,
+            'loadBalancerDNSEndpoint': args.loadBalancerDNSEndpoint,
+            'AWSHostedZoneIDForLoadbalancerRegionBasis': args.AWSHostedZoneIDForLoadbalancerRegionBasis,
+            'ecrRepoName': args.appName,
+            'registryId': args.awsAccountID,
+            'secretName': secretName if secretCopied else None,
+            'httpRuleARN': loadBalancerResources['httpRuleARN'],
+            'httpsRuleARN': loadBalancerResources['httpsRuleARN'],
+            'targetGroupARN': loadBalancerResources['targetGroupARN'],
+            'region': args.region
+        })
+        if teardownResponse:
+            logger.info(" Deleted all resources of {}".format(FullDomainName))
+            stateStore.deleteEnvironment(ecsTaskDefinitionName)
         else:
-            logger.error(" Unable to get target group ARN")
-        
-        
+            logger.error(" Unable to delete all resources please check for error")
+            sys.exit(1)
+
     else:
         logger.error(" Please choose the correct operation exiting")
         sys.exit(1)
     
 if __name__ == "__main__":
-    main()
+    # Timeline and API call summary are written on exit so that runs which fail and exit early are covered as well
+    tracing.startRun(args.operation)
+    atexit.register(tracing.writeTrace)
+    atexit.register(apiStats.writeSummary)
+    with tracing.span(args.operation, 'operation'):
+        main()
     
 
 
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from clientRegistry import clientRegistry
+from route53 import route53
+from secretManager import secretManager
+from tracing import tracing
+
+
+# Logger configuration
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+# Resource types of an environment which are tagged with pod=cloud-dev and Name
+taggedResourceTypes = ['ecs:service', 'elasticloadbalancing:targetgroup', 'ecr:repository']
+
+# Resources which make create fail when they already exist
+conflictingResources = ['ecsService', 'targetGroup', 'ecrRepo', 'routeRecord', 'secret']
+
+
+# Method to find tagged resources of an environment with one tagging API query
+@tracing.traced()
+def findTaggedResources(names: list, region: str):
+    """_summary_
+
+    Args:
+        names (list): Values of Name tag of the resources, eg: ecs service, target group and ECR repo names
+        region (str): Region of the resources
+
+    Returns:
+        _type_: ARNs of the resources found by resource type
+    """
+    client = clientRegistry.getClient('resourcegroupstaggingapi', region)
+    resources = {}
+    paginator = client.get_paginator('get_resources')
+    for page in paginator.paginate(
+        TagFilters = [
+            {'Key': 'pod', 'Values': ['cloud-dev']},
+            {'Key': 'Name', 'Values': names}
+        ],
+        ResourceTypeFilters = taggedResourceTypes
+    ):
+        for resource in page['ResourceTagMappingList']:
+            # ARN is arn:partition:service:region:account:resource
+            arnParts = resource['ResourceARN'].split(':', 5)
+            resourceType = arnParts[2] + ':' + arnParts[5].split('/')[0].split(':')[0]
+            resources.setdefault(resourceType, []).append(resource['ResourceARN'])
+    return resources
+
+
+# Method to find the resource with given path among tagged resources, Name tag is matched for all types so the path tells them apart
+def findResource(resourceARNs: list, resourcePath: str):
+    """_summary_
+
+    Args:
+        resourceARNs (list): ARNs of one resource type found by tag
+        resourcePath (str): Resource part of the ARN, eg: service/<cluster>/<name> or repository/<name>
+
+    Returns:
+        _type_: ARN of the resource or None
+    """
+    for arn in resourceARNs:
+        # Target group ARNs end with an ID after the name
+        arnPath = arn.split(':', 5)[5]
+        if arnPath == resourcePath or arnPath.startswith(resourcePath + '/'):
+            return arn
+    return None
+
+
+# Method to check that nothing of an environment exists before it is created
+@tracing.traced()
+def runPreflight(ecsServiceName: str, ecsClusterName: str, targetGroupName: str, ecrRepoName: str, FullDomainName: str, HostedZoneId: str, sourceSecretName: str, region: str):
+    """_summary_
+
+    Args:
+        ecsServiceName (str): Name of the ecs service, task definition and secret of the environment
+        ecsClusterName (str): ECS Cluster name
+        targetGroupName (str): Name of the target group of the environment
+        ecrRepoName (str): Name of the ECR repo of the app
+        FullDomainName (str): DNS name of the environment
+        HostedZoneId (str): Hosted Zone ID
+        sourceSecretName (str): Secret to be copied, it has to exist
+        region (str): Region of the resources
+
+    Returns:
+        _type_: Report with the resources found, the ones which conflict and the ones which are missing
+    """
+    # Tagged resources are found with one query, route53 records cannot be tagged and secrets copied by older versions
+    # are not tagged with pod and Name hence only they are checked directly, all the calls run at the same time
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        taggedFuture = executor.submit(findTaggedResources, [ecsServiceName, targetGroupName, ecrRepoName], region)
+        routeRecordFuture = executor.submit(route53.checkIfRouteRecordExists, FullDomainName, HostedZoneId, region)
+        secretFuture = executor.submit(secretManager.checkIfSecretExists, ecsServiceName, region)
+        sourceSecretFuture = executor.submit(secretManager.checkIfSecretExists, sourceSecretName, region)
+        taggedResources = taggedFuture.result()
+        resources = {
+            'ecsService': findResource(taggedResources.get('ecs:service', []), 'service/{}/{}'.format(ecsClusterName, ecsServiceName)),
+            'targetGroup': findResource(taggedResources.get('elasticloadbalancing:targetgroup', []), 'targetgroup/{}'.format(targetGroupName)),
+            'ecrRepo': findResource(taggedResources.get('ecr:repository', []), 'repository/{}'.format(ecrRepoName)),
+            'secret': ecsServiceName if secretFuture.result() else None,
+            'routeRecord': FullDomainName if routeRecordFuture.result() else None,
+            'sourceSecret': sourceSecretName if sourceSecretFuture.result() else None
+        }
+
+    report = {
+        'resources': resources,
+        'conflicts': [name for name in conflictingResources if resources[name]],
+        'missing': [name for name in ['sourceSecret'] if not resources[name]]
+    }
+    report['passed'] = not report['conflicts'] and not report['missing']
+    return report
@@ -0,0 +1,334 @@
+#!/usr/bin/env python3
+
+import os
+import re
+import logging
+from datetime import datetime, timedelta, timezone
+from concurrent.futures import ThreadPoolExecutor
+
+from clientRegistry import clientRegistry
+from service import ecsService
+from route53 import route53
+from loadBalancer import loadBalancer
+from secretManager import secretManager
+from teardown import teardown
+from stateStore import stateStore
+from tracing import tracing
+
+
+# Logger configuration
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+# Environments older than TTL are reaped, 0 turns TTL off
+reapTTLHours = float(os.environ.get('CLOUD_DEV_REAP_TTL_HOURS', '0'))
+
+# Environments without a deployment and without a request for this long are reaped
+reapIdleHours = float(os.environ.get('CLOUD_DEV_REAP_IDLE_HOURS', '72'))
+
+# Number of environments torn down at the same time
+reapMaxWorkers = int(os.environ.get('CLOUD_DEV_REAP_WORKERS', '8'))
+
+# Stale environments are only reported, they are deleted only when CLOUD_DEV_REAP_DRY_RUN=false or --delete is passed
+reapDryRun = os.environ.get('CLOUD_DEV_REAP_DRY_RUN', 'true').lower() != 'false'
+
+# Requests per second per service while reaping, kept below the AWS API limits so that other runs are not throttled
+reapRateLimits = {
+    'ecs': 10,
+    'elbv2': 10,
+    'route53': 4,
+    'ecr': 10,
+    'secretsmanager': 20,
+    'cloudwatch': 10
+}
+
+# Prefix of the ecs service, task definition and secret of every environment
+environmentPrefix = 'cloud-dev-'
+
+# CloudWatch accepts at most 500 queries per get_metric_data call
+maxMetricQueries = 500
+
+
+# Method to read all resources tagged with pod=cloud-dev in a single paginated sweep
+@tracing.traced()
+def sweepTaggedResources(region: str):
+    """_summary_
+
+    Args:
+        region (str): Region to be swept
+
+    Returns:
+        _type_: Resources with ARN and tags as a dict
+    """
+    client = clientRegistry.getClient('resourcegroupstaggingapi', region)
+    resources = []
+    paginator = client.get_paginator('get_resources')
+    for page in paginator.paginate(
+        TagFilters = [{'Key': 'pod', 'Values': ['cloud-dev']}],
+        ResourceTypeFilters = ['ecs:service', 'elasticloadbalancing:targetgroup', 'ecr:repository'],
+        ResourcesPerPage = 100
+    ):
+        for resource in page['ResourceTagMappingList']:
+            resources.append({
+                'ARN': resource['ResourceARN'],
+                'Tags': {tag['Key']: tag['Value'] for tag in resource['Tags']}
+            })
+    logger.info(" Found {} cloud-dev resources".format(len(resources)))
+    return resources
+
+
+# Method to get short name of target group the same way create names it
+def getTargetGroupNameShort(domainName: str):
+    """_summary_
+
+    Args:
+        domainName (str): Host name of the environment, userName-appName
+
+    Returns:
+        _type_: Name of the target group
+    """
+    return re.sub('[^a-zA-Z0-9 \n\.]', '', domainName[:31])
+
+
+# Method to group swept resources by environment, every environment is an ecs service in the cluster
+def groupEnvironments(resources: list, ecsClusterName: str):
+    """_summary_
+
+    Args:
+        resources (list): Resources returned by sweepTaggedResources
+        ecsClusterName (str): Only services of this cluster are grouped
+
+    Returns:
+        _type_: Environments by ecs service name
+    """
+    environments = {}
+    targetGroups = {}
+    ecrRepos = {}
+    for resource in resources:
+        # ARN is arn:partition:service:region:account:resource
+        arnParts = resource['ARN'].split(':', 5)
+        resourceType, resourcePath = arnParts[2], arnParts[5]
+        if resourceType == 'ecs' and resourcePath.startswith('service/'):
+            # Service ARN is service/cluster/name
+            pathParts = resourcePath.split('/')
+            if len(pathParts) != 3 or pathParts[1] != ecsClusterName or not pathParts[2].startswith(environmentPrefix):
+                continue
+            # User name has no special characters hence the first dash after the prefix ends it
+            userName, _, appName = pathParts[2][len(environmentPrefix):].partition('-')
+            environments[pathParts[2]] = {
+                'ecsServiceName': pathParts[2],
+                'userName': userName,
+                'appName': appName,
+                'userEmail': resource['Tags'].get('userName'),
+                'targetGroupARN': None,
+                'ecrRepoName': None
+            }
+        elif resourceType == 'elasticloadbalancing':
+            targetGroups[resource['Tags'].get('Name')] = resource['ARN']
+        elif resourceType == 'ecr':
+            # ECR repos are tagged with UserName unlike the other resources
+            ecrRepos[resourcePath.split('/', 1)[1]] = resource['Tags'].get('UserName')
+
+    for environment in environments.values():
+        environment['targetGroupARN'] = targetGroups.get(getTargetGroupNameShort(environment['userName'] + '-' + environment['appName']))
+        # ECR repo is named after the app, it belongs to the environment only when the same user created it
+        if environment['appName'] in ecrRepos and ecrRepos[environment['appName']] == environment['userEmail']:
+            environment['ecrRepoName'] = environment['appName']
+    return environments
+
+
+# Method to add creation and last deployment time of every environment
+def addDeploymentTimes(environments: dict, ecsClusterName: str, region: str):
+    """_summary_
+
+    Args:
+        environments (dict): Environments returned by groupEnvironments
+        ecsClusterName (str): ECS Cluster name
+        region (str): Region of the ecs cluster
+    """
+    services = ecsService.describeServices(list(environments), ecsClusterName, region)
+    for ecsServiceName, environment in environments.items():
+        service = services.get(ecsServiceName)
+        if service is None or service['status'] != 'ACTIVE':
+            environment['createdAt'] = None
+            environment['lastDeployedAt'] = None
+            continue
+        environment['createdAt'] = service['createdAt']
+        environment['lastDeployedAt'] = max(deployment['updatedAt'] for deployment in service['deployments'])
+
+
+# Method to get number of requests served by every target group in the last few hours
+@tracing.traced()
+def getRequestCounts(targetGroupARNs: list, listenerARN: str, hours: float, region: str):
+    """_summary_
+
+    Args:
+        targetGroupARNs (list): ARNs of the target groups
+        listenerARN (str): ARN of a listener of the load balancer in front of the target groups
+        hours (float): Hours to look back
+        region (str): Region of the load balancer
+
+    Returns:
+        _type_: Request count by target group ARN
+    """
+    client = clientRegistry.getClient('cloudwatch', region)
+    # CloudWatch dimensions are the ARN suffixes, listener ARN is listener/app/name/id/listenerId
+    loadBalancerDimension = '/'.join(listenerARN.split(':')[-1].split('/')[1:4])
+    endTime = datetime.now(timezone.utc)
+    startTime = endTime - timedelta(hours=hours)
+    requestCounts = {}
+    for start in range(0, len(targetGroupARNs), maxMetricQueries):
+        batch = targetGroupARNs[start:start + maxMetricQueries]
+        queries = [
+            {
+                'Id': 'q{}'.format(index),
+                'MetricStat': {
+                    'Metric': {
+                        'Namespace': 'AWS/ApplicationELB',
+                        'MetricName': 'RequestCount',
+                        'Dimensions': [
+                            {'Name': 'TargetGroup', 'Value': targetGroupARN.split(':')[-1]},
+                            {'Name': 'LoadBalancer', 'Value': loadBalancerDimension}
+                        ]
+                    },
+                    'Period': 3600,
+                    'Stat': 'Sum'
+                }
+            }
+            for index, targetGroupARN in enumerate(batch)
+        ]
+        paginator = client.get_paginator('get_metric_data')
+        for page in paginator.paginate(MetricDataQueries = queries, StartTime = startTime, EndTime = endTime):
+            for result in page['MetricDataResults']:
+                targetGroupARN = batch[int(result['Id'][1:])]
+                requestCounts[targetGroupARN] = requestCounts.get(targetGroupARN, 0) + sum(result['Values'])
+    return requestCounts
+
+
+# Method to find environments which are older than TTL or have been idle
+def findStaleEnvironments(environments: dict, listenerARN: str, region: str):
+    """_summary_
+
+    Args:
+        environments (dict): Environments with deployment times added
+        listenerARN (str): ARN of a listener of the load balancer in front of the target groups
+        region (str): Region of the environments
+
+    Returns:
+        _type_: Stale environments with the reason they are stale
+    """
+    now = datetime.now(timezone.utc)
+    idleSince = now - timedelta(hours=reapIdleHours)
+    notDeployedRecently = {name for name, environment in environments.items() if environment['lastDeployedAt'] and environment['lastDeployedAt'] < idleSince}
+    # Requests are only read for environments which could be idle
+    requestCounts = getRequestCounts([environments[name]['targetGroupARN'] for name in notDeployedRecently if environments[name]['targetGroupARN']], listenerARN, reapIdleHours, region)
+
+    staleEnvironments = []
+    for environment in environments.values():
+        if environment['createdAt'] is None:
+            continue
+        if reapTTLHours and environment['createdAt'] < now - timedelta(hours=reapTTLHours):
+            environment['reason'] = 'created {}'.format(environment['createdAt'].isoformat())
+        elif environment['ecsServiceName'] in notDeployedRecently and requestCounts.get(environment['targetGroupARN'], 0) == 0:
+            environment['reason'] = 'no deployment or request since {}'.format(environment['lastDeployedAt'].isoformat())
+        else:
+            continue
+        staleEnvironments.append(environment)
+    return staleEnvironments
+
+
+# Method to tear down one stale environment
+@tracing.traced()
+def reapEnvironment(environment: dict, ecsClusterName: str, domainNameOfHostedZone: str, HTTPListenerARN: str, HTTPSListenerARN: str, registryId: str, region: str):
+    """_summary_
+
+    Args:
+        environment (dict): Stale environment
+        ecsClusterName (str): ECS Cluster name
+        domainNameOfHostedZone (str): Route53 hosted zone under which record of the environment was created
+        HTTPListenerARN (str): HTTP Listener ARN of load balancer
+        HTTPSListenerARN (str): HTTPS Listener ARN of load balancer
+        registryId (str): AWS Account ID
+        region (str): Region of the environment
+
+    Returns:
+        _type_: If every resource of the environment was deleted
+    """
+    ecsServiceName = environment['ecsServiceName']
+    FullDomainName = environment['userName'] + '-' + environment['appName'] + '.' + domainNameOfHostedZone
+    # Older secrets were not tagged hence secret is looked up by name
+    secretName = ecsServiceName if secretManager.checkIfSecretExists(ecsServiceName, region) else None
+    teardownResponse = teardown.runTeardown({
+        'ecsServiceName': ecsServiceName,
+        'ecsClusterName': ecsClusterName,
+        'ecsTaskDefinitionName': ecsServiceName,
+        # Route53 records of all stale environments are deleted together before teardown
+        'hostName': None,
+        'ecrRepoName': environment['ecrRepoName'],
+        'registryId': registryId,
+        'secretName': secretName,
+        'httpRuleARN': loadBalancer.getHTTPRuleARN(FullDomainName, HTTPListenerARN, region) or None,
+        'httpsRuleARN': loadBalancer.getHTTPSRuleARN(FullDomainName, HTTPSListenerARN, region) or None,
+        'targetGroupARN': environment['targetGroupARN'],
+        'region': region
+    })
+    if teardownResponse:
+        stateStore.deleteEnvironment(ecsServiceName)
+    return teardownResponse
+
+
+# Method to find and tear down all stale environments of the cluster
+def reapStaleEnvironments(ecsClusterName: str, domainNameOfHostedZone: str, HostedZoneId: str, loadBalancerDNSEndpoint: str, AWSHostedZoneIDForLoadbalancerRegionBasis: str, HTTPListenerARN: str, HTTPSListenerARN: str, registryId: str, region: str, dryRun: bool = reapDryRun):
+    """_summary_
+
+    Args:
+        ecsClusterName (str): ECS Cluster name
+        domainNameOfHostedZone (str): Route53 hosted zone DNS record under which records were created
+        HostedZoneId (str): Hosted Zone ID
+        loadBalancerDNSEndpoint (str): DNS Endpoint of load balancer the records point to
+        AWSHostedZoneIDForLoadbalancerRegionBasis (str): AWS assigns zone ID for different type of load balancer based on region
+        HTTPListenerARN (str): HTTP Listener ARN of load balancer
+        HTTPSListenerARN (str): HTTPS Listener ARN of load balancer
+        registryId (str): AWS Account ID
+        region (str): Region of the environments
+        dryRun (bool): Only report stale environments without deleting them
+
+    Returns:
+        _type_: Names of the environments reaped and names of the ones which failed
+    """
+    for serviceName, requestsPerSecond in reapRateLimits.items():
+        clientRegistry.setRateLimit(serviceName, requestsPerSecond)
+
+    environments = groupEnvironments(sweepTaggedResources(region), ecsClusterName)
+    addDeploymentTimes(environments, ecsClusterName, region)
+    staleEnvironments = findStaleEnvironments(environments, HTTPSListenerARN, region)
+    for environment in staleEnvironments:
+        logger.info(" {} of {} is stale, {}".format(environment['ecsServiceName'], environment['userEmail'], environment['reason']))
+    logger.info(" {} of {} environments are stale".format(len(staleEnvironments), len(environments)))
+    if dryRun or not staleEnvironments:
+        return [], []
+
+    # Records of all environments go in one change batch instead of one change per environment
+    hostNames = []
+    for environment in staleEnvironments:
+        hostName = environment['userName'] + '-' + environment['appName']
+        if route53.checkIfRouteRecordExists(hostName + '.' + domainNameOfHostedZone, HostedZoneId, region):
+            hostNames.append(hostName)
+    if hostNames and not route53.deleteR53Entries(hostNames, domainNameOfHostedZone, HostedZoneId, loadBalancerDNSEndpoint, AWSHostedZoneIDForLoadbalancerRegionBasis, region):
+        logger.error(" Unable to delete r53 entries of stale environments")
+
+    reaped = []
+    failed = []
+    with ThreadPoolExecutor(max_workers=reapMaxWorkers) as executor:
+        futures = {
+            executor.submit(reapEnvironment, environment, ecsClusterName, domainNameOfHostedZone, HTTPListenerARN, HTTPSListenerARN, registryId, region): environment['ecsServiceName']
+            for environment in staleEnvironments
+        }
+        for future, ecsServiceName in futures.items():
+            if future.result():
+                reaped.append(ecsServiceName)
+            else:
+                failed.append(ecsServiceName)
+    logger.info(" Reaped {} environments, {} failed".format(len(reaped), len(failed)))
+    return reaped, failed
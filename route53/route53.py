@@ -1,7 +1,11 @@
 #!/usr/bin/env python3
 
-import boto3
+from clientRegistry import clientRegistry
 import logging
+import threading
+
+from waiter import waiter
+from tracing import tracing
 
 
 # Logger configuration
@@ -9,7 +13,205 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
-#client = boto3.client('route53', region_name= region )
+# Route53 allows 1000 records per change batch, alias changes are kept well below that
+maxChangesPerBatch = 500
+
+# Seconds to wait for a change to reach all Route53 name servers
+changeSyncTimeout = 300
+
+# Record snapshot of each hosted zone, read once per run and then kept up to date in place
+zoneSnapshots = {}
+zoneSnapshotLock = threading.RLock()
+
+
+# Method to normalise DNS name the way Route53 returns it
+def normaliseRecordName(recordName: str):
+    """_summary_
+
+    Args:
+        recordName (str): DNS name with or without trailing dot
+
+    Returns:
+        _type_: Lower case DNS name ending with a dot
+    """
+    recordName = recordName.lower()
+    if not recordName.endswith('.'):
+        recordName = recordName + '.'
+    return recordName
+
+
+# Method to build alias record change pointing host to load balancer
+def buildAliasRecordChange(action: str, hostName: str, domainNameOfHostedZone: str, loadBalancerDNSEndpoint: str, AWSHostedZoneIDForLoadbalancerRegionBasis: str):
+    """_summary_
+
+    Args:
+        action (str): CREATE, DELETE or UPSERT
+        hostName (str): hostname of the record
+        domainNameOfHostedZone (str): Route53 hosted zone DNS record under which records would be created
+        loadBalancerDNSEndpoint (str): DNS Endpoint of load balancer to point route53 record
+        AWSHostedZoneIDForLoadbalancerRegionBasis (str): AWS assigns zone ID for different type of load balancer based on region more details https://docs.aws.amazon.com/general/latest/gr/elb.html
+
+    Returns:
+        _type_: Change to be sent in change batch
+    """
+    return {
+        'Action': action,
+        'ResourceRecordSet': {
+            'Name': hostName + '.' + domainNameOfHostedZone,
+            'Type': 'A',
+            'AliasTarget': {
+                'DNSName': loadBalancerDNSEndpoint,
+                'HostedZoneId': AWSHostedZoneIDForLoadbalancerRegionBasis,
+                'EvaluateTargetHealth': False,
+            }
+        }
+    }
+
+
+# Method to get all records of hosted zone, all the pages are read on first use
+@tracing.traced()
+def getZoneRecordSnapshot(HostedZoneId: str, region: str, refresh: bool = False):
+    """_summary_
+
+    Args:
+        HostedZoneId (str): Hosted Zone ID
+        region (str): Region of the client
+        refresh (bool): Read the zone again even if it was read before
+
+    Returns:
+        _type_: Record sets of the zone by (name, type)
+    """
+    with zoneSnapshotLock:
+        if HostedZoneId in zoneSnapshots and not refresh:
+            return zoneSnapshots[HostedZoneId]
+
+        client = clientRegistry.getClient('route53', region)
+        snapshot = {}
+        paginator = client.get_paginator('list_resource_record_sets')
+        for page in paginator.paginate(HostedZoneId = HostedZoneId, PaginationConfig = {'PageSize': 300}):
+            for recordSet in page['ResourceRecordSets']:
+                snapshot[(normaliseRecordName(recordSet['Name']), recordSet['Type'])] = recordSet
+        zoneSnapshots[HostedZoneId] = snapshot
+        logger.info(" Loaded {} records of hosted zone {}".format(len(snapshot), HostedZoneId))
+        return snapshot
+
+
+# Method to apply submitted changes to zone snapshot if it has been read
+def applyChangesToSnapshot(changes: list, HostedZoneId: str):
+    """_summary_
+
+    Args:
+        changes (list): Changes which were accepted by Route53
+        HostedZoneId (str): Hosted Zone ID
+    """
+    with zoneSnapshotLock:
+        snapshot = zoneSnapshots.get(HostedZoneId)
+        if snapshot is None:
+            return
+        for change in changes:
+            recordSet = change['ResourceRecordSet']
+            key = (normaliseRecordName(recordSet['Name']), recordSet['Type'])
+            if change['Action'] == 'DELETE':
+                snapshot.pop(key, None)
+            else:
+                snapshot[key] = recordSet
+
+
+# Method to wait until change has reached all Route53 name servers
+def waitForChangeInSync(changeId: str, region: str, timeout: int = changeSyncTimeout):
+    """_summary_
+
+    Args:
+        changeId (str): ID of the change returned by change_resource_record_sets
+        region (str): Region of the client
+        timeout (int): Seconds to wait
+
+    Returns:
+        _type_: If change is INSYNC
+    """
+    client = clientRegistry.getClient('route53', region)
+
+    def checkInSync():
+        return client.get_change(Id = changeId)['ChangeInfo']['Status'] == 'INSYNC'
+
+    return waiter.pollUntil(checkInSync, timeout, baseDelay=2, maxDelay=15, description='route53 change {}'.format(changeId))
+
+
+# Method to submit record changes in as few change batches as possible
+@tracing.traced()
+def submitRecordChanges(changes: list, HostedZoneId: str, region: str, waitForSync: bool = True):
+    """_summary_
+
+    Args:
+        changes (list): Record changes, eg: built with buildAliasRecordChange
+        HostedZoneId (str): Hosted Zone ID of zone under which all records would be created
+        region (str): Region of the client
+        waitForSync (bool): Wait for every batch to be INSYNC
+
+    Returns:
+        _type_: Change info of every batch or False if any batch failed
+    """
+    client = clientRegistry.getClient('route53', region)
+    changeInfos = []
+    try:
+        # Batches are sent one after another to stay within Route53 request rate
+        for start in range(0, len(changes), maxChangesPerBatch):
+            batch = changes[start:start + maxChangesPerBatch]
+            response = client.change_resource_record_sets(
+                HostedZoneId=HostedZoneId,
+                ChangeBatch={
+                    'Comment': 'Created by cloud-dev automation',
+                    'Changes': batch
+                }
+            )
+            applyChangesToSnapshot(batch, HostedZoneId)
+            changeInfos.append(response['ChangeInfo'])
+            logger.info(" Submitted {} route53 changes as {}".format(len(batch), response['ChangeInfo']['Id']))
+    except Exception as e:
+        print(str(e))
+        return False
+
+    if waitForSync:
+        for changeInfo in changeInfos:
+            if not waitForChangeInSync(changeInfo['Id'], region):
+                return False
+    return changeInfos
+
+
+# Method to create route53 records of many hosts in one change batch
+def createR53Entries(hostNames: list, domainNameOfHostedZone: str, HostedZoneId: str, loadBalancerDNSEndpoint: str, AWSHostedZoneIDForLoadbalancerRegionBasis: str, region: str):
+    """_summary_
+
+    Args:
+        hostNames (list): hostnames to be created
+        domainNameOfHostedZone (str): Route53 hosted zone DNS record under which records would be created
+        HostedZoneId (str): Hosted Zone ID of zone under which all records would be created
+        loadBalancerDNSEndpoint (str): DNS Endpoint of load balancer to point route53 record
+        AWSHostedZoneIDForLoadbalancerRegionBasis (str): AWS assigns zone ID for different type of load balancer based on region more details https://docs.aws.amazon.com/general/latest/gr/elb.html
+
+    Returns:
+        _type_: Change info of every batch or False on failure
+    """
+    changes = [buildAliasRecordChange('CREATE', hostName, domainNameOfHostedZone, loadBalancerDNSEndpoint, AWSHostedZoneIDForLoadbalancerRegionBasis) for hostName in hostNames]
+    return submitRecordChanges(changes, HostedZoneId, region)
+
+
+# Method to delete route53 records of many hosts in one change batch
+def deleteR53Entries(hostNames: list, domainNameOfHostedZone: str, HostedZoneId: str, loadBalancerDNSEndpoint: str, AWSHostedZoneIDForLoadbalancerRegionBasis: str, region: str):
+    """_summary_
+
+    Args:
+        hostNames (list): hostnames to be deleted
+        domainNameOfHostedZone (str): Route53 hosted zone DNS record under which records would be created
+        HostedZoneId (str): Hosted Zone ID of zone under which all records would be created
+        loadBalancerDNSEndpoint (str): DNS Endpoint of load balancer to point route53 record
+        AWSHostedZoneIDForLoadbalancerRegionBasis (str): AWS assigns zone ID for different type of load balancer based on region more details https://docs.aws.amazon.com/general/latest/gr/elb.html
+
+    Returns:
+        _type_: Change info of every batch or False on failure
+    """
+    changes = [buildAliasRecordChange('DELETE', hostName, domainNameOfHostedZone, loadBalancerDNSEndpoint, AWSHostedZoneIDForLoadbalancerRegionBasis) for hostName in hostNames]
+    return submitRecordChanges(changes, HostedZoneId, region)
 
 
 # Method to create route53 record
@@ -26,35 +228,11 @@ def createR53Entry(hostName: str, domainNameOfHostedZone: str, HostedZoneId: str
     Returns:
         _type_: Route53 record details
     """
-    domainName = hostName + '.' + domainNameOfHostedZone
-    client = boto3.client('route53', region_name= region)
-    try:
-        response = client.change_resource_record_sets(
-            HostedZoneId=HostedZoneId,
-            ChangeBatch={
-                'Comment': 'Created by cloud-dev automation',
-                'Changes': [
-                        {
-                            'Action': 'CREATE',
-                            'ResourceRecordSet': {
-                                'Name': domainName,
-                                'Type': 'A',
-                                'AliasTarget': {
-                                    'DNSName': loadBalancerDNSEndpoint,
-                                    'HostedZoneId': AWSHostedZoneIDForLoadbalancerRegionBasis,
-                                    'EvaluateTargetHealth': False,
-                                }
-                            }
-                        }
-                ]
-            }   
-        )
-        return response
-        
-    except Exception as e:
-        print(str(e))
+    changeInfos = createR53Entries([hostName], domainNameOfHostedZone, HostedZoneId, loadBalancerDNSEndpoint, AWSHostedZoneIDForLoadbalancerRegionBasis, region)
+    if not changeInfos:
         return False
-    
+    return changeInfos[0]
+
 # Method to delete route53 entry
 def DeleteR53Entry(hostName: str, domainNameOfHostedZone: str, HostedZoneId: str, loadBalancerDNSEndpoint: str, AWSHostedZoneIDForLoadbalancerRegionBasis: str, region: str):
     """_summary_
@@ -67,65 +245,21 @@ def DeleteR53Entry(hostName: str, domainNameOfHostedZone: str, HostedZoneId: str
         AWSHostedZoneIDForLoadbalancerRegionBasis (str): AWS assigns zone ID for different type of load balancer based on region more details https://docs.aws.amazon.com/general/latest/gr/elb.html
 
     Returns:
-        _type_: Route53 record deletion 
+        _type_: Route53 record deletion
     """
-    domainName = hostName + '.' + domainNameOfHostedZone
-    client = boto3.client('route53', region_name= region)
-    try:
-        response = client.change_resource_record_sets(
-            HostedZoneId=HostedZoneId,
-            ChangeBatch={
-                'Comment': 'Created by cloud-dev automation',
-                'Changes': [
-                        {
-                            'Action': 'DELETE',
-                            'ResourceRecordSet': {
-                                'Name': domainName,
-                                'Type': 'A',
-                                'AliasTarget': {
-                                    'DNSName': loadBalancerDNSEndpoint,
-                                    'HostedZoneId': AWSHostedZoneIDForLoadbalancerRegionBasis,
-                                    'EvaluateTargetHealth': False,
-                                }
-                            }
-                        }
-                ]
-            }   
-        )
-        DeleteR53EntryStatus = response['ResponseMetadata']['HTTPStatusCode']
-        return DeleteR53EntryStatus
-        
-    except Exception as e:
-        print(str(e))
+    changeInfos = deleteR53Entries([hostName], domainNameOfHostedZone, HostedZoneId, loadBalancerDNSEndpoint, AWSHostedZoneIDForLoadbalancerRegionBasis, region)
+    if not changeInfos:
         return False
+    return changeInfos[0]
 
 # Method to check if route53 record exists
 def checkIfRouteRecordExists(DomainName: str, HostedZoneId: str, region: str):
-    
+
     """_summary_
 
     Args:
-        DomainName (str): DNS Name to be checked which exists
+        DomainName (str): Full DNS Name to be checked which exists
         HostedZoneId (str):  Hosted Zone ID
     """
-    client = boto3.client('route53', region_name= region)
-    response = client.list_resource_record_sets(
-        HostedZoneId=HostedZoneId,
-        StartRecordName=DomainName,
-        StartRecordType='A'
-    )
-
-    if response['IsTruncated']:
-        response = client.list_resource_record_sets(
-            HostedZoneId=HostedZoneId,
-            StartRecordName=DomainName,
-            StartRecordType='A',
-            StartRecordIdentifier=response['NextRecordIdentifier']
-        )
-
-    for record_set in response['ResourceRecordSets']:
-        if record_set['Name'] == DomainName and record_set['Type'] == 'A':
-            return True
-    else:
-        return False
-
+    snapshot = getZoneRecordSnapshot(HostedZoneId, region)
+    return (normaliseRecordName(DomainName), 'A') in snapshot
@@ -1,19 +1,19 @@
-import boto3
+from clientRegistry import clientRegistry
 from botocore.exceptions import ClientError
+import json
+from tracing import tracing
 
 
-# Create a Secrets Manager client
-#client = boto3.client('secretsmanager', region_name= region)
 
 # Method to check if secret exists
 def checkIfSecretExists(secretName: str, regionName: str):
-    client = boto3.client('secretsmanager', region_name= region)
     """_summary_
 
     Args:
         secretName (str): Name of the secret to be checked if exists
         regionName (str): region to be checked
     """
+    client = clientRegistry.getClient('secretsmanager', regionName)
     try:
         checkIfSecretExistsResponse = client.describe_secret(SecretId = secretName)
         if checkIfSecretExistsResponse:
@@ -22,15 +22,19 @@ def checkIfSecretExists(secretName: str, regionName: str):
        return False
 
 # Method to create new secret by inheriting from existing secret
-def getAndCreateSecret(sourceSecretName: str, destSecretName: str, userEmail: str, region: str):
+@tracing.traced()
+def getAndCreateSecret(sourceSecretName: str, destSecretName: str, userEmail: str, region: str, clientRequestToken: str = None, overrides: dict = None):
     """_summary_
 
     Args:
         sourceSecretName (str): Name of the secret to copy from
         destSecretName (str): Name of the secret to copy to
         userEmail (str): Email id of the user for tagging resources for tracking
+        clientRequestToken (str): Same token on a retried create with the same value does not create the secret again
+        overrides (dict): Keys to be changed or added in the copy, source secret has to be JSON when given
     """
-    client = boto3.client('secretsmanager', region_name= region)
+    idempotencyArgs = {'ClientRequestToken': clientRequestToken} if clientRequestToken else {}
+    client = clientRegistry.getClient('secretsmanager', region)
     try:
         response = client.get_secret_value(SecretId=sourceSecretName)
     except ClientError as e:
@@ -39,36 +43,65 @@ def getAndCreateSecret(sourceSecretName: str, destSecretName: str, userEmail: st
 
     # Create a new secret by inheriting the existing one
     try:
+        secretString = response['SecretString']
+        if overrides:
+            secretString = json.dumps(dict(json.loads(secretString), **overrides))
         response = client.create_secret(
+            **idempotencyArgs,
             Name=destSecretName,
-            SecretString=response['SecretString'],
+            SecretString=secretString,
             Description=destSecretName,
             Tags=[
                 {
                     'Key': 'Name',
-                    'Value': userEmail
+                    'Value': destSecretName
                 },
                 {
                     'Key': 'userName',
                     'Value': userEmail
                 },
-                
+                {
+                    'Key': 'pod',
+                    'Value': 'cloud-dev'
+                },
             ]
         )
         return destSecretName
-    except ClientError as e:
+    except (ClientError, ValueError) as e:
+        print(str(e))
+        return False
+
+
+# Method to get full ARN and keys of a JSON secret, these are injected into the container by ECS
+@tracing.traced()
+def getSecretKeys(secretName: str, region: str):
+    """_summary_
+
+    Args:
+        secretName (str): Name of the secret
+        region (str): Region of the secret
+
+    Returns:
+        _type_: Full ARN and keys of the secret or False if secret could not be read or is not JSON
+    """
+    client = clientRegistry.getClient('secretsmanager', region)
+    try:
+        response = client.get_secret_value(SecretId=secretName)
+        return response['ARN'], sorted(json.loads(response['SecretString']))
+    except (ClientError, ValueError) as e:
         print(str(e))
         return False
 
 
 # Method to delete secret from secret manager
+@tracing.traced()
 def deleteSecret(secretName: str, region: str):
     """_summary_
 
     Args:
         secretName (str): Name of the secret to be deleted
     """
-    client = boto3.client('secretsmanager', region_name= region)
+    client = clientRegistry.getClient('secretsmanager', region)
     try:
         response = client.delete_secret(
             SecretId = secretName,
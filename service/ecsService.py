@@ -1,43 +1,128 @@
 #!/usr/bin/env python3
 
-import boto3
+from clientRegistry import clientRegistry
+import os
 import logging
+import threading
+
+from waiter import waiter
+from tracing import tracing
 
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
-#client = boto3.client('ecs', region_name= region)
+# describe_services accepts at most 10 services per call
+maxServicesPerDescribe = 10
+
+# Service ARNs of each cluster, listed only by callers which need to scan the cluster
+clusterInventories = {}
+clusterInventoryLock = threading.Lock()
+
+# Failed rollouts go back to the last deployment which worked. Percents are the ECS defaults, kept so that the new task
+# is started before the old one is stopped. They do not shorten the rollout, the deregistration delay which create and update set on the target group does
+deploymentConfiguration = {
+    'minimumHealthyPercent': 100,
+    'maximumPercent': 200,
+    'deploymentCircuitBreaker': {
+        'enable': True,
+        'rollback': True
+    }
+}
+
+# Seconds to wait for a rollout to finish
+deploymentTimeout = int(os.environ.get('CLOUD_DEV_DEPLOYMENT_TIMEOUT', '900'))
+
+
+# Method to describe ecs services by name, names are sent in batches of 10
+@tracing.traced()
+def describeServices(ecsServiceNames: list, ecsClusterName: str, region: str):
+    """_summary_
+
+    Args:
+        ecsServiceNames (list): Names of the ecs services
+        ecsClusterName (str): Name of the ecs cluster
+        region (str): Region of the ecs cluster
+
+    Returns:
+        _type_: Service details by service name, services which are missing are left out
+    """
+    client = clientRegistry.getClient('ecs', region)
+    services = {}
+    for start in range(0, len(ecsServiceNames), maxServicesPerDescribe):
+        response = client.describe_services(
+            cluster = ecsClusterName,
+            services = ecsServiceNames[start:start + maxServicesPerDescribe]
+        )
+        for service in response['services']:
+            services[service['serviceName']] = service
+    return services
+
+
+# Method to get status of ecs service
+def getServiceStatus(ecsServiceName: str, ecsClusterName: str, region: str):
+    """_summary_
+
+    Args:
+        ecsServiceName (str): Name of the ecs service
+        ecsClusterName (str): Name of the ecs cluster
+        region (str): Region of the ecs cluster
+
+    Returns:
+        _type_: ACTIVE, DRAINING, INACTIVE or None if service was never created
+    """
+    service = describeServices([ecsServiceName], ecsClusterName, region).get(ecsServiceName)
+    if service is None:
+        return None
+    return service['status']
 
 
-# Method for check is ecs service exists using service ARNs
-def checkIfServiceExists(ecsServiceName: str, ecsClusterName: str, region: str, awsAccountID: str):
+# Method for check is ecs service exists
+def checkIfServiceExists(ecsServiceName: str, ecsClusterName: str, region: str, awsAccountID: str = None):
     """_summary_
 
     Args:
         ecsServiceName (str): Name of the ecs service to be created
         ecsClusterName (str): Name of the ecs cluster in which service will be created
         region (str): Region in which firelens will be created
-        awsAccountID (str): AWS Account ID
+        awsAccountID (str): AWS Account ID, not needed anymore as service is looked up by name
 
     Returns:
         _type_: If ECS Service exists
     """
-    client = boto3.client('ecs', region_name= region)
-    response = client.list_services(
-        cluster = ecsClusterName,
-        launchType = 'FARGATE'
-    )
-    ecsServiceARN = 'arn:aws:ecs:' + region + ':' + awsAccountID + ':service/' + ecsClusterName + '/' + ecsServiceName
-    service_arns = response['serviceArns']
-    if ecsServiceARN in service_arns:
-        return True
-    else:
-        return False
+    # Deleted services stay INACTIVE for a while and do not block creating a new one
+    return getServiceStatus(ecsServiceName, ecsClusterName, region) in ('ACTIVE', 'DRAINING')
+
+
+# Method to get ARNs of all services in cluster, cluster is listed once and then served from cache
+@tracing.traced()
+def getClusterInventory(ecsClusterName: str, region: str, refresh: bool = False):
+    """_summary_
+
+    Args:
+        ecsClusterName (str): Name of the ecs cluster
+        region (str): Region of the ecs cluster
+        refresh (bool): List the cluster again even if it was listed before
+
+    Returns:
+        _type_: ARNs of all services in the cluster
+    """
+    with clusterInventoryLock:
+        key = (ecsClusterName, region)
+        if key in clusterInventories and not refresh:
+            return clusterInventories[key]
+        client = clientRegistry.getClient('ecs', region)
+        serviceARNs = []
+        paginator = client.get_paginator('list_services')
+        for page in paginator.paginate(cluster = ecsClusterName, PaginationConfig = {'PageSize': 100}):
+            serviceARNs.extend(page['serviceArns'])
+        clusterInventories[key] = serviceARNs
+        return serviceARNs
 
 # Method to create ecs service
-def createService(ecsServiceName: str, taskDefinitionName: str, targetGroupArn: str, containerName: str, containerPort: int, userEmail: str, ecsClusterName: str, subnetID: str, securityGroupID: str, region: str):
+@tracing.traced()
+def createService(ecsServiceName: str, taskDefinitionName: str, targetGroupArn: str, containerName: str, containerPort: int, userEmail: str, ecsClusterName: str, subnetID: str, securityGroupID: str, region: str, clientToken: str = None):
     """_summary_
 
     Args:
@@ -49,13 +134,16 @@ def createService(ecsServiceName: str, taskDefinitionName: str, targetGroupArn:
         ecsClusterName (str): Port on which container runs
         subnetID (str): Subnet in which ecs service will be running
         securityGroupID (str): Security group to be used for ecs services
+        clientToken (str): Same token on a retried create returns the service created by the first attempt
 
     Returns:
         _type_: ECS service details
     """
-    client = boto3.client('ecs', region_name= region)
+    client = clientRegistry.getClient('ecs', region)
+    idempotencyArgs = {'clientToken': clientToken} if clientToken else {}
     try:
         response = client.create_service(
+            **idempotencyArgs,
             cluster = ecsClusterName,
             serviceName = ecsServiceName,
             taskDefinition = taskDefinitionName,
@@ -89,7 +177,8 @@ def createService(ecsServiceName: str, taskDefinitionName: str, targetGroupArn:
                     'value':userEmail
                 },
             ],
-            propagateTags = 'TASK_DEFINITION'
+            propagateTags = 'TASK_DEFINITION',
+            deploymentConfiguration = deploymentConfiguration
         )
         serviceName = response['service']['serviceName']
         serviceARN = response['service']['serviceArn']
@@ -101,6 +190,7 @@ def createService(ecsServiceName: str, taskDefinitionName: str, targetGroupArn:
         return False
 
 # Method to delete ECS Service
+@tracing.traced()
 def deleteEcsService(serviceName: str, ecsClusterName: str, region: str):
     """_summary_
 
@@ -108,7 +198,7 @@ def deleteEcsService(serviceName: str, ecsClusterName: str, region: str):
         serviceName (str): Name of the service to be deleted
         ecsClusterName (str): ECS Cluster name
     """
-    client = boto3.client('ecs', region_name= region)
+    client = clientRegistry.getClient('ecs', region)
     try:
         response = client.delete_service(
             cluster = ecsClusterName,
@@ -122,27 +212,124 @@ def deleteEcsService(serviceName: str, ecsClusterName: str, region: str):
         print(str(e))
         return False
 
+# Method to wait till deleted ecs service has stopped all its tasks
+def waitForServiceInactive(ecsServiceName: str, ecsClusterName: str, region: str):
+    """_summary_
+
+    Args:
+        ecsServiceName (str): Name of the deleted ecs service
+        ecsClusterName (str): ECS Cluster name
+        region (str): Region of the ecs cluster
+
+    Returns:
+        _type_: If service became INACTIVE
+    """
+    client = clientRegistry.getClient('ecs', region)
+    try:
+        client.get_waiter('services_inactive').wait(
+            cluster = ecsClusterName,
+            services = [ecsServiceName],
+            WaiterConfig = {
+                'Delay': 5,
+                'MaxAttempts': 120
+            }
+        )
+        return True
+    except Exception as e:
+        print(str(e))
+        return False
+
+
+# Method to check if a deployment of ecs service has finished rolling out
+def checkDeploymentRolledOut(ecsServiceName: str, deploymentId: str, ecsClusterName: str, region: str):
+    """_summary_
+
+    Args:
+        ecsServiceName (str): Name of the ecs service
+        deploymentId (str): ID of the deployment started by update, None for the current primary deployment
+        ecsClusterName (str): ECS Cluster name
+        region (str): Region of the ecs cluster
+
+    Raises:
+        Exception: Deployment failed, was rolled back or service is missing
+
+    Returns:
+        _type_: If deployment has all its tasks running and old tasks are stopped
+    """
+    service = describeServices([ecsServiceName], ecsClusterName, region).get(ecsServiceName)
+    if service is None:
+        raise Exception("Service {} not found in cluster {}".format(ecsServiceName, ecsClusterName))
+    if deploymentId is None:
+        deploymentId = next((deployment['id'] for deployment in service['deployments'] if deployment['status'] == 'PRIMARY'), None)
+    deployments = {deployment['id']: deployment for deployment in service['deployments']}
+    deployment = deployments.get(deploymentId)
+    # Circuit breaker rollback starts a new primary deployment with the previous task definition
+    if deployment is None or deployment['status'] != 'PRIMARY':
+        raise Exception("Deployment {} of {} was rolled back".format(deploymentId, ecsServiceName))
+    if deployment.get('rolloutState') == 'FAILED':
+        raise Exception("Deployment of {} failed {}".format(ecsServiceName, deployment.get('rolloutStateReason', '')))
+    if deployment.get('rolloutState') == 'COMPLETED':
+        return True
+    # Rollout state is only updated after a while, new tasks running with nothing left of the old deployment is already steady
+    oldTasksRunning = sum(other['runningCount'] for other in service['deployments'] if other['id'] != deploymentId)
+    return deployment['runningCount'] >= deployment['desiredCount'] and oldTasksRunning == 0
+
+
+# Method to wait for a deployment of ecs service to finish rolling out
+def waitForDeployment(ecsServiceName: str, deploymentId: str, ecsClusterName: str, region: str, timeout: int = None):
+    """_summary_
+
+    Args:
+        ecsServiceName (str): Name of the ecs service
+        deploymentId (str): ID of the deployment started by update
+        ecsClusterName (str): ECS Cluster name
+        region (str): Region of the ecs cluster
+        timeout (int): Seconds to wait, default is CLOUD_DEV_DEPLOYMENT_TIMEOUT
+
+    Returns:
+        _type_: If deployment rolled out
+    """
+    try:
+        return waiter.pollUntil(
+            lambda: checkDeploymentRolledOut(ecsServiceName, deploymentId, ecsClusterName, region),
+            timeout or deploymentTimeout,
+            baseDelay=2,
+            maxDelay=15,
+            description='deployment {} of {} to roll out'.format(deploymentId, ecsServiceName)
+        )
+    except Exception as e:
+        print(str(e))
+        return False
+
+
 # Method to update existing ECS Service
-def updateECSService(ecsServiceName: str, taskDefinitionARN: str, ecsClusterName: str, region: str):
+@tracing.traced()
+def updateECSService(ecsServiceName: str, taskDefinitionARN: str, ecsClusterName: str, region: str, waitForRollout: bool = True):
     """_summary_
 
     Args:
         serviceName (str): Name of the service to be updated
         taskDefinitionARN (str): ARN of the task definition to be updated
+        waitForRollout (bool): Wait till the new deployment is live or has failed
+
+    Returns:
+        _type_: If service was updated and the new deployment rolled out
     """
-    client = boto3.client('ecs', region_name= region)
+    client = clientRegistry.getClient('ecs', region)
     try:
         response = client.update_service(
             cluster = ecsClusterName,
             service = ecsServiceName,
             taskDefinition = taskDefinitionARN,
+            deploymentConfiguration = deploymentConfiguration,
             forceNewDeployment = True
         )
-        
-        serviceName = (response['service']['serviceName'])
-        return True
-    
     except Exception as e:
         print(str(e))
         return False
 
+    deploymentId = [deployment['id'] for deployment in response['service']['deployments'] if deployment['status'] == 'PRIMARY'][0]
+    logger.info(" Started deployment {} of {}".format(deploymentId, ecsServiceName))
+    if not waitForRollout:
+        return True
+    return waitForDeployment(ecsServiceName, deploymentId, ecsClusterName, region)
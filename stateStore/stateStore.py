@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import time
+import sqlite3
+import logging
+
+
+# Logger configuration
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+# SQLite file where resources of every environment created from this machine are recorded
+stateDBPath = os.environ.get('CLOUD_DEV_STATE_DB', os.path.expanduser('~/.cache/cloud-dev/state.db'))
+
+# Seconds to wait for another run holding the database lock
+stateDBTimeout = 30
+
+
+# Method to open state database, a new connection is opened per call as steps run on different threads
+def getConnection():
+    """_summary_
+
+    Returns:
+        _type_: SQLite connection with environments table created
+    """
+    os.makedirs(os.path.dirname(stateDBPath), exist_ok=True)
+    connection = sqlite3.connect(stateDBPath, timeout=stateDBTimeout)
+    connection.execute(
+        'CREATE TABLE IF NOT EXISTS environments ('
+        'environmentName TEXT PRIMARY KEY, '
+        'resources TEXT NOT NULL, '
+        'updatedAt REAL NOT NULL)'
+    )
+    connection.execute(
+        'CREATE TABLE IF NOT EXISTS steps ('
+        'environmentName TEXT NOT NULL, '
+        'stepName TEXT NOT NULL, '
+        'outputs TEXT NOT NULL, '
+        'finishedAt REAL NOT NULL, '
+        'PRIMARY KEY (environmentName, stepName))'
+    )
+    return connection
+
+
+# Method to get recorded resources of an environment
+def getEnvironment(environmentName: str):
+    """_summary_
+
+    Args:
+        environmentName (str): Name of the environment, eg: cloud-dev-userName-appName
+
+    Returns:
+        _type_: Recorded resources, empty when nothing was recorded or the database can not be read
+    """
+    try:
+        connection = getConnection()
+        try:
+            row = connection.execute('SELECT resources FROM environments WHERE environmentName = ?', (environmentName,)).fetchone()
+        finally:
+            connection.close()
+    except sqlite3.Error as e:
+        logger.error(" Unable to read state of {} {}".format(environmentName, str(e)))
+        return {}
+    if row is None:
+        return {}
+    return json.loads(row[0])
+
+
+# Method to record resources of an environment, resources recorded before are kept unless overwritten
+def saveEnvironment(environmentName: str, resources: dict):
+    """_summary_
+
+    Args:
+        environmentName (str): Name of the environment, eg: cloud-dev-userName-appName
+        resources (dict): Names and ARNs of the resources
+
+    Returns:
+        _type_: If state was saved
+    """
+    try:
+        connection = getConnection()
+        try:
+            # Read and write are done in one transaction so that concurrent runs do not drop each other's resources
+            with connection:
+                connection.execute('BEGIN IMMEDIATE')
+                row = connection.execute('SELECT resources FROM environments WHERE environmentName = ?', (environmentName,)).fetchone()
+                recordedResources = json.loads(row[0]) if row else {}
+                recordedResources.update(resources)
+                connection.execute(
+                    'INSERT OR REPLACE INTO environments (environmentName, resources, updatedAt) VALUES (?, ?, ?)',
+                    (environmentName, json.dumps(recordedResources), time.time())
+                )
+        finally:
+            connection.close()
+        return True
+    except sqlite3.Error as e:
+        logger.error(" Unable to save state of {} {}".format(environmentName, str(e)))
+        return False
+
+
+# Method to forget an environment once it is deleted
+def deleteEnvironment(environmentName: str):
+    """_summary_
+
+    Args:
+        environmentName (str): Name of the environment, eg: cloud-dev-userName-appName
+
+    Returns:
+        _type_: If state was deleted
+    """
+    try:
+        connection = getConnection()
+        try:
+            with connection:
+                connection.execute('DELETE FROM environments WHERE environmentName = ?', (environmentName,))
+                connection.execute('DELETE FROM steps WHERE environmentName = ?', (environmentName,))
+        finally:
+            connection.close()
+        return True
+    except sqlite3.Error as e:
+        logger.error(" Unable to delete state of {} {}".format(environmentName, str(e)))
+        return False
+
+
+# Method to journal outputs of a finished step so that a failed run can be resumed
+def saveStepOutputs(environmentName: str, stepName: str, outputs: dict):
+    """_summary_
+
+    Args:
+        environmentName (str): Name of the environment, eg: cloud-dev-userName-appName
+        stepName (str): Name of the finished step
+        outputs (dict): Outputs of the step
+
+    Returns:
+        _type_: If step was journaled
+    """
+    try:
+        connection = getConnection()
+        try:
+            with connection:
+                connection.execute(
+                    'INSERT OR REPLACE INTO steps (environmentName, stepName, outputs, finishedAt) VALUES (?, ?, ?, ?)',
+                    (environmentName, stepName, json.dumps(outputs), time.time())
+                )
+        finally:
+            connection.close()
+        return True
+    except (sqlite3.Error, TypeError) as e:
+        logger.error(" Unable to journal step {} of {} {}".format(stepName, environmentName, str(e)))
+        return False
+
+
+# Method to get outputs of the steps journaled by an earlier run
+def getStepOutputs(environmentName: str):
+    """_summary_
+
+    Args:
+        environmentName (str): Name of the environment, eg: cloud-dev-userName-appName
+
+    Returns:
+        _type_: Outputs by step name, empty when no step was journaled
+    """
+    try:
+        connection = getConnection()
+        try:
+            rows = connection.execute('SELECT stepName, outputs FROM steps WHERE environmentName = ?', (environmentName,)).fetchall()
+        finally:
+            connection.close()
+    except sqlite3.Error as e:
+        logger.error(" Unable to read journal of {} {}".format(environmentName, str(e)))
+        return {}
+    return {stepName: json.loads(outputs) for stepName, outputs in rows}
+
+
+# Method to clear journal once the run it belongs to has finished
+def clearStepOutputs(environmentName: str):
+    """_summary_
+
+    Args:
+        environmentName (str): Name of the environment, eg: cloud-dev-userName-appName
+
+    Returns:
+        _type_: If journal was cleared
+    """
+    try:
+        connection = getConnection()
+        try:
+            with connection:
+                connection.execute('DELETE FROM steps WHERE environmentName = ?', (environmentName,))
+        finally:
+            connection.close()
+        return True
+    except sqlite3.Error as e:
+        logger.error(" Unable to clear journal of {} {}".format(environmentName, str(e)))
+        return False
@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+
+import logging
+import itertools
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from tracing import tracing
+
+
+# Logger configuration
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+# Default number of steps which can run at the same time
+defaultMaxWorkers = 8
+
+# Sequence number of every run of a graph in the process, keeps spans of graphs with the same name apart
+graphRunNumbers = itertools.count(1)
+
+
+# Method to declare a step of the graph
+def step(name: str, func, requires: list = None, provides: list = None):
+    """_summary_
+
+    Args:
+        name (str): Unique name of the step
+        func (function): Called with the required outputs as keyword arguments, returns a dict with the provided outputs or False on failure
+        requires (list): Names of the outputs this step needs before it can start
+        provides (list): Names of the outputs this step produces for other steps
+
+    Returns:
+        _type_: Step definition
+    """
+    return {
+        'name': name,
+        'func': func,
+        'requires': list(requires or []),
+        'provides': list(provides or [])
+    }
+
+
+# Method to validate that every step can be scheduled
+def validateSteps(steps: list, initialOutputs: dict):
+    """_summary_
+
+    Args:
+        steps (list): Steps declared with step()
+        initialOutputs (dict): Outputs available before any step runs
+
+    Raises:
+        Exception: Duplicate step, duplicate output, missing output or a dependency cycle
+
+    Returns:
+        _type_: True if the graph is valid
+    """
+    providers = dict.fromkeys(initialOutputs, None)
+    stepNames = set()
+    for stepDefinition in steps:
+        if stepDefinition['name'] in stepNames:
+            raise Exception("Step {} is declared more than once".format(stepDefinition['name']))
+        stepNames.add(stepDefinition['name'])
+        for output in stepDefinition['provides']:
+            if output in providers:
+                raise Exception("Output {} is provided more than once".format(output))
+            providers[output] = stepDefinition['name']
+
+    for stepDefinition in steps:
+        for output in stepDefinition['requires']:
+            if output not in providers:
+                raise Exception("Step {} requires {} which no step provides".format(stepDefinition['name'], output))
+
+    # Kahn's algorithm, anything left over is part of a cycle
+    available = set(initialOutputs)
+    pending = list(steps)
+    while pending:
+        ready = [s for s in pending if all(r in available for r in s['requires'])]
+        if not ready:
+            raise Exception("Dependency cycle between steps {}".format([s['name'] for s in pending]))
+        for stepDefinition in ready:
+            available.update(stepDefinition['provides'])
+            pending.remove(stepDefinition)
+    return True
+
+
+# Method to run a single step and check what it returned
+def runStep(stepDefinition: dict, outputs: dict, traceAttributes: dict = None):
+    """_summary_
+
+    Args:
+        stepDefinition (dict): Step to be run
+        outputs (dict): Outputs produced so far
+        traceAttributes (dict): Details recorded with the span of the step, eg: steps it waited on, ID of the span is added to it
+
+    Returns:
+        _type_: Outputs of the step or False on failure
+    """
+    kwargs = {name: outputs[name] for name in stepDefinition['requires']}
+    with tracing.span(stepDefinition['name'], 'step', **(traceAttributes or {})) as attributes:
+        if traceAttributes is not None:
+            traceAttributes['spanId'] = tracing.currentSpanId()
+        try:
+            result = stepDefinition['func'](**kwargs)
+        except Exception as e:
+            logger.error(" Step {} raised {}".format(stepDefinition['name'], str(e)))
+            attributes['failed'] = True
+            return False
+        attributes['failed'] = result is False or result is None
+
+    if result is False or result is None:
+        return False
+    missing = [name for name in stepDefinition['provides'] if name not in result]
+    if missing:
+        logger.error(" Step {} did not provide {}".format(stepDefinition['name'], missing))
+        return False
+    return {name: result[name] for name in stepDefinition['provides']}
+
+
+# Method to run all the steps, independent steps run at the same time
+def runSteps(steps: list, initialOutputs: dict = None, maxWorkers: int = defaultMaxWorkers, continueOnFailure: bool = False, completedSteps: dict = None, onStepFinished = None, graphName: str = 'steps'):
+    """_summary_
+
+    Args:
+        steps (list): Steps declared with step()
+        initialOutputs (dict): Outputs available before any step runs
+        maxWorkers (int): Maximum number of steps running at the same time
+        continueOnFailure (bool): Keep running steps which do not depend on a failed step, eg: for teardown
+        completedSteps (dict): Outputs by step name of the steps finished in an earlier run, these are not run again
+        onStepFinished (function): Called with step name and its outputs after every step finishes, eg: to journal it
+        graphName (str): Name of the graph in the trace, eg: create, teardown:<environment>
+
+    Returns:
+        _type_: Outputs of all the finished steps, the names of the steps which failed and of the steps which never ran because of them
+    """
+    outputs = dict(initialOutputs or {})
+    validateSteps(steps, outputs)
+
+    # Step which provides each output and when it became available, used to trace what every step waited on
+    providers = {output: stepDefinition['name'] for stepDefinition in steps for output in stepDefinition['provides']}
+    graphStartedAt = tracing.now()
+    graphId = '{}#{}'.format(graphName, next(graphRunNumbers))
+    availableAt = dict.fromkeys(outputs, graphStartedAt)
+    stepSpanIds = {}
+
+    pending = list(steps)
+    completedSteps = completedSteps or {}
+    for stepDefinition in steps:
+        completedOutputs = completedSteps.get(stepDefinition['name'])
+        if completedOutputs is not None and all(name in completedOutputs for name in stepDefinition['provides']):
+            logger.info(" Skipping step {} finished in an earlier run".format(stepDefinition['name']))
+            outputs.update({name: completedOutputs[name] for name in stepDefinition['provides']})
+            availableAt.update(dict.fromkeys(stepDefinition['provides'], tracing.now()))
+            pending.remove(stepDefinition)
+
+    running = {}
+    failedSteps = []
+    with ThreadPoolExecutor(max_workers=maxWorkers, thread_name_prefix=graphName) as executor:
+        while pending or running:
+            # Nothing new is scheduled once a step has failed unless asked to, running steps are allowed to finish
+            if continueOnFailure or not failedSteps:
+                for stepDefinition in [s for s in pending if all(r in outputs for r in s['requires'])]:
+                    pending.remove(stepDefinition)
+                    logger.info(" Starting step {}".format(stepDefinition['name']))
+                    dependsOn = sorted({providers[r] for r in stepDefinition['requires'] if r in providers})
+                    traceAttributes = {
+                        'graph': graphName,
+                        'graphId': graphId,
+                        'dependsOn': dependsOn,
+                        'dependsOnSpans': [stepSpanIds[name] for name in dependsOn if stepSpanIds.get(name)],
+                        'readyAt': max([availableAt[r] for r in stepDefinition['requires']], default=graphStartedAt)
+                    }
+                    future = executor.submit(runStep, stepDefinition, dict(outputs), traceAttributes)
+                    running[future] = (stepDefinition, traceAttributes)
+            if not running:
+                break
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                stepDefinition, traceAttributes = running.pop(future)
+                stepSpanIds[stepDefinition['name']] = traceAttributes.get('spanId')
+                result = future.result()
+                if result is False:
+                    logger.error(" Step {} failed".format(stepDefinition['name']))
+                    failedSteps.append(stepDefinition['name'])
+                else:
+                    logger.info(" Finished step {}".format(stepDefinition['name']))
+                    outputs.update(result)
+                    availableAt.update(dict.fromkeys(result, tracing.now()))
+                    if onStepFinished:
+                        onStepFinished(stepDefinition['name'], result)
+
+    # Steps which depend on a failed step never become ready
+    skippedSteps = [stepDefinition['name'] for stepDefinition in pending]
+    for stepName in skippedSteps:
+        logger.error(" Step {} skipped".format(stepName))
+    return outputs, failedSteps, skippedSteps
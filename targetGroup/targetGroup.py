@@ -1,18 +1,27 @@
 #!/usr/bin/env python3
 
-import boto3
+from clientRegistry import clientRegistry
 import logging
 
+from waiter import waiter
+from tracing import tracing
+
 
 
 # Define the custom logger
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# define the boto client
-#client = boto3.client('elbv2', region_name= region)
+
+# Seconds for which old tasks keep serving in flight requests after they are replaced, default of AWS is 300
+deregistrationDelaySeconds = 30
+
+# Seconds to wait for targets to be deregistered before target group is deleted
+deregistrationTimeout = 600
+
 
 # Method to create target group
+@tracing.traced()
 def createTargetGroup(targetGroupName: str, port: int, healthCheckPath: str, userEmail: str, vpcId: str, region: str):
     """ Method to create target group
     
@@ -27,7 +36,7 @@ def createTargetGroup(targetGroupName: str, port: int, healthCheckPath: str, use
         task definition name(str): Name of the target group created
         
     """
-    client = boto3.client('elbv2', region_name= region)
+    client = clientRegistry.getClient('elbv2', region)
     try:
         response = client.create_target_group(
             Name = targetGroupName,
@@ -67,6 +76,8 @@ def createTargetGroup(targetGroupName: str, port: int, healthCheckPath: str, use
         
         targetGroupARN =  response['TargetGroups'][0]['TargetGroupArn']
         targetGroupName = response['TargetGroups'][0]['TargetGroupName']
+        if not setDeregistrationDelay(targetGroupARN, region):
+            return False
         return targetGroupARN, targetGroupName
     
         
@@ -75,6 +86,34 @@ def createTargetGroup(targetGroupName: str, port: int, healthCheckPath: str, use
         return False
 
 
+# Method to set the deregistration delay of target group, used for new target groups and ones created before it was set
+def setDeregistrationDelay(targetGroupARN: str, region: str):
+    """_summary_
+
+    Args:
+        targetGroupARN (str): ARN of target group
+        region (str): Region of the target group
+
+    Returns:
+        _type_: If deregistration delay was set
+    """
+    client = clientRegistry.getClient('elbv2', region)
+    try:
+        client.modify_target_group_attributes(
+            TargetGroupArn = targetGroupARN,
+            Attributes = [
+                {
+                    'Key': 'deregistration_delay.timeout_seconds',
+                    'Value': str(deregistrationDelaySeconds)
+                },
+            ]
+        )
+        return True
+    except Exception as e:
+        print(str(e))
+        return False
+
+
 # Method to get ARN of target group
 def getTargetGroupARN(targetGroupName: str, region: str):
     """_summary_
@@ -82,7 +121,7 @@ def getTargetGroupARN(targetGroupName: str, region: str):
     Args:
         targetGroupName (str): Name of the target group
     """
-    client = boto3.client('elbv2', region_name= region)
+    client = clientRegistry.getClient('elbv2', region)
     try:
         response = client.describe_target_groups(
         Names=[targetGroupName]
@@ -94,14 +133,62 @@ def getTargetGroupARN(targetGroupName: str, region: str):
         return False
     
 
+# Method to check if target group still exists, used to verify target group ARN recorded earlier
+def checkIfTargetGroupExists(targetGroupARN: str, region: str):
+    """_summary_
+
+    Args:
+        targetGroupARN (str): ARN of target group
+        region (str): Region of the target group
+
+    Returns:
+        _type_: If target group exists
+    """
+    client = clientRegistry.getClient('elbv2', region)
+    try:
+        response = client.describe_target_groups(TargetGroupArns = [targetGroupARN])
+        return len(response['TargetGroups']) == 1
+    except Exception as e:
+        print(str(e))
+        return False
+
+
+# Method to wait till all targets of target group are deregistered
+def waitForTargetsDeregistered(targetGroupARN: str, region: str, timeout: int = deregistrationTimeout):
+    """_summary_
+
+    Args:
+        targetGroupARN (str): ARN of target group
+        region (str): Region of the target group
+        timeout (int): Seconds to wait
+
+    Returns:
+        _type_: If target group has no registered targets left
+    """
+    client = clientRegistry.getClient('elbv2', region)
+
+    # target_deregistered waiter of boto3 never succeeds on a target group without targets hence it is polled here.
+    # Targets stay listed while they are draining and unused ones are still registered, so only an empty list is done
+    def checkDeregistered():
+        response = client.describe_target_health(TargetGroupArn = targetGroupARN)
+        return len(response['TargetHealthDescriptions']) == 0
+
+    try:
+        return waiter.pollUntil(checkDeregistered, timeout, baseDelay=2, maxDelay=15, description='targets of {} to be deregistered'.format(targetGroupARN))
+    except Exception as e:
+        print(str(e))
+        return False
+
+
 # Method to delete target group    
+@tracing.traced()
 def deleteTargetGroup(targetGroupARN: str, region: str):
     """_summary_
 
     Args:
         targetGroupARN (str): ARN of target group
     """
-    client = boto3.client('elbv2', region_name= region)
+    client = clientRegistry.getClient('elbv2', region)
     try:
         deleteTargetGroupResponse = client.delete_target_group(
             TargetGroupArn = targetGroupARN
@@ -1,7 +1,13 @@
 #!/usr/bin/env python3
 
-import boto3
+from clientRegistry import clientRegistry
 import logging
+import os
+import json
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+
+from tracing import tracing
 
 
 # Logger configuration
@@ -9,11 +15,19 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
-#client = boto3.client('ecs', region_name= region)
-            
+# Tag in which hash of the task definition content is stored
+contentHashTagKey = 'cloud-dev-content-hash'
 
-# Method to create task definition    
-def createTaskDefinition(ecsTaskDefinitionName: str, containerName: str, dockerImage: str, appName: str, containerPort: int, userEmail: str, secretName: str, awsAccountId: str, iamRoleNameForEcsTasks: str, iamExecutionRoleName: str, elasticSearchEndpointForLogs: str, elastciUserName: str, elasticPassowrd: str, region: str):
+# Number of latest revisions kept when old revisions are cleaned up on update
+keepTaskDefinitionRevisions = int(os.environ.get('CLOUD_DEV_KEEP_TASK_DEFINITION_REVISIONS', '3'))
+
+# Revisions de-registered at the same time and deleted per delete_task_definitions call
+maxGCWorkers = 8
+maxTaskDefinitionsPerDelete = 10
+
+
+# Method to build register_task_definition request for the app and its log router
+def buildTaskDefinitionRequest(ecsTaskDefinitionName: str, containerName: str, dockerImage: str, appName: str, containerPort: int, userEmail: str, secretName: str, awsAccountId: str, iamRoleNameForEcsTasks: str, iamExecutionRoleName: str, elasticSearchEndpointForLogs: str, elastciUserName: str, elasticPassowrd: str, region: str, imageTag: str = 'latest', secretKeys: list = None, secretARN: str = None):
     """_summary_
 
     Args:
@@ -31,108 +45,209 @@ def createTaskDefinition(ecsTaskDefinitionName: str, containerName: str, dockerI
         elastciUserName (str): UserName of the elastic
         elasticPassowrd (str): Password of the elastic
         region (str): Region in which firelens will be used for logs 
+        imageTag (str): Tag of the docker image to be deployed
+        secretKeys (list): Keys of the secret injected by ECS as environment variables, secret is only passed by name when not given
+        secretARN (str): Full ARN of the secret, needed when secretKeys are given
 
     Returns:
-        _type_: _description_
+        _type_: Keyword arguments for register_task_definition
     """
-    client = boto3.client('ecs', region_name= region)
-    dockerImage = dockerImage + ':latest'
-    try:
-        response = client.register_task_definition(
-            family = ecsTaskDefinitionName,
-            taskRoleArn = 'arn:aws:iam::' + awsAccountId + ':role/' + iamRoleNameForEcsTasks,
-            executionRoleArn = 'arn:aws:iam::' + awsAccountId + ':role/' + iamExecutionRoleName,
-            networkMode = 'awsvpc',
-            cpu ='256',
-            memory ='512',
-            tags = [
-                {
-                    'key': 'pod',
-                    'value': 'cloud-dev'
-                },
-                {
-                    'key': 'Name',
-                    'value': ecsTaskDefinitionName
-                },
-                {
-                    'key': 'userName',
-                    'value': userEmail
-                },
-            ],
-            runtimePlatform = {
-                'cpuArchitecture': 'X86_64',
-                'operatingSystemFamily': 'LINUX'
+    dockerImage = dockerImage + ':' + imageTag
+    # ECS reads every key from the secret before the container starts. Full ARN is needed as a partial one can not be
+    # resolved when the secret name itself ends with a hyphen and six characters, eg: cloud-dev-user-orders
+    containerSecrets = [
+        {
+            'name': secretKey,
+            'valueFrom': secretARN + ':' + secretKey + '::'
+        }
+        for secretKey in sorted(secretKeys or [])
+    ]
+    taskDefinitionRequest = {
+        'family': ecsTaskDefinitionName,
+        'taskRoleArn': 'arn:aws:iam::' + awsAccountId + ':role/' + iamRoleNameForEcsTasks,
+        'executionRoleArn': 'arn:aws:iam::' + awsAccountId + ':role/' + iamExecutionRoleName,
+        'networkMode': 'awsvpc',
+        'cpu': '256',
+        'memory': '512',
+        'tags': [
+            {
+                'key': 'pod',
+                'value': 'cloud-dev'
             },
-            requiresCompatibilities = [
-                'FARGATE'
-            ],
-            containerDefinitions = [
-                {
-                    'name': containerName,
-                    'image': dockerImage,
-                    'portMappings': [
-                        {
-                            'containerPort': containerPort,
-                            'protocol': 'tcp'
-                        },
-                    ],
-                    'essential': True,
-                    'environment': [
-                        {
-                            'name': 'ENVIRONMENT_KEY',
-                            'value': secretName
-                        }
-                    ],
-                    'logConfiguration': {
-                        'logDriver': 'awsfirelens',
-                        'options': {                            
-                            'Name': 'es',
-                            'Time_Key': '@timestamp',
-                            'Port': '9200',
-                            'Logstash_Prefix': appName,
-                            'Host': elasticSearchEndpointForLogs,
-                            'Index': appName,
-                            'Logstash_DateFormat': '%Y.%m.%d',
-                            'Logstash_Format': 'true',
-                            'Time_Key_Format': '%Y-%m-%dT%H:%M:%S',
-                            'Type': '_doc',
-                            'HTTP_User': elastciUserName,
-                            'HTTP_Passwd': elasticPassowrd
-                        }
-                    }
-                },
-                # log router container 
-                {
-                    'name': 'log_router',
-                    'image': '906394416424.dkr.ecr.ap-south-1.amazonaws.com/aws-for-fluent-bit:latest',
-                    'essential': True,
-                    'firelensConfiguration': {
-                        'type': 'fluentbit'
+            {
+                'key': 'Name',
+                'value': ecsTaskDefinitionName
+            },
+            {
+                'key': 'userName',
+                'value': userEmail
+            },
+        ],
+        'runtimePlatform': {
+            'cpuArchitecture': 'X86_64',
+            'operatingSystemFamily': 'LINUX'
+        },
+        'requiresCompatibilities': [
+            'FARGATE'
+        ],
+        'containerDefinitions': [
+            {
+                'name': containerName,
+                'image': dockerImage,
+                'portMappings': [
+                    {
+                        'containerPort': containerPort,
+                        'protocol': 'tcp'
                     },
-                    'logConfiguration': {
-                        'logDriver': 'awslogs',
-                        'options':{
-                            "awslogs-group": "firelens-container",
-                            "awslogs-region": "ap-south-1",
-                            "awslogs-create-group": "true",
-                            "awslogs-stream-prefix": "firelens"
-                        }                        
+                ],
+                'essential': True,
+                'environment': [
+                    {
+                        'name': 'ENVIRONMENT_KEY',
+                        'value': secretName
+                    }
+                ],
+                'logConfiguration': {
+                    'logDriver': 'awsfirelens',
+                    'options': {                            
+                        'Name': 'es',
+                        'Time_Key': '@timestamp',
+                        'Port': '9200',
+                        'Logstash_Prefix': appName,
+                        'Host': elasticSearchEndpointForLogs,
+                        'Index': appName,
+                        'Logstash_DateFormat': '%Y.%m.%d',
+                        'Logstash_Format': 'true',
+                        'Time_Key_Format': '%Y-%m-%dT%H:%M:%S',
+                        'Type': '_doc',
+                        'HTTP_User': elastciUserName,
+                        'HTTP_Passwd': elasticPassowrd
                     }
                 }
-                
-            ]
+            },
+            # log router container 
+            {
+                'name': 'log_router',
+                'image': '906394416424.dkr.ecr.ap-south-1.amazonaws.com/aws-for-fluent-bit:latest',
+                'essential': True,
+                'firelensConfiguration': {
+                    'type': 'fluentbit'
+                },
+                'logConfiguration': {
+                    'logDriver': 'awslogs',
+                    'options':{
+                        "awslogs-group": "firelens-container",
+                        "awslogs-region": region,
+                        "awslogs-create-group": "true",
+                        "awslogs-stream-prefix": "firelens"
+                    }                        
+                }
+            }
+            
+        ]
+    }
+    # Left out when not used so that hash of task definitions registered before stays the same
+    if containerSecrets:
+        taskDefinitionRequest['containerDefinitions'][0]['secrets'] = containerSecrets
+    return taskDefinitionRequest
+
+
+# Method to get hash of everything in task definition request except tags
+def getTaskDefinitionHash(taskDefinitionRequest: dict):
+    """_summary_
+
+    Args:
+        taskDefinitionRequest (dict): Request built with buildTaskDefinitionRequest
+
+    Returns:
+        _type_: sha256 hex digest of the canonical JSON of the request
+    """
+    content = {key: value for key, value in taskDefinitionRequest.items() if key != 'tags'}
+    canonicalContent = json.dumps(content, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(canonicalContent.encode('utf-8')).hexdigest()
+
+
+# Method to register task definition with its content hash as tag
+@tracing.traced()
+def registerTaskDefinition(taskDefinitionRequest: dict, region: str):
+    """_summary_
+
+    Args:
+        taskDefinitionRequest (dict): Request built with buildTaskDefinitionRequest
+        region (str): Region of the ecs cluster
+
+    Returns:
+        _type_: task definition arn and name
+    """
+    client = clientRegistry.getClient('ecs', region)
+    contentHash = getTaskDefinitionHash(taskDefinitionRequest)
+    tags = taskDefinitionRequest['tags'] + [{'key': contentHashTagKey, 'value': contentHash}]
+    response = client.register_task_definition(**dict(taskDefinitionRequest, tags=tags))
+    taskDefinitionARN = (response['taskDefinition']['taskDefinitionArn'])
+    taskDefinitionName = taskDefinitionARN.split('/')[1].split(':')[0]
+    return taskDefinitionARN, taskDefinitionName
+
+
+# Method to get latest active revision of task definition with its tags
+@tracing.traced()
+def getLatestTaskDefinition(ecsTaskDefinitionName: str, region: str):
+    """_summary_
+
+    Args:
+        ecsTaskDefinitionName (str): Name of the task definition family
+        region (str): Region of the ecs cluster
+
+    Returns:
+        _type_: task definition arn and tags or None if family has no active revision
+    """
+    client = clientRegistry.getClient('ecs', region)
+    try:
+        response = client.describe_task_definition(
+            taskDefinition = ecsTaskDefinitionName,
+            include = ['TAGS']
         )
-        
-        taskDefinitionARN = (response['taskDefinition']['taskDefinitionArn'])
-        taskDefinitionName = taskDefinitionARN.split('/')[1].split(':')[0]
-        return taskDefinitionARN, taskDefinitionName
+    except client.exceptions.ClientException:
+        return None
+    tags = {tag['key']: tag['value'] for tag in response.get('tags', [])}
+    return response['taskDefinition']['taskDefinitionArn'], tags
+
+
+# Method to create task definition    
+def createTaskDefinition(ecsTaskDefinitionName: str, containerName: str, dockerImage: str, appName: str, containerPort: int, userEmail: str, secretName: str, awsAccountId: str, iamRoleNameForEcsTasks: str, iamExecutionRoleName: str, elasticSearchEndpointForLogs: str, elastciUserName: str, elasticPassowrd: str, region: str, imageTag: str = 'latest', secretKeys: list = None, secretARN: str = None):
+    """_summary_
+
+    Args:
+        ecsTaskDefinitionName (str): Name of the task definition
+        containerName (str): Name of the conatiner
+        dockerImage (str): Docker image 
+        appName (str): Name of the app being deployed 
+        containerPort (int): Port on which container runs
+        userEmail (str): User email to tag it to resources
+        secretName (str): Name of the secret from secret manager to be used for inheriting
+        awsAccountId (str): AWS Account ID
+        iamRoleNameForEcsTasks (str): Name of the IAM role to be used for tasks 
+        iamExecutionRoleName (str): Name of the IAM role for execution 
+        elasticSearchEndpointForLogs (str): Endpoint for pushing logs to elasticsearch 
+        elastciUserName (str): UserName of the elastic
+        elasticPassowrd (str): Password of the elastic
+        region (str): Region in which firelens will be used for logs 
+        imageTag (str): Tag of the docker image to be deployed
+        secretKeys (list): Keys of the secret injected by ECS as environment variables, secret is only passed by name when not given
+        secretARN (str): Full ARN of the secret, needed when secretKeys are given
+
+    Returns:
+        _type_: task definition arn and name
+    """
+    taskDefinitionRequest = buildTaskDefinitionRequest(ecsTaskDefinitionName, containerName, dockerImage, appName, containerPort, userEmail, secretName, awsAccountId, iamRoleNameForEcsTasks, iamExecutionRoleName, elasticSearchEndpointForLogs, elastciUserName, elasticPassowrd, region, imageTag, secretKeys, secretARN)
+    try:
+        return registerTaskDefinition(taskDefinitionRequest, region)
     
     except Exception as e:
         print(str(e))
         return False
 
 # Method to update/create new revision of existing ECS Task definition
-def updateTaskDefinition(ecsTaskDefinitionName: str, containerName: str, dockerImage: str, appName: str, containerPort: int, userEmail: str, secretName: str, awsAccountId: str, iamRoleNameForEcsTasks: str, iamExecutionRoleName: str, elasticSearchEndpointForLogs: str, elastciUserName: str, elasticPassowrd: str, region: str):
+def updateTaskDefinition(ecsTaskDefinitionName: str, containerName: str, dockerImage: str, appName: str, containerPort: int, userEmail: str, secretName: str, awsAccountId: str, iamRoleNameForEcsTasks: str, iamExecutionRoleName: str, elasticSearchEndpointForLogs: str, elastciUserName: str, elasticPassowrd: str, region: str, imageTag: str = 'latest', secretKeys: list = None, secretARN: str = None):
     """_summary_
 
     Args:
@@ -150,140 +265,137 @@ def updateTaskDefinition(ecsTaskDefinitionName: str, containerName: str, dockerI
         elastciUserName (str): UserName of the elastic
         elasticPassowrd (str): Password of the elastic
         region (str): Region in which firelens will be used for logs 
+        imageTag (str): Tag of the docker image to be deployed
+        secretKeys (list): Keys of the secret injected by ECS as environment variables, secret is only passed by name when not given
+        secretARN (str): Full ARN of the secret, needed when secretKeys are given
 
     Returns:
-        task definition arn (str): task definition arn which is created
+        task definition arn (str): task definition arn which is created, or the current one if nothing has changed
     """
-    client = boto3.client('ecs', region_name= region)
-    dockerImage = dockerImage + ':latest'
+    taskDefinitionRequest = buildTaskDefinitionRequest(ecsTaskDefinitionName, containerName, dockerImage, appName, containerPort, userEmail, secretName, awsAccountId, iamRoleNameForEcsTasks, iamExecutionRoleName, elasticSearchEndpointForLogs, elastciUserName, elasticPassowrd, region, imageTag, secretKeys, secretARN)
     try:
-        response = client.register_task_definition(
-            family = ecsTaskDefinitionName,
-            taskRoleArn = 'arn:aws:iam::' + awsAccountId + ':role/' + iamRoleNameForEcsTasks,
-            executionRoleArn = 'arn:aws:iam::' + awsAccountId + ':role/' + iamExecutionRoleName,
-            networkMode = 'awsvpc',
-            cpu ='256',
-            memory ='512',
-            tags = [
-                {
-                    'key': 'pod',
-                    'value': 'cloud-dev'
-                },
-                {
-                    'key': 'Name',
-                    'value': ecsTaskDefinitionName
-                },
-                {
-                    'key': 'userName',
-                    'value': userEmail
-                },
-            ],
-            runtimePlatform = {
-                'cpuArchitecture': 'X86_64',
-                'operatingSystemFamily': 'LINUX'
-            },
-            requiresCompatibilities = [
-                'FARGATE'
-            ],
-            containerDefinitions = [
-                {
-                    'name': containerName,
-                    'image': dockerImage,
-                    'portMappings': [
-                        {
-                            'containerPort': containerPort,
-                            'protocol': 'tcp'
-                        },
-                    ],
-                    'essential': True,
-                    'environment': [
-                        {
-                            'name': 'ENVIRONMENT_KEY',
-                            'value': secretName
-                        }
-                    ],
-                    'logConfiguration': {
-                        'logDriver': 'awsfirelens',
-                        'options': {                            
-                            'Name': 'es',
-                            'Time_Key': '@timestamp',
-                            'Port': '9200',
-                            'Logstash_Prefix': appName,
-                            'Host': elasticSearchEndpointForLogs,
-                            'Index': appName,
-                            'Logstash_DateFormat': '%Y.%m.%d',
-                            'Logstash_Format': 'true',
-                            'Time_Key_Format': '%Y-%m-%dT%H:%M:%S',
-                            'Type': '_doc',
-                            'HTTP_User': elastciUserName,
-                            'HTTP_Passwd': elasticPassowrd
-                        }
-                    }
-                },
-                # log router container 
-                {
-                    'name': 'log_router',
-                    'image': '906394416424.dkr.ecr.ap-south-1.amazonaws.com/aws-for-fluent-bit:latest',
-                    'essential': True,
-                    'firelensConfiguration': {
-                        'type': 'fluentbit'
-                    },
-                    'logConfiguration': {
-                        'logDriver': 'awslogs',
-                        'options':{
-                            "awslogs-group": "firelens-container",
-                            "awslogs-region": region,
-                            "awslogs-create-group": "true",
-                            "awslogs-stream-prefix": "firelens"
-                        }                        
-                    }
-                }
-                
-            ]
-        )
-        
-        taskDefinitionARN = (response['taskDefinition']['taskDefinitionArn'])
-        taskDefinitionName = taskDefinitionARN.split('/')[1].split(':')[0]
-        return taskDefinitionARN, taskDefinitionName
+        # Same content means only the image behind the tag has changed, a new deployment of current revision is enough
+        latestTaskDefinition = getLatestTaskDefinition(ecsTaskDefinitionName, region)
+        if latestTaskDefinition:
+            latestTaskDefinitionARN, latestTags = latestTaskDefinition
+            if latestTags.get(contentHashTagKey) == getTaskDefinitionHash(taskDefinitionRequest):
+                logger.info(" Task definition {} has not changed reusing it".format(latestTaskDefinitionARN))
+                return latestTaskDefinitionARN, ecsTaskDefinitionName
+        return registerTaskDefinition(taskDefinitionRequest, region)
     
     except Exception as e:
         print(str(e))
         return False
 
 
+# Method to deregister single revision of task definition
+def deRegisterTaskDefinitionRevision(taskDefinitionARN: str, region: str):
+    """_summary_
+
+    Args:
+        taskDefinitionARN (str): ARN of task definition revision
+
+    Returns:
+        _type_: If revision was de-registered
+    """
+    client = clientRegistry.getClient('ecs', region)
+    try:
+        client.deregister_task_definition(
+            taskDefinition = taskDefinitionARN
+        )
+        return True
+    except Exception as e:
+        print(str(e))
+        return False
+
+
 # Method to deregister all revisions of task definition
 def deRegisterTaskDefinition(taskDefinitionARNs: list, region: str):
     
     """_summary_
 
     Args:
-        taskDefinitionARN (str): ARN of task definition
+        taskDefinitionARNs (list): ARNs of task definition revisions, all of them are tried even if some fail
+
+    Returns:
+        _type_: If all revisions were de-registered
+    """
+    if not taskDefinitionARNs:
+        return True
+    with ThreadPoolExecutor(max_workers=min(maxGCWorkers, len(taskDefinitionARNs))) as executor:
+        results = list(executor.map(lambda taskDefinitionARN: deRegisterTaskDefinitionRevision(taskDefinitionARN, region), taskDefinitionARNs))
+    return all(results)
+
+
+# Method to delete de-registered revisions of task definition
+@tracing.traced()
+def deleteTaskDefinitions(taskDefinitionARNs: list, region: str):
+    """_summary_
+
+    Args:
+        taskDefinitionARNs (list): ARNs of INACTIVE task definition revisions
+
+    Returns:
+        _type_: If all revisions were deleted
     """
-    client = boto3.client('ecs', region_name= region)
-    for taskDefinitionARN in taskDefinitionARNs:
+    client = clientRegistry.getClient('ecs', region)
+    deleted = True
+    for start in range(0, len(taskDefinitionARNs), maxTaskDefinitionsPerDelete):
         try:
-            deRegisterTaskDefinitionResponse = client.deregister_task_definition(
-                taskDefinition = taskDefinitionARN
+            response = client.delete_task_definitions(
+                taskDefinitions = taskDefinitionARNs[start:start + maxTaskDefinitionsPerDelete]
             )
         except Exception as e:
             print(str(e))
-            return False
-    return True
-        
+            deleted = False
+            continue
+        for failure in response.get('failures', []):
+            logger.error(" Unable to delete {} {}".format(failure.get('arn'), failure.get('reason')))
+            deleted = False
+    return deleted
+
+
+# Method to keep only the last revisions of task definition, older ones are de-registered and deleted
+@tracing.traced()
+def garbageCollectTaskDefinitions(taskDefinitionName: str, region: str, keepLast: int = keepTaskDefinitionRevisions):
+    """_summary_
+
+    Args:
+        taskDefinitionName (str): Name of the task definition family
+        region (str): Region of the ecs cluster
+        keepLast (int): Number of latest active revisions to keep, 0 removes all of them
+
+    Returns:
+        _type_: If all old revisions were removed
+    """
+    try:
+        activeARNs = listTaskDefinitionARNS(taskDefinitionName, region)
+        staleARNs = activeARNs[:max(len(activeARNs) - keepLast, 0)]
+        deRegistered = deRegisterTaskDefinition(staleARNs, region)
+        inactiveARNs = listTaskDefinitionARNS(taskDefinitionName, region, status='INACTIVE')
+    except Exception as e:
+        print(str(e))
+        return False
+    deleted = deleteTaskDefinitions(inactiveARNs, region)
+    logger.info(" Removed {} old revisions of {} keeping last {}".format(len(staleARNs), taskDefinitionName, keepLast))
+    return deRegistered and deleted
+
 
 # Method to get all revisions of a task definition
-def listTaskDefinitionARNS(taskDefinitionName: str, region: str):
+def listTaskDefinitionARNS(taskDefinitionName: str, region: str, status: str = 'ACTIVE'):
     """_summary_
 
     Args:
         taskDefinition (str): Name of the task definition
+        status (str): ACTIVE or INACTIVE revisions
 
     Returns:
-        _type_: _description_
+        _type_: ARNs of all revisions of the family from oldest to latest
     """
-    client = boto3.client('ecs', region_name= region)
-    response = client.list_task_definitions(familyPrefix=taskDefinitionName)
-    task_definition_arns = response['taskDefinitionArns']
+    client = clientRegistry.getClient('ecs', region)
+    paginator = client.get_paginator('list_task_definitions')
+    task_definition_arns = []
+    for page in paginator.paginate(familyPrefix=taskDefinitionName, status=status, sort='ASC'):
+        # familyPrefix also matches longer family names, only exact family is kept
+        task_definition_arns.extend(arn for arn in page['taskDefinitionArns'] if arn.split('/')[-1].rsplit(':', 1)[0] == taskDefinitionName)
     return task_definition_arns
-    
-    
\ No newline at end of file
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+
+import logging
+
+from stepGraph import stepGraph
+from service import ecsService
+from route53 import route53
+from loadBalancer import loadBalancer
+from targetGroup import targetGroup
+from taskDefinition import taskDefinition
+from application import application
+from secretManager import secretManager
+
+
+# Logger configuration
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+# Resources of an environment passed to teardown, resources which are None are skipped
+teardownResourceNames = [
+    'ecsServiceName',
+    'ecsClusterName',
+    'ecsTaskDefinitionName',
+    'hostName',
+    'domainNameOfHostedZone',
+    'HostedZoneId',
+    'loadBalancerDNSEndpoint',
+    'AWSHostedZoneIDForLoadbalancerRegionBasis',
+    'ecrRepoName',
+    'registryId',
+    'secretName',
+    'httpRuleARN',
+    'httpsRuleARN',
+    'targetGroupARN',
+    'region'
+]
+
+
+# Teardown step to delete ecs service, service which is already gone is not an error
+def stepDeleteService(ecsServiceName: str, ecsClusterName: str, region: str):
+    if ecsServiceName is None or not ecsService.checkIfServiceExists(ecsServiceName, ecsClusterName, region):
+        logger.info(" ECS service {} does not exist".format(ecsServiceName))
+        return {'serviceDeleted': False}
+    if not ecsService.deleteEcsService(ecsServiceName, ecsClusterName, region):
+        logger.error(" Unable to delete ECS service {}".format(ecsServiceName))
+        return False
+    logger.info(" ECS service {} deleted ".format(ecsServiceName))
+    return {'serviceDeleted': True}
+
+# Teardown step to wait till deleted service has stopped all its tasks
+def stepWaitServiceInactive(serviceDeleted: bool, ecsServiceName: str, ecsClusterName: str, region: str):
+    if serviceDeleted and not ecsService.waitForServiceInactive(ecsServiceName, ecsClusterName, region):
+        logger.error(" ECS service {} did not become inactive".format(ecsServiceName))
+        return False
+    return {'serviceInactive': True}
+
+# Teardown step to wait till tasks of the service are deregistered from target group
+def stepWaitTargetsDeregistered(serviceInactive: bool, targetGroupARN: str, region: str):
+    if targetGroupARN and not targetGroup.waitForTargetsDeregistered(targetGroupARN, region):
+        logger.error(" Targets are still registered in target group")
+        return False
+    return {'targetsDeregistered': True}
+
+# Teardown step to delete route53 record
+def stepDeleteRouteRecord(hostName: str, domainNameOfHostedZone: str, HostedZoneId: str, loadBalancerDNSEndpoint: str, AWSHostedZoneIDForLoadbalancerRegionBasis: str, region: str):
+    FullDomainName = '{}.{}'.format(hostName, domainNameOfHostedZone)
+    if hostName is None or not route53.checkIfRouteRecordExists(FullDomainName, HostedZoneId, region):
+        logger.info(" No r53 entry {}".format(FullDomainName))
+        return {'routeRecordDeleted': False}
+    if not route53.DeleteR53Entry(hostName, domainNameOfHostedZone, HostedZoneId, loadBalancerDNSEndpoint, AWSHostedZoneIDForLoadbalancerRegionBasis, region):
+        logger.error(" Unable to delete r53 entry {}".format(FullDomainName))
+        return False
+    logger.info(" Deleted r53 entry {}".format(FullDomainName))
+    return {'routeRecordDeleted': True}
+
+# Teardown step to delete ECR repo
+def stepDeleteECRRepo(ecrRepoName: str, registryId: str, region: str):
+    if ecrRepoName is None:
+        return {'ecrRepoDeleted': False}
+    if not application.deleteECRRepo(ecrRepoName, registryId, region):
+        logger.error(" Unable to delete ECR Repo")
+        return False
+    logger.info(" ECR repo deleted")
+    return {'ecrRepoDeleted': True}
+
+# Teardown step to delete secret from secret manager
+def stepDeleteSecret(secretName: str, region: str):
+    if secretName is None:
+        return {'secretDeleted': False}
+    if not secretManager.deleteSecret(secretName, region):
+        logger.error(" Unable to delete secret please check for error")
+        return False
+    logger.info(" Secret {} deleted from secret manager ".format(secretName))
+    return {'secretDeleted': True}
+
+# Teardown step to de-register and delete all revisions of task definition
+def stepDeleteTaskDefinitions(ecsTaskDefinitionName: str, region: str):
+    if ecsTaskDefinitionName is None:
+        return {'taskDefinitionsDeleted': False}
+    if not taskDefinition.garbageCollectTaskDefinitions(ecsTaskDefinitionName, region, keepLast=0):
+        logger.error(" Unable to de-register task definition ")
+        return False
+    logger.info(" Task definition have been de-registered")
+    return {'taskDefinitionsDeleted': True}
+
+# Teardown step to delete http rule from load balancer listener
+def stepDeleteHTTPRule(httpRuleARN: str, region: str):
+    if httpRuleARN is None:
+        return {'httpRuleDeleted': False}
+    if not loadBalancer.deleteHTTPRuleLoadBalancer(httpRuleARN, region):
+        logger.error(" Unable to delete http rule from load balancer")
+        return False
+    logger.info(" Deleted http rule from load balancer")
+    return {'httpRuleDeleted': True}
+
+# Teardown step to delete https rule from load balancer listener
+def stepDeleteHTTPSRule(httpsRuleARN: str, region: str):
+    if httpsRuleARN is None:
+        return {'httpsRuleDeleted': False}
+    if not loadBalancer.deleteHTTPSRuleLoadBalancer(httpsRuleARN, region):
+        logger.error(" Unable to delete https rule from load balancer")
+        return False
+    logger.info(" Deleted https rule from load balancer")
+    return {'httpsRuleDeleted': True}
+
+# Teardown step to delete target group once nothing refers to it
+def stepDeleteTargetGroup(targetGroupARN: str, targetsDeregistered: bool, httpRuleDeleted: bool, httpsRuleDeleted: bool, region: str):
+    if targetGroupARN is None:
+        return {'targetGroupDeleted': False}
+    if not targetGroup.deleteTargetGroup(targetGroupARN, region):
+        logger.error(" Unable to delete target group")
+        return False
+    logger.info(" Target group deleted")
+    return {'targetGroupDeleted': True}
+
+
+# Method to get steps of teardown, only target group waits for other deletes
+def getTeardownSteps():
+    """_summary_
+
+    Returns:
+        _type_: Steps to be run with stepGraph.runSteps
+    """
+    return [
+        stepGraph.step('deleteService', stepDeleteService, ['ecsServiceName', 'ecsClusterName', 'region'], ['serviceDeleted']),
+        stepGraph.step('waitServiceInactive', stepWaitServiceInactive, ['serviceDeleted', 'ecsServiceName', 'ecsClusterName', 'region'], ['serviceInactive']),
+        stepGraph.step('waitTargetsDeregistered', stepWaitTargetsDeregistered, ['serviceInactive', 'targetGroupARN', 'region'], ['targetsDeregistered']),
+        stepGraph.step('deleteRouteRecord', stepDeleteRouteRecord, ['hostName', 'domainNameOfHostedZone', 'HostedZoneId', 'loadBalancerDNSEndpoint', 'AWSHostedZoneIDForLoadbalancerRegionBasis', 'region'], ['routeRecordDeleted']),
+        stepGraph.step('deleteECRRepo', stepDeleteECRRepo, ['ecrRepoName', 'registryId', 'region'], ['ecrRepoDeleted']),
+        stepGraph.step('deleteSecret', stepDeleteSecret, ['secretName', 'region'], ['secretDeleted']),
+        stepGraph.step('deleteTaskDefinitions', stepDeleteTaskDefinitions, ['ecsTaskDefinitionName', 'region'], ['taskDefinitionsDeleted']),
+        stepGraph.step('deleteHTTPRule', stepDeleteHTTPRule, ['httpRuleARN', 'region'], ['httpRuleDeleted']),
+        stepGraph.step('deleteHTTPSRule', stepDeleteHTTPSRule, ['httpsRuleARN', 'region'], ['httpsRuleDeleted']),
+        stepGraph.step('deleteTargetGroup', stepDeleteTargetGroup, ['targetGroupARN', 'targetsDeregistered', 'httpRuleDeleted', 'httpsRuleDeleted', 'region'], ['targetGroupDeleted'])
+    ]
+
+
+# Method to delete all resources of an environment, independent deletes run at the same time
+def runTeardown(resources: dict):
+    """_summary_
+
+    Args:
+        resources (dict): Names and ARNs of the resources, see teardownResourceNames, missing ones are skipped
+
+    Returns:
+        _type_: If every resource was deleted or did not exist
+    """
+    initialOutputs = {name: resources.get(name) for name in teardownResourceNames}
+    # A failed delete does not stop the others, only the steps which depend on it are skipped
+    outputs, failedSteps, skippedSteps = stepGraph.runSteps(getTeardownSteps(), initialOutputs, continueOnFailure=True, graphName='teardown:{}'.format(resources.get('ecsTaskDefinitionName')))
+    if failedSteps:
+        # Resources of the steps which never ran are left behind as well
+        logger.error(" Teardown failed at steps {}, steps not run because of it {}".format(failedSteps, skippedSteps))
+        return False
+    return True
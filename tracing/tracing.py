@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import time
+import logging
+import threading
+import functools
+from contextlib import contextmanager
+
+
+# Logger configuration
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+# Trace of the run is written here when the run ends, CLOUD_DEV_TRACE=false turns tracing off
+traceEnabled = os.environ.get('CLOUD_DEV_TRACE', 'true').lower() == 'true'
+traceDir = os.environ.get('CLOUD_DEV_TRACE_DIR', os.path.expanduser('~/.cache/cloud-dev/traces'))
+
+# Spans of the whole run, times are seconds since the run started
+spans = []
+spansLock = threading.Lock()
+runStartMonotonic = time.monotonic()
+runStartTime = time.time()
+runName = 'run'
+
+# Span open on each thread, used as parent of the spans started inside it
+openSpans = threading.local()
+
+
+# Method to get seconds since the run started
+def now():
+    """_summary_
+
+    Returns:
+        _type_: Seconds since the run started
+    """
+    return time.monotonic() - runStartMonotonic
+
+
+# Method to record a span which was timed by the caller, eg: steps of a docker build
+def recordSpan(name: str, start: float, end: float, category: str = 'call', parent: int = None, error: str = None, **attributes):
+    """_summary_
+
+    Args:
+        name (str): Name of the span
+        start (float): Seconds since the run started when span began, see now()
+        end (float): Seconds since the run started when span ended
+        category (str): Kind of span, eg: step, call, wait
+        parent (int): ID of the enclosing span, default is the span open on the current thread
+        error (str): Error which ended the span
+        attributes: Details shown with the span
+
+    Returns:
+        _type_: ID of the span or None when tracing is off
+    """
+    if not traceEnabled:
+        return None
+    if parent is None:
+        stack = getattr(openSpans, 'stack', [])
+        parent = stack[-1] if stack else None
+    currentThread = threading.current_thread()
+    with spansLock:
+        spanId = len(spans) + 1
+        spans.append({
+            'id': spanId,
+            'name': name,
+            'category': category,
+            'start': start,
+            'end': end,
+            'thread': currentThread.ident,
+            'threadName': currentThread.name,
+            'parent': parent,
+            'error': error,
+            'attributes': attributes
+        })
+    return spanId
+
+
+# Method to get ID of the span open on the current thread
+def currentSpanId():
+    """_summary_
+
+    Returns:
+        _type_: ID of the innermost open span or None
+    """
+    stack = getattr(openSpans, 'stack', [])
+    return stack[-1] if stack else None
+
+
+# Method to time a block of code as a span
+@contextmanager
+def span(name: str, category: str = 'call', **attributes):
+    """_summary_
+
+    Args:
+        name (str): Name of the span
+        category (str): Kind of span, eg: step, call, wait
+        attributes: Details shown with the span, can be added to inside the block
+
+    Returns:
+        _type_: Attributes of the span which can be updated inside the block
+    """
+    if not traceEnabled:
+        yield attributes
+        return
+    stack = getattr(openSpans, 'stack', None)
+    if stack is None:
+        stack = openSpans.stack = []
+    parent = stack[-1] if stack else None
+    # Placeholder id keeps children pointing at this span, the span itself is recorded when it ends
+    with spansLock:
+        spans.append(None)
+        spanId = len(spans)
+    stack.append(spanId)
+    start = now()
+    error = None
+    try:
+        yield attributes
+    except BaseException as e:
+        error = '{}: {}'.format(type(e).__name__, str(e))
+        raise
+    finally:
+        stack.pop()
+        currentThread = threading.current_thread()
+        with spansLock:
+            spans[spanId - 1] = {
+                'id': spanId,
+                'name': name,
+                'category': category,
+                'start': start,
+                'end': now(),
+                'thread': currentThread.ident,
+                'threadName': currentThread.name,
+                'parent': parent,
+                'error': error,
+                'attributes': attributes
+            }
+
+
+# Method to decorate a function so that every call is recorded as a span
+def traced(name: str = None, category: str = 'call'):
+    """_summary_
+
+    Args:
+        name (str): Name of the span, default is module.function
+        category (str): Kind of span, eg: step, call, wait
+
+    Returns:
+        _type_: Decorator
+    """
+    def decorator(func):
+        spanName = name or '{}.{}'.format(func.__module__.split('.')[-1], func.__name__)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(spanName, category):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# Method to get finished spans
+def getSpans():
+    """_summary_
+
+    Returns:
+        _type_: Copy of all the spans which have ended
+    """
+    with spansLock:
+        return [dict(recordedSpan) for recordedSpan in spans if recordedSpan is not None]
+
+
+# Method to get the chain of steps which decided how long a step graph took
+def getCriticalPath(graphId: str, recordedSpans: list = None):
+    """_summary_
+
+    Args:
+        graphId (str): ID of one run of a step graph, as recorded by stepGraph.runSteps
+        recordedSpans (list): Spans to be used, default is all spans of the run
+
+    Returns:
+        _type_: Steps from first to last, each with its duration and time spent waiting for a worker
+    """
+    # Same graph can run many times in a run, eg: teardown of every reaped environment, spans are only linked by ID
+    stepSpans = {
+        recordedSpan['id']: recordedSpan
+        for recordedSpan in (recordedSpans or getSpans())
+        if recordedSpan['category'] == 'step' and recordedSpan['attributes'].get('graphId') == graphId
+    }
+    if not stepSpans:
+        return []
+
+    # Walk back from the step which ended last through the dependency which finished last
+    path = []
+    current = max(stepSpans.values(), key=lambda recordedSpan: recordedSpan['end'])
+    while current is not None:
+        path.append({
+            'name': current['name'],
+            'seconds': round(current['end'] - current['start'], 3),
+            'queuedSeconds': round(current['start'] - current['attributes'].get('readyAt', current['start']), 3)
+        })
+        dependencies = [stepSpans[spanId] for spanId in current['attributes'].get('dependsOnSpans', []) if spanId in stepSpans]
+        current = max(dependencies, key=lambda recordedSpan: recordedSpan['end']) if dependencies else None
+    return list(reversed(path))
+
+
+# Method to convert spans to Chrome trace format, it can be opened in chrome://tracing or Perfetto
+def toChromeTrace(recordedSpans: list):
+    """_summary_
+
+    Args:
+        recordedSpans (list): Spans to be converted
+
+    Returns:
+        _type_: Chrome trace with one complete event per span and the name of every thread
+    """
+    traceEvents = []
+    threadNames = {}
+    for recordedSpan in recordedSpans:
+        threadNames[recordedSpan['thread']] = recordedSpan['threadName']
+        traceEvents.append({
+            'name': recordedSpan['name'],
+            'cat': recordedSpan['category'],
+            'ph': 'X',
+            'ts': int(recordedSpan['start'] * 1000000),
+            'dur': int((recordedSpan['end'] - recordedSpan['start']) * 1000000),
+            'pid': os.getpid(),
+            'tid': recordedSpan['thread'],
+            'args': dict(recordedSpan['attributes'], error=recordedSpan['error']) if recordedSpan['error'] else recordedSpan['attributes']
+        })
+    for thread, threadName in threadNames.items():
+        traceEvents.append({'name': 'thread_name', 'ph': 'M', 'pid': os.getpid(), 'tid': thread, 'args': {'name': threadName}})
+    return {'traceEvents': traceEvents, 'displayTimeUnit': 'ms'}
+
+
+# Method to name the run, used in the names of the trace files
+def startRun(name: str):
+    """_summary_
+
+    Args:
+        name (str): Name of the run, eg: operation being performed
+    """
+    global runName
+    runName = name
+
+
+# Method to write timeline of the run as JSON and Chrome trace and log the critical path
+def writeTrace():
+    """_summary_
+
+    Returns:
+        _type_: Paths of the JSON and Chrome trace files or None if nothing was traced
+    """
+    recordedSpans = getSpans()
+    if not traceEnabled or not recordedSpans:
+        return None
+    graphIds = sorted({recordedSpan['attributes']['graphId'] for recordedSpan in recordedSpans if recordedSpan['category'] == 'step'})
+    criticalPaths = {graphId: getCriticalPath(graphId, recordedSpans) for graphId in graphIds}
+    for graphId, path in criticalPaths.items():
+        logger.info(" Critical path of {}: {}".format(graphId, ' -> '.join('{} {:.1f}s'.format(step['name'], step['seconds']) for step in path)))
+
+    try:
+        os.makedirs(traceDir, exist_ok=True)
+        fileName = '{}-{}-{}'.format(runName, time.strftime('%Y%m%dT%H%M%S', time.localtime(runStartTime)), os.getpid())
+        timelinePath = os.path.join(traceDir, fileName + '.json')
+        chromeTracePath = os.path.join(traceDir, fileName + '.trace.json')
+        with open(timelinePath, 'w') as timelineFile:
+            json.dump({
+                'run': runName,
+                'startedAt': runStartTime,
+                'seconds': now(),
+                'spans': recordedSpans,
+                'criticalPaths': criticalPaths
+            }, timelineFile, indent=2, default=str)
+        with open(chromeTracePath, 'w') as chromeTraceFile:
+            json.dump(toChromeTrace(recordedSpans), chromeTraceFile, default=str)
+    except OSError as e:
+        logger.error(" Unable to write trace {}".format(str(e)))
+        return None
+    logger.info(" Trace written to {} and {}".format(timelinePath, chromeTracePath))
+    return timelinePath, chromeTracePath
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+
+import time
+import random
+import logging
+
+from tracing import tracing
+
+
+# Logger configuration
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+# Method to get delay before next attempt using exponential backoff with jitter
+def getBackoffDelay(attempt: int, baseDelay: float, maxDelay: float):
+    """_summary_
+
+    Args:
+        attempt (int): Number of attempts already made, starting at 0
+        baseDelay (float): Delay in seconds before the first retry
+        maxDelay (float): Upper limit of the delay in seconds
+
+    Returns:
+        _type_: Delay in seconds, between half and full of the exponential delay
+    """
+    delay = min(maxDelay, baseDelay * (2 ** attempt))
+    return random.uniform(delay / 2, delay)
+
+
+# Method to keep calling check until it returns a truthy value or the deadline passes
+def pollUntil(check, timeout: float, baseDelay: float = 2, maxDelay: float = 30, description: str = 'condition'):
+    """_summary_
+
+    Args:
+        check (function): Called without arguments, returns a truthy value when done, raises to stop waiting
+        timeout (float): Seconds after which waiting stops
+        baseDelay (float): Delay in seconds before the first retry
+        maxDelay (float): Upper limit of the delay between attempts
+        description (str): What is being waited for, used in logs
+
+    Returns:
+        _type_: Value returned by check or False if the deadline passed
+    """
+    deadline = time.monotonic() + timeout
+    attempt = 0
+    with tracing.span('wait for {}'.format(description), 'wait') as attributes:
+        while True:
+            attributes['attempts'] = attempt + 1
+            result = check()
+            if result:
+                return result
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                logger.error(" Timed out waiting for {}".format(description))
+                attributes['timedOut'] = True
+                return False
+            delay = min(remaining, getBackoffDelay(attempt, baseDelay, maxDelay))
+            logger.info(" Waiting {:.1f}s for {}".format(delay, description))
+            time.sleep(delay)
+            attempt += 1